@@ -0,0 +1,2 @@
+"""Benchmarks and tools used to measure the performance of the fetcher.
+Not imported by the fetcher itself."""
@@ -0,0 +1,90 @@
+"""Microbenchmark of the JSON codecs in netskope_fetcher.codec.
+
+Measures, for every backend that is installed, the cost per log of
+decoding a full API response page and of encoding the logs back out as
+newline delimited json for the log files. The 'passthrough' row is
+passthrough mode: splitting the raw logs out of the page and joining
+them back up as lines.
+
+Usage:
+    (venv) $ python -m benchmarks.bench_codec [--records 5000] [--repeat 5]
+"""
+
+import argparse
+import json
+import time
+
+from benchmarks.records import make_page
+from netskope_fetcher.codec import available_codecs
+from netskope_fetcher.passthrough import split_response
+
+
+def _best_of(repeat, func):
+    """ Run func 'repeat' times and return the fastest time in seconds """
+
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(records, repeat):
+    """ Benchmark every installed codec.
+
+    Returns
+    ----------
+    list
+        One dict per backend with decode and encode cost per log in
+        microseconds.
+    """
+
+    page = make_page("page", records)
+    body = json.dumps({"status": "success", "msg": "", "data": page}).encode()
+
+    results = []
+    for codec in available_codecs():
+        decode = _best_of(repeat, lambda codec=codec: codec.loads(body))
+        encode = _best_of(repeat, lambda codec=codec: codec.dumps_lines(page))
+        results.append(
+            {
+                "codec": codec.name,
+                "decode_us_per_log": decode / records * 1e6,
+                "encode_us_per_log": encode / records * 1e6,
+            }
+        )
+
+    raw_records = split_response(body)[1]
+    decode = _best_of(repeat, lambda: split_response(body))
+    encode = _best_of(repeat, raw_records.to_lines)
+    results.append(
+        {
+            "codec": "passthrough",
+            "decode_us_per_log": decode / records * 1e6,
+            "encode_us_per_log": encode / records * 1e6,
+        }
+    )
+    return results
+
+
+def main():
+    """ Parse arguments, run the benchmark and print a table """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("{:<12} {:>18} {:>18}".format("codec", "decode us/log", "encode us/log"))
+    for result in run(args.records, args.repeat):
+        print(
+            "{codec:<12} {decode_us_per_log:>18.2f} {encode_us_per_log:>18.2f}".format(
+                **result
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
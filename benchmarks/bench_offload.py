@@ -0,0 +1,105 @@
+"""Finds the page size at which offloading pages to worker processes
+(netskope_fetcher.offload, NETSKOPE_OFFLOAD_WORKERS) starts to pay off.
+
+Runs the end-to-end throughput benchmark (benchmarks.bench_throughput)
+against the local API simulator once per page size with every page
+handled on the event loop, and once with every page handed to the
+worker processes. Reports records/sec and the longest the event loop
+was held up for both, and the smallest page size at which offloading
+was faster. Use that page's size in bytes (printed alongside) as
+NETSKOPE_OFFLOAD_MIN_BYTES.
+
+Offloading only helps when there are spare cores: on a single core
+machine the workers compete with the event loop for the same CPU.
+
+Usage:
+    (venv) $ python -m benchmarks.bench_offload --records 20000 \\
+        --latency 0.02 --page-sizes 250,1000,2500,5000 --workers 4
+"""
+
+import argparse
+import json
+import os
+
+from benchmarks.bench_throughput import add_client_arguments, run
+from benchmarks.simulator import add_arguments
+from benchmarks.records import make_page
+
+
+def page_bytes(page_size):
+    """ Approximate size in bytes of a full response page """
+
+    page = make_page("page", page_size)
+    return len(json.dumps({"status": "success", "msg": "", "data": page}))
+
+
+def main():
+    """ Parse arguments, run the benchmark for every page size and
+        report
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    add_arguments(parser)
+    add_client_arguments(parser)
+    parser.add_argument("--page-sizes", default="250,1000,2500,5000")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", help="save the results to this json file")
+    args = parser.parse_args()
+
+    rows = []
+    for page_size in [int(size) for size in args.page_sizes.split(",")]:
+        row = {"page_size": page_size, "page_bytes": page_bytes(page_size)}
+        for mode, workers in (("loop", 0), ("offload", args.workers)):
+            results = run(
+                argparse.Namespace(
+                    **dict(
+                        vars(args),
+                        page_limit=page_size,
+                        offload_workers=workers,
+                        offload_min_bytes=0,
+                    )
+                )
+            )["results"]
+            row[mode] = {
+                "records_per_sec": results["records_per_sec"],
+                "max_loop_lag_ms": results["max_loop_lag_ms"],
+            }
+        rows.append(row)
+
+    columns = ("page", "bytes", "loop rec/s", "offload rec/s", "speedup")
+    columns += ("loop lag ms", "offload lag")
+    print("{:>9} {:>11} {:>13} {:>13} {:>9} {:>12} {:>12}".format(*columns))
+    crossover = None
+    for row in rows:
+        speedup = row["offload"]["records_per_sec"] / row["loop"]["records_per_sec"]
+        if speedup > 1.0 and crossover is None:
+            crossover = row
+        print(
+            "{:>9} {:>11} {:>13.0f} {:>13.0f} {:>8.2f}x {:>12.1f} {:>12.1f}".format(
+                row["page_size"],
+                row["page_bytes"],
+                row["loop"]["records_per_sec"],
+                row["offload"]["records_per_sec"],
+                speedup,
+                row["loop"]["max_loop_lag_ms"],
+                row["offload"]["max_loop_lag_ms"],
+            )
+        )
+
+    print()
+    if crossover is None:
+        print("Offloading was not faster at any page size.")
+    else:
+        print(
+            "Offloading pays off from {} logs per page ({} bytes).".format(
+                crossover["page_size"], crossover["page_bytes"]
+            )
+        )
+
+    if args.output:
+        with open(args.output, "w") as _f:
+            json.dump({"workers": args.workers, "rows": rows}, _f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""End-to-end throughput benchmark.
+
+Starts the local API simulator (benchmarks.simulator) in its own
+process and pulls down every event and alert type through
+EventClient/AlertClient and NetskopeAsyncBootstrap in streaming mode,
+writing to a temporary directory. Reports records/sec, p50/p99 request
+latency, the longest the event loop was held up, peak RSS and bytes
+written.
+
+Results can be saved as json (--output) and compared against an
+earlier run (--baseline). The exit status is 1 if a metric regressed
+by more than --tolerance.
+
+--memory-check N runs the benchmark again with N times as many records
+and checks that peak memory doesn't grow with them: it should depend on
+the page size and concurrency only. The exit status is 1 if peak RSS
+grew by more than --rss-tolerance.
+
+Usage:
+    (venv) $ python -m benchmarks.bench_throughput --records 50000 \\
+        --latency 0.05 --jitter 0.02 --output results.json
+    (venv) $ python -m benchmarks.bench_throughput --records 50000 \\
+        --latency 0.05 --jitter 0.02 --baseline results.json
+    (venv) $ python -m benchmarks.bench_throughput --records 10000 \\
+        --memory-check 4
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.simulator import add_arguments, serve_in_process, simulator_kwargs
+from netskope_fetcher.alerts import AlertClient
+from netskope_fetcher.bootstrap import NetskopeAsyncBootstrap
+from netskope_fetcher.checkpoint import CheckpointStore
+from netskope_fetcher.events import EventClient
+from netskope_fetcher.offload import PageOffloader
+from netskope_fetcher.scheduler import RequestScheduler
+from netskope_fetcher.token import Token
+from netskope_fetcher.writer import LogWriter
+
+
+# Metric name: True if bigger is better
+METRICS = {
+    "records_per_sec": True,
+    "p50_latency_ms": False,
+    "p99_latency_ms": False,
+    "max_loop_lag_ms": False,
+    "peak_rss_mb": False,
+}
+
+
+class TimingScheduler(RequestScheduler):
+
+    """ RequestScheduler that records how long every fetch took,
+        retries included.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = []
+
+    async def fetch(self, session, url, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().fetch(session, url, params=params, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+async def watch_loop(lags, interval=0.01):
+    """ Record how late each wake-up of a 'interval' second sleep is.
+        The lateness is time the event loop spent busy with something
+        else. Runs until cancelled.
+    """
+
+    loop = asyncio.get_event_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+def percentile(values, fraction):
+    """ Nearest-rank percentile of a list of numbers """
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def directory_size(directory):
+    """ Total size in bytes of the files under directory """
+
+    total = 0
+    for root, _, files in os.walk(directory):
+        for file_ in files:
+            total += os.path.getsize(os.path.join(root, file_))
+    return total
+
+
+async def pull(base_url, start, end, output_dir, args):
+    """ Pull down (start, end] for every type.
+
+    Returns
+    ----------
+    tuple
+        (records received, list of request latencies in seconds,
+        number of types pulled down, list of event loop lags in
+        seconds)
+    """
+
+    scheduler = TimingScheduler()
+    writer = LogWriter(output_dir)
+    offloader = PageOffloader(
+        workers=args.offload_workers, min_bytes=args.offload_min_bytes
+    )
+    checkpoints = None
+    if args.checkpoints:
+        checkpoints = CheckpointStore(os.path.join(output_dir, "checkpoints.json"))
+    kwargs = {
+        "token": Token(auth_token="benchmark"),
+        "start": start,
+        "end": end,
+        "writer": writer,
+        "checkpoints": checkpoints,
+        "window_shards": args.shards,
+        "page_concurrency": args.page_concurrency,
+        "passthrough": args.passthrough,
+        "offloader": offloader if offloader.enabled else None,
+    }
+    clients = [
+        EventClient(url=base_url + "/events", **kwargs),
+        AlertClient(url=base_url + "/alerts", **kwargs),
+    ]
+    for client in clients:
+        # A full page is as big as the simulator serves.
+        client.max_logs = args.page_limit
+
+    lags = []
+    watcher = asyncio.ensure_future(watch_loop(lags))
+    bootstrap = NetskopeAsyncBootstrap(client_list=clients, scheduler=scheduler)
+    try:
+        await bootstrap.run_async_clients(asyncio.get_event_loop())
+        await writer.drain()
+    finally:
+        watcher.cancel()
+        writer.close()
+        offloader.close()
+
+    received = sum(sum(client.log_counts.values()) for client in clients)
+    types = sum(len(client.type_list) for client in clients)
+    return received, scheduler.latencies, types, lags
+
+
+def run(args):
+    """ Run the benchmark once and return the results as a dict """
+
+    start = int(time.time()) - args.span
+    end = start + args.span
+    output_dir = tempfile.mkdtemp(prefix="netskope-bench-")
+    try:
+        with serve_in_process(start_time=start, **simulator_kwargs(args)) as base_url:
+            started = time.perf_counter()
+            loop = asyncio.get_event_loop()
+            received, latencies, types, lags = loop.run_until_complete(
+                pull(base_url, start, end, output_dir, args)
+            )
+            elapsed = time.perf_counter() - started
+        bytes_written = directory_size(output_dir)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return {
+        "config": {
+            key: value
+            for key, value in sorted(vars(args).items())
+            if key not in ("output", "baseline", "tolerance")
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": int(time.time()),
+        },
+        "results": {
+            "records_expected": args.records * types,
+            "records": received,
+            "seconds": elapsed,
+            "records_per_sec": received / elapsed if elapsed else 0.0,
+            "requests": len(latencies),
+            "p50_latency_ms": percentile(latencies, 0.50) * 1000,
+            "p99_latency_ms": percentile(latencies, 0.99) * 1000,
+            "max_loop_lag_ms": max(lags, default=0.0) * 1000,
+            "peak_rss_mb": _peak_rss_mb(),
+            "bytes_written": bytes_written,
+        },
+    }
+
+
+def run_in_process(args):
+    """ Run the benchmark in a process of its own, so its peak RSS
+        isn't that of an earlier run, and return the results.
+    """
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_and_send, args=(args, sender))
+    process.start()
+    sender.close()
+    try:
+        return receiver.recv()
+    except EOFError:
+        raise RuntimeError("The benchmark process died.")
+    finally:
+        process.join()
+
+
+def _run_and_send(args, sender):
+    sender.send(run(args))
+    sender.close()
+
+
+def memory_check(args, results):
+    """ Run the benchmark again with args.memory_check times as many
+        records and compare its peak RSS with that of results.
+
+    Returns
+    ----------
+    tuple
+        (records, peak RSS in MB, relative growth in peak RSS) of the
+        larger run.
+    """
+
+    larger = argparse.Namespace(
+        **dict(vars(args), records=args.records * args.memory_check)
+    )
+    smaller = results["results"]["peak_rss_mb"]
+    peak = run_in_process(larger)["results"]["peak_rss_mb"]
+    return larger.records, peak, (peak - smaller) / smaller
+
+
+def compare(results, baseline, tolerance):
+    """ Compare results against a baseline.
+
+    Returns
+    ----------
+    list
+        (metric, baseline value, current value, relative change,
+        regressed) tuples.
+    """
+
+    rows = []
+    for metric, higher_is_better in METRICS.items():
+        old = baseline["results"].get(metric)
+        new = results["results"].get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        regressed = -change > tolerance if higher_is_better else change > tolerance
+        rows.append((metric, old, new, change, regressed))
+    return rows
+
+
+def _peak_rss_mb():
+    """ Peak resident set size of this process in MB """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    if sys.platform == "darwin":
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def add_client_arguments(parser):
+    """ Add the client settings to an argparse parser """
+
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--page-concurrency", type=int, default=4)
+    parser.add_argument("--checkpoints", action="store_true")
+    parser.add_argument("--passthrough", action="store_true")
+    parser.add_argument("--offload-workers", type=int, default=0)
+    parser.add_argument("--offload-min-bytes", type=int, default=0)
+
+
+def main():
+    """ Parse arguments, run the benchmark and report """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    add_arguments(parser)
+    add_client_arguments(parser)
+    parser.add_argument("--output", help="save the results to this json file")
+    parser.add_argument("--baseline", help="compare against this json file")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    parser.add_argument(
+        "--memory-check",
+        type=int,
+        default=0,
+        metavar="N",
+        help="check peak RSS again with N times as many records",
+    )
+    parser.add_argument("--rss-tolerance", type=float, default=0.50)
+    args = parser.parse_args()
+
+    results = run_in_process(args) if args.memory_check else run(args)
+    for name, value in results["results"].items():
+        print("{:<20} {:>16.2f}".format(name, value))
+
+    regressed = False
+    if args.memory_check:
+        records, peak, growth = memory_check(args, results)
+        worse = growth > args.rss_tolerance
+        regressed = worse
+        print()
+        print(
+            "peak_rss_mb with {} records per type: {:.2f} ({:+.1%}){}".format(
+                records, peak, growth, "  REGRESSED" if worse else ""
+            )
+        )
+
+    if args.output:
+        with open(args.output, "w") as _f:
+            json.dump(results, _f, indent=2)
+
+    if not args.baseline:
+        return 1 if regressed else 0
+
+    with open(args.baseline) as _f:
+        baseline = json.load(_f)
+    print()
+    print("{:<20} {:>12} {:>12} {:>9}".format("metric", "baseline", "current", "change"))
+    for metric, old, new, change, worse in compare(results, baseline, args.tolerance):
+        regressed = regressed or worse
+        print(
+            "{:<20} {:>12.2f} {:>12.2f} {:>+8.1%}{}".format(
+                metric, old, new, change, "  REGRESSED" if worse else ""
+            )
+        )
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
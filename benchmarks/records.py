@@ -0,0 +1,78 @@
+"""Generates synthetic logs shaped like the ones the Netskope API
+returns, for use in benchmarks."""
+
+import random
+
+
+_APPS = ["Box", "Dropbox", "Google Drive", "Microsoft Office 365 OneDrive", "Slack"]
+_ACTIVITIES = ["Browse", "Upload", "Download", "Login Successful", "Share"]
+_BROWSERS = ["Chrome", "Firefox", "Edge", "Safari"]
+
+
+def make_record(type_, index, timestamp, rng=random):
+    """ Return one synthetic log of the given type.
+
+    Parameters
+    ----------
+    type_: str
+        The log 'type'. For example: 'page'
+    index: int
+        Used to build a unique '_id'.
+    timestamp: int
+        Epoch timestamp of the log.
+    rng: random.Random
+        Source of randomness, so runs can be made repeatable.
+    """
+
+    app = rng.choice(_APPS)
+    return {
+        "_id": "{:024x}".format(index * 2654435761 % (16 ** 24)),
+        "type": type_,
+        "timestamp": timestamp,
+        "_insertion_epoch_timestamp": timestamp + rng.randint(1, 120),
+        "user": "user{}@example.com".format(rng.randint(1, 5000)),
+        "userip": "10.{}.{}.{}".format(
+            rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254)
+        ),
+        "srcip": "192.168.{}.{}".format(rng.randint(0, 255), rng.randint(1, 254)),
+        "dstip": "52.{}.{}.{}".format(
+            rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254)
+        ),
+        "app": app,
+        "appcategory": "Cloud Storage",
+        "activity": rng.choice(_ACTIVITIES),
+        "browser": rng.choice(_BROWSERS),
+        "os": "Windows 10",
+        "device": "Windows Device",
+        "site": app,
+        "url": "https://www.{}.com/{}".format(
+            app.lower().replace(" ", ""), rng.randint(1, 10 ** 6)
+        ),
+        "page": "www.{}.com".format(app.lower().replace(" ", "")),
+        "domain": "{}.com".format(app.lower().replace(" ", "")),
+        "ccl": rng.choice(["excellent", "high", "medium", "low"]),
+        "cci": rng.randint(1, 100),
+        "count": 1,
+        "numbytes": rng.randint(100, 10 ** 7),
+        "client_bytes": rng.randint(100, 10 ** 6),
+        "server_bytes": rng.randint(100, 10 ** 6),
+        "traffic_type": "CloudApp",
+        "access_method": "Client",
+        "src_country": "US",
+        "src_location": "Lexington",
+        "dst_country": "US",
+        "organization_unit": "example.com/Users/Lexington",
+        "policy": "Allow All",
+        "acked": "false",
+        "ur_normalized": "user@example.com",
+        "sv": "unknown",
+    }
+
+
+def make_page(type_, count, start_time=1500000000, seed=0):
+    """ Return a list of 'count' synthetic logs, one per second from
+        start_time onwards.
+    """
+
+    rng = random.Random(seed)
+    return [make_record(type_, n, start_time + n, rng) for n in range(count)]
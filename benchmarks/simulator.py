@@ -0,0 +1,327 @@
+"""Local stand-in for the Netskope /api/v1/events and /api/v1/alerts
+endpoints, for benchmarks and end-to-end tests.
+
+Every type has a configurable number of logs spread evenly over a time
+range. Requests honor 'starttime', 'endtime' (as (starttime, endtime]),
+'skip' and 'limit' like the real API. Latency, jitter and injected
+429s, 5xx responses and HTML error pages can be configured so the
+fetcher's throttling and retry paths are exercised too.
+
+Logs are built from a small pool of pre-encoded synthetic logs (see
+benchmarks.records) with a unique '_id' and 'timestamp' spliced in, so
+the simulator costs the client as little CPU as possible. For
+throughput numbers, run it in its own process (serve_in_process).
+
+Usage:
+    (venv) $ python -m benchmarks.simulator --port 8080 --records 100000
+"""
+
+from contextlib import contextmanager
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import time
+
+from aiohttp import web
+
+from benchmarks.records import make_page
+
+
+_POOL_SIZE = 1000
+
+_HTML_ERROR = (
+    b"<html><head><title>503 Service Unavailable</title></head>"
+    b"<body>Service Unavailable</body></html>"
+)
+
+
+class NetskopeSimulator:
+
+    """ aiohttp application that serves synthetic logs.
+
+    Attributes
+    ----------
+    records: int
+        Logs per type, unless overridden in 'counts'.
+    counts: dict
+        Logs per type, keyed by 'endpoint/type' (ex: 'event/page').
+    start_time: int
+        Logs are spread evenly over (start_time, start_time + span].
+    span: int
+        Seconds covered by the logs.
+    page_limit: int
+        Most logs returned by one request, whatever 'limit' asks for.
+    latency: float
+        Seconds each response is delayed by.
+    jitter: float
+        Up to this many extra seconds are added to the latency at
+        random.
+    rate_429: float
+        Fraction of requests answered with a 429 (and Retry-After).
+    rate_5xx: float
+        Fraction of requests answered with a 502.
+    rate_html: float
+        Fraction of requests answered with an HTML error page and a
+        200 status, like a misbehaving proxy.
+    retry_after: float
+        Retry-After sent with the 429s. None to leave it out.
+    stats: dict
+        Counters of requests, logs served and injected errors.
+    """
+
+    def __init__(self, **kwargs):
+        self.records = kwargs.get("records", 10000)
+        self.counts = kwargs.get("counts") or {}
+        self.start_time = kwargs.get("start_time") or int(time.time()) - 600
+        self.span = kwargs.get("span") or 600
+        self.page_limit = kwargs.get("page_limit") or 5000
+        self.latency = kwargs.get("latency", 0.0)
+        self.jitter = kwargs.get("jitter", 0.0)
+        self.rate_429 = kwargs.get("rate_429", 0.0)
+        self.rate_5xx = kwargs.get("rate_5xx", 0.0)
+        self.rate_html = kwargs.get("rate_html", 0.0)
+        self.retry_after = kwargs.get("retry_after")
+        self.stats = {
+            "requests": 0,
+            "logs": 0,
+            "throttled": 0,
+            "server_errors": 0,
+            "html_errors": 0,
+        }
+        self._rng = random.Random(kwargs.get("seed", 0))
+        self._pools = {}
+        self._runner = None
+
+    def app(self):
+        """ Return the aiohttp web.Application """
+
+        app = web.Application()
+        app.router.add_get("/api/v1/events", self._events)
+        app.router.add_get("/api/v1/alerts", self._alerts)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """ Start serving in the running event loop.
+
+        Returns
+        ----------
+        str
+            Base URL, ex: http://127.0.0.1:8080/api/v1
+        """
+
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return "http://{}:{}/api/v1".format(host, port)
+
+    async def stop(self):
+        """ Stop serving """
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def count(self, endpoint_type, type_):
+        """ Number of logs the type has in total """
+
+        return self.counts.get("{}/{}".format(endpoint_type, type_), self.records)
+
+    def timestamp(self, endpoint_type, type_, index):
+        """ Timestamp of the index'th log of the type """
+
+        count = self.count(endpoint_type, type_)
+        return self.start_time + 1 + index * self.span // max(count, 1)
+
+    async def _events(self, request):
+        return await self._respond(request, "event")
+
+    async def _alerts(self, request):
+        return await self._respond(request, "alert")
+
+    async def _respond(self, request, endpoint_type):
+        """ Serve one page, or an injected error """
+
+        self.stats["requests"] += 1
+        delay = self.latency + self._rng.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        roll = self._rng.random()
+        if roll < self.rate_429:
+            self.stats["throttled"] += 1
+            headers = {}
+            if self.retry_after is not None:
+                headers["Retry-After"] = str(self.retry_after)
+            return web.Response(status=429, text="Too Many Requests", headers=headers)
+        roll -= self.rate_429
+        if roll < self.rate_5xx:
+            self.stats["server_errors"] += 1
+            return web.Response(status=502, text="Bad Gateway")
+        roll -= self.rate_5xx
+        if roll < self.rate_html:
+            self.stats["html_errors"] += 1
+            return web.Response(body=_HTML_ERROR, content_type="text/html")
+
+        query = request.query
+        try:
+            type_ = query["type"]
+            start, end = int(query["starttime"]), int(query["endtime"])
+            skip = int(query.get("skip", 0))
+            limit = min(int(query.get("limit", self.page_limit)), self.page_limit)
+        except (KeyError, ValueError):
+            return _json_response(
+                {"status": "error", "errors": ["Invalid request parameters"]}
+            )
+
+        first = self._first_after(endpoint_type, type_, start)
+        last = self._first_after(endpoint_type, type_, end)
+        indexes = range(first + skip, min(first + skip + limit, last))
+        self.stats["logs"] += len(indexes)
+
+        data = b", ".join(self._record(endpoint_type, type_, n) for n in indexes)
+        return web.Response(
+            body=b'{"status": "success", "msg": "", "data": [' + data + b"]}",
+            content_type="application/json",
+        )
+
+    def _first_after(self, endpoint_type, type_, moment):
+        """ Index of the first log with a timestamp after moment """
+
+        low, high = 0, self.count(endpoint_type, type_)
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(endpoint_type, type_, middle) <= moment:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _record(self, endpoint_type, type_, index):
+        """ Raw json bytes of the index'th log of the type """
+
+        key = "{}/{}".format(endpoint_type, type_)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = _encoded_pool(type_)
+        return b'{"_id": "%s-%d", "timestamp": %d, %s' % (
+            key.encode(),
+            index,
+            self.timestamp(endpoint_type, type_, index),
+            pool[index % len(pool)],
+        )
+
+
+def _encoded_pool(type_):
+    """ Pre-encoded synthetic logs without their leading '{' and their
+        '_id' and 'timestamp' fields.
+    """
+
+    pool = []
+    for record in make_page(type_, _POOL_SIZE):
+        del record["_id"], record["timestamp"]
+        pool.append(json.dumps(record).encode()[1:])
+    return pool
+
+
+def _json_response(body):
+    return web.Response(body=json.dumps(body).encode(), content_type="application/json")
+
+
+def _free_port():
+    """ Ask the OS for a free TCP port """
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve(port, kwargs):
+    """ Entry point of the simulator process """
+
+    web.run_app(
+        NetskopeSimulator(**kwargs).app(),
+        host="127.0.0.1",
+        port=port,
+        print=None,
+        access_log=None,
+    )
+
+
+@contextmanager
+def serve_in_process(**kwargs):
+    """ Run a NetskopeSimulator in its own process so it doesn't compete
+        with the client for CPU. Yields the base URL.
+    """
+
+    port = _free_port()
+    process = multiprocessing.Process(target=_serve, args=(port, kwargs), daemon=True)
+    process.start()
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or not process.is_alive():
+                    raise RuntimeError("The simulator did not start.")
+                time.sleep(0.05)
+        yield "http://127.0.0.1:{}/api/v1".format(port)
+    finally:
+        process.terminate()
+        process.join()
+
+
+def add_arguments(parser):
+    """ Add the simulator settings to an argparse parser """
+
+    parser.add_argument("--records", type=int, default=10000, help="logs per type")
+    parser.add_argument("--span", type=int, default=600)
+    parser.add_argument("--page-limit", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--rate-html", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=None)
+
+
+def simulator_kwargs(args):
+    """ NetskopeSimulator keyword arguments from parsed arguments """
+
+    return {
+        "records": args.records,
+        "span": args.span,
+        "page_limit": args.page_limit,
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "rate_429": args.rate_429,
+        "rate_5xx": args.rate_5xx,
+        "rate_html": args.rate_html,
+        "retry_after": args.retry_after,
+    }
+
+
+def main():
+    """ Serve until interrupted """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    print(
+        "Serving http://127.0.0.1:{}/api/v1/events and /api/v1/alerts".format(
+            args.port
+        )
+    )
+    _serve(args.port, simulator_kwargs(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""Defines the Backfill class which pulls down a historical range of
+logs (ex: the last month) in many chunks at once, next to the normal
+incremental runs.
+
+The range is cut into chunks of 'chunk_seconds' and up to 'parallel'
+chunks are pulled down at once, every type of each chunk concurrently,
+so nothing ever has to hold (or paginate through) the whole range.
+
+A backfill has its own output directory and its own CheckpointStore
+(the progress store), which records the windows committed per type. It
+never reads or writes time.log or the incremental run's checkpoints, so
+the two can run side by side. An interrupted backfill resumes where it
+left off: run it again with the same range and only the windows that
+weren't committed are pulled down.
+
+Progress (share of the range committed across every type) and an ETA
+are logged every 'progress_interval' seconds.
+"""
+
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import signal
+import time
+
+from netskope_fetcher.config import env_float, env_int
+from netskope_fetcher.connection import create_session
+
+
+class Backfill:
+
+    """ Pulls down (start, end] in parallel chunks.
+
+    Attributes
+    ----------
+    run_window: coroutine function
+        Called as run_window(session, start, end). Pulls down and
+        writes every log in (start, end] and returns True once all of
+        it has been committed to 'progress'.
+    start: int
+        Epoch start of the range.
+    end: int
+        Epoch end of the range.
+    progress: netskope_fetcher.checkpoint.CheckpointStore
+        Windows committed so far, per type.
+    types: list
+        (endpoint_type, type_) of every type pulled down, to measure
+        progress with.
+    chunk_seconds: int
+        Width of a chunk.
+    parallel: int
+        Chunks pulled down at once.
+    retries: int
+        How many more times a failed chunk is tried before the backfill
+        gives up on it (until the next run).
+    progress_interval: float
+        Seconds between progress reports.
+    name: str
+        Used in the progress reports (ex: the tenant).
+    """
+
+    def __init__(self, run_window, start, end, progress, types, **kwargs):
+        if end <= start:
+            raise ValueError("The backfill must end after it starts.")
+        self.run_window = run_window
+        self.start = start
+        self.end = end
+        self.progress = progress
+        self.types = list(types)
+        self.chunk_seconds = kwargs.get("chunk_seconds") or env_int(
+            "NETSKOPE_BACKFILL_CHUNK_SECONDS", 3600
+        )
+        self.parallel = kwargs.get("parallel") or env_int(
+            "NETSKOPE_BACKFILL_PARALLEL", 8
+        )
+        self.retries = kwargs.get("retries")
+        if self.retries is None:
+            self.retries = env_int("NETSKOPE_BACKFILL_RETRIES", 2)
+        self.progress_interval = kwargs.get("progress_interval") or env_float(
+            "NETSKOPE_BACKFILL_PROGRESS_INTERVAL", 30.0
+        )
+        self.name = kwargs.get("name") or "Backfill"
+        self.http_settings = kwargs.get("http_settings")
+        self._started = None
+        self._done_at_start = None
+        self._stopping = None
+
+    def chunks(self):
+        """ (start, end] of every chunk of the range, oldest first """
+
+        chunks = []
+        cursor = self.start
+        while cursor < self.end:
+            chunks.append((cursor, min(cursor + self.chunk_seconds, self.end)))
+            cursor += self.chunk_seconds
+        return chunks
+
+    def pending_chunks(self):
+        """ Chunks that still have an uncommitted window for any type """
+
+        return [
+            (start, end)
+            for start, end in self.chunks()
+            if any(
+                self.progress.pending_windows(endpoint_type, type_, start, end)
+                for endpoint_type, type_ in self.types
+            )
+        ]
+
+    def done_seconds(self):
+        """ Seconds of the range committed, added up over every type """
+
+        total = (self.end - self.start) * len(self.types)
+        pending = sum(
+            end - start
+            for endpoint_type, type_ in self.types
+            for start, end in self.progress.pending_windows(
+                endpoint_type, type_, self.start, self.end
+            )
+        )
+        return total - pending
+
+    def report(self):
+        """ Progress line: share of the range committed and an ETA based
+            on how fast this run has gone so far.
+        """
+
+        total = (self.end - self.start) * len(self.types)
+        done = self.done_seconds()
+        share = 100.0 * done / total if total else 100.0
+        line = "{}: {:.1f}% done, {} of {} chunks left".format(
+            self.name, share, len(self.pending_chunks()), len(self.chunks())
+        )
+        elapsed = time.monotonic() - (self._started or time.monotonic())
+        sped = done - (self._done_at_start or 0)
+        if 0 < done < total and sped > 0 and elapsed > 0:
+            eta = timedelta(seconds=int((total - done) * elapsed / sped))
+            line += ", ETA {}".format(eta)
+        return line
+
+    def stop(self):
+        """ Stop starting chunks. Chunks in flight finish. """
+
+        self._stop_event().set()
+
+    def run(self):
+        """ Start the event loop and pull the range down, stopping after
+            the chunks in flight on SIGTERM or SIGINT.
+
+        Returns
+        ----------
+        bool
+            True if the whole range is committed.
+        """
+
+        return run_backfills([self], self.http_settings)
+
+    async def run_async(self, session=None):
+        """ Pull down every pending chunk, up to 'parallel' at once.
+            Returns True if the whole range is committed.
+        """
+
+        if session is None:
+            async with create_session(self.http_settings) as session:
+                return await self.run_async(session)
+
+        self._started = time.monotonic()
+        self._done_at_start = self.done_seconds()
+        queue = asyncio.Queue()
+        for chunk in self.pending_chunks():
+            queue.put_nowait((chunk, 0))
+        logging.info(
+            "%s of %s to %s: %s of %s chunks to pull down.",
+            self.name,
+            _format_time(self.start),
+            _format_time(self.end),
+            queue.qsize(),
+            len(self.chunks()),
+        )
+
+        reporter = asyncio.ensure_future(self._report_every())
+        workers = [
+            asyncio.ensure_future(self._work(session, queue))
+            for _ in range(min(self.parallel, queue.qsize()))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+        logging.info(self.report())
+        return not self.pending_chunks()
+
+    async def _work(self, session, queue):
+        """ Pull chunks off the queue until it's empty. Failed chunks go
+            to the back of the queue until they run out of retries.
+        """
+
+        while not queue.empty() and not self._stop_event().is_set():
+            (start, end), attempt = queue.get_nowait()
+            try:
+                committed = await self.run_window(session, start, end)
+            except asyncio.CancelledError:
+                raise
+            except Exception as _e:  # pylint: disable=broad-except
+                logging.exception("Exception Occurred: %s.", _e)
+                committed = False
+            if committed:
+                continue
+            if attempt < self.retries:
+                queue.put_nowait(((start, end), attempt + 1))
+            else:
+                logging.error(
+                    "%s: giving up on %s to %s until the next run.",
+                    self.name,
+                    _format_time(start),
+                    _format_time(end),
+                )
+
+    async def _report_every(self):
+        """ Log the progress every progress_interval seconds """
+
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            logging.info(self.report())
+
+    def _stop_event(self):
+        """ The asyncio.Event set by stop(). Created on first use so it
+            belongs to the running loop.
+        """
+
+        if self._stopping is None:
+            self._stopping = asyncio.Event()
+        return self._stopping
+
+
+def run_backfills(backfills, http_settings=None):
+    """ Run the backfills (one per tenant) on one event loop and session
+        until they're done or SIGTERM or SIGINT stops them.
+
+    Returns
+    ----------
+    bool
+        True if every range is committed.
+    """
+
+    def stop():
+        for backfill in backfills:
+            backfill.stop()
+
+    async def run_all():
+        async with create_session(http_settings) as session:
+            return await asyncio.gather(
+                *[backfill.run_async(session) for backfill in backfills]
+            )
+
+    loop = asyncio.get_event_loop()
+    for signal_ in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_, stop)
+    try:
+        return all(loop.run_until_complete(run_all()))
+    finally:
+        for signal_ in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(signal_)
+
+
+def parse_time(text):
+    """ Epoch time from an epoch number or an ISO 8601 date/time (UTC
+        unless it has an offset). Ex: 1790812800, 2026-10-01 or
+        2026-10-01T12:00.
+    """
+
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(
+            "Expected an epoch time or an ISO 8601 date. Got: {}".format(text)
+        )
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def _format_time(timestamp):
+    """ Readable UTC time for log messages """
+
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M")
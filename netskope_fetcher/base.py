@@ -10,6 +10,14 @@ import os
 
 from aiohttp.client_exceptions import ContentTypeError
 
+from netskope_fetcher.codec import get_codec
+from netskope_fetcher.config import env_bool, env_int, env_list
+from netskope_fetcher.metrics import METRICS
+from netskope_fetcher.paging import configured_page_size
+from netskope_fetcher.passthrough import RawRecords, extract_field, split_response
+from netskope_fetcher.profiling import TIMERS
+from netskope_fetcher.scheduler import RequestScheduler
+
 
 def _status_check(json_, type_, status_code, pagination):
     """ Check to see if response is valid or un-expected """
@@ -32,6 +40,47 @@ def _status_check(json_, type_, status_code, pagination):
     return True
 
 
+def _newest_timestamp(log_list):
+    """ Newest 'timestamp' in a page of logs, or None if it has none """
+
+    if not log_list:
+        return None
+    if isinstance(log_list, RawRecords):
+        # Pulling the timestamp out of every raw log would cost about
+        # as much as decoding it. Look at both ends instead.
+        timestamps = [
+            extract_field(log_list[0], "timestamp"),
+            extract_field(log_list[-1], "timestamp"),
+        ]
+    else:
+        timestamps = [log.get("timestamp") for log in log_list]
+    return max(
+        (
+            stamp
+            for stamp in timestamps
+            if isinstance(stamp, (int, float)) and not isinstance(stamp, bool)
+        ),
+        default=None,
+    )
+
+
+def split_window(start, end, parts):
+    """ Split the (start, end] epoch range into 'parts' contiguous
+        sub-windows of (nearly) equal width.
+
+    Returns
+    ----------
+    list
+        List of (start, end) tuples. Fewer than 'parts' are returned
+        if the range is too narrow to split that many times.
+    """
+
+    parts = max(1, min(parts, end - start))
+    bounds = [start + (end - start) * part // parts for part in range(parts)]
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
 class BaseNetskopeClient:
 
     """ Base class for Netskope clients.
@@ -64,7 +113,67 @@ class BaseNetskopeClient:
     session: aiohttp.ClientSession object
         Used for non-blocking HTTP requests
     max_logs: int
-        The maximum amount of logs before pagination must be performed.
+        Default page size, sent as 'limit' (NETSKOPE_PAGE_SIZE). Set
+        per endpoint and type in the environment, see
+        netskope_fetcher.paging.
+    page_tuner: netskope_fetcher.paging.PageTuner object
+        If set, picks the page size of each request from the responses
+        so far, starting at the configured size.
+    page_concurrency: int
+        How many requests for a single type may be in flight at once.
+    window_shards: int
+        How many equal sub-windows [start, end] is split into before
+        any requests are made.
+    min_window: int
+        Sub-windows narrower than this (in seconds) are paginated with
+        'skip' instead of being split further. At least 1, since a
+        one second window can't be split.
+    split_depth: int
+        Sub-windows whose first page shows they hold more than this
+        many pages are split instead of being paginated with 'skip'.
+    writer: netskope_fetcher.writer.LogWriter object
+        If set, the client runs in streaming mode: each page of logs is
+        handed to the writer as soon as it arrives instead of being
+        kept in log_dictionary.
+    scheduler: netskope_fetcher.scheduler.RequestScheduler object
+        Owns the in-flight request budget, throttling and retries.
+        NetskopeAsyncBootstrap shares one between all of its clients.
+    http_settings: netskope_fetcher.connection.HttpSettings object
+        Per-request connect/read timeouts for this endpoint.
+    codec: netskope_fetcher.codec.JsonCodec object
+        Used to decode the API responses.
+    passthrough: bool
+        (Streaming mode only) Keep logs as the raw json bytes the API
+        sent instead of decoding them into dicts and encoding them
+        again for the log files.
+    passthrough_types: list
+        Types passthrough applies to. Empty for every type.
+    checkpoints: netskope_fetcher.checkpoint.CheckpointStore object
+        If set (streaming mode only), each sub-window is staged and
+        committed to the log file and the checkpoints together, and
+        windows committed by an earlier run are skipped.
+    filters: netskope_fetcher.filters.FieldFilters object
+        If set, each type's logs are trimmed down to the wanted fields
+        and records (NETSKOPE_FILTERS_FILE) before they are delivered.
+    dedup: netskope_fetcher.dedup.Deduplicator object
+        If set, logs that were already written are dropped before they
+        are delivered.
+    metrics: netskope_fetcher.metrics.NetskopeMetrics object
+        Request, page and record metrics are kept here. The process
+        wide METRICS by default.
+    timers: netskope_fetcher.profiling.PhaseTimers object
+        Time spent fetching and decoding is added up here. The process
+        wide TIMERS by default.
+    offloader: netskope_fetcher.offload.PageOffloader object
+        (Streaming mode only) If set, big pages are decoded and encoded
+        again in a worker process instead of on the event loop.
+    tenant: str
+        Name of the tenant the logs belong to, when several are pulled
+        down at once. Requests wait for a slot in the shared scheduler
+        in turn with the other tenants'.
+    log_counts: dict
+        Dictionary with log types as keys and the number of logs
+        received so far as values. Kept in both modes.
     """
 
     def __init__(self, **kwargs):
@@ -74,10 +183,43 @@ class BaseNetskopeClient:
             self.end - int(os.environ["NETSKOPE_DEFAULT_INTERVAL"])
         )
         self.type_list = []
+        self.endpoint_type = None
         self.log_dictionary = {}
         self.session = kwargs.get("session")
         self.url = kwargs.get("url")
-        self.max_logs = 5000  # TODO - move this to config file
+        self.max_logs = kwargs.get("max_logs") or env_int("NETSKOPE_PAGE_SIZE", 5000)
+        self.page_tuner = kwargs.get("page_tuner")
+        self.page_concurrency = kwargs.get("page_concurrency") or env_int(
+            "NETSKOPE_PAGE_CONCURRENCY", 4
+        )
+        self.window_shards = kwargs.get("window_shards") or env_int(
+            "NETSKOPE_WINDOW_SHARDS", 1
+        )
+        self.min_window = max(
+            1, kwargs.get("min_window") or env_int("NETSKOPE_MIN_WINDOW", 60)
+        )
+        self.split_depth = max(
+            1, kwargs.get("split_depth") or env_int("NETSKOPE_SPLIT_DEPTH", 8)
+        )
+        self.writer = kwargs.get("writer")
+        self.checkpoints = kwargs.get("checkpoints")
+        self.scheduler = kwargs.get("scheduler") or RequestScheduler()
+        self.http_settings = kwargs.get("http_settings")
+        self.codec = kwargs.get("codec") or get_codec()
+        self.passthrough = kwargs.get("passthrough")
+        if self.passthrough is None:
+            self.passthrough = env_bool("NETSKOPE_PASSTHROUGH")
+        self.passthrough_types = kwargs.get("passthrough_types") or env_list(
+            "NETSKOPE_PASSTHROUGH_TYPES"
+        )
+        self.filters = kwargs.get("filters")
+        self.dedup = kwargs.get("dedup")
+        self.metrics = kwargs.get("metrics") or METRICS
+        self.timers = kwargs.get("timers") or TIMERS
+        self.offloader = kwargs.get("offloader")
+        self.tenant = kwargs.get("tenant")
+        self.log_counts = {}
+        self._semaphores = {}
 
     async def get_logs(self, session, loop):
         """ This function serves as the entry point into the
@@ -103,11 +245,11 @@ class BaseNetskopeClient:
         """
 
         tasks = [self._async_worker(session, type_) for type_ in self.type_list]
-        await asyncio.gather(*tasks, loop=loop)
+        await asyncio.gather(*tasks)
 
     async def _async_worker(self, session, event_type):
-        """ Setups up the request parameters and calls the API
-            communication function.
+        """ Splits the run interval into sub-windows and pulls each of
+            them down concurrently.
 
         Parameters
         ----------
@@ -117,22 +259,247 @@ class BaseNetskopeClient:
             The type of event. For example:  'application' or 'page'
         """
 
-        params = {
-            "token": self.token.auth_token,
-            "type": event_type,
-            "starttime": self.start,
-            "endtime": self.end,
-        }
-        await self._api_call_2(session, params)
+        consumed_before = self.log_counts.get(event_type, 0)
+        suppressed_before = self._suppressed(event_type)
+        self._semaphores[event_type] = asyncio.Semaphore(self.page_concurrency)
+
+        tasks = []
+        for pending_start, pending_end in self.pending_windows(event_type):
+            for start, end in split_window(
+                pending_start, pending_end, self.window_shards
+            ):
+                params = {
+                    "token": self.token.auth_token,
+                    "type": event_type,
+                    "starttime": start,
+                    "endtime": end,
+                }
+                tasks.append(self._api_call_2(session, params))
+        await asyncio.gather(*tasks)
+
+        # We now know the total count of the logs we pulled down for
+        # this type.
+        length = str(self.log_counts.get(event_type, 0) - consumed_before)
+        logging.info("Consumed %s logs for type: %s", length, event_type)
+        suppressed = self._suppressed(event_type) - suppressed_before
+        if suppressed:
+            logging.info(
+                "Suppressed %s duplicate logs for type: %s", suppressed, event_type
+            )
+
+    async def _api_call_2(self, session, _params):
+        """ Pulls down every log for one type within the starttime and
+            endtime of _params.
+
+            The first page is requested on its own. If it comes back
+            full and shows that the window holds more than
+            self.split_depth pages (see _window_parts), the window is
+            split and the sub-windows are pulled down concurrently (and
+            split again if they're still too busy). Otherwise the first
+            page is kept and the following 'skip' offsets are requested
+            self.page_concurrency at a time until a short (or failed)
+            page shows that there is nothing left to grab. A page size
+            the API hasn't sent a full page for yet (see
+            netskope_fetcher.paging) is only asked for one page at a
+            time.
+
+        Parameters
+        ----------
+        session: aiohttp.ClientSession object
+            Used for non-blocking HTTP requests
+        _params: dict
+            Dictonary that contains parameters to be passed in the
+            query string of the API call.
+        """
+
+        type_ = _params["type"]
+        start, end = _params["starttime"], _params["endtime"]
+
+        limit = self.page_size(type_)
+        stage = None
+        async with self._semaphore(type_):
+            json_ = await self._request_page(session, _params, limit=limit)
+            if json_ is None:
+                return
+
+            # Did we hit our log limit in the response and need to go
+            # grab more?  (Also tests if data was returned or not)
+            need_more = bool(self._api_has_more_logs_to_grab(json_, type_, limit))
+            received = json_.get("received", len(json_.get("data") or []))
+            parts = 1
+            if need_more:
+                parts = self._window_parts(json_.get("data") or [], start, end)
+
+            if parts == 1:
+                # With checkpoints, the window's logs are staged until
+                # every page has been pulled down and then committed all
+                # at once.
+                if self.checkpoints is not None:
+                    stage = self.writer.open_stage(
+                        self.endpoint_type, type_, start, end
+                    )
+
+                # Either hand the page off to the writer or keep it for
+                # write_logs.
+                await self._deliver_page(
+                    type_, json_.get("data") or [], stage, json_.get("received")
+                )
+            # Don't hold on to the page while the rest of the window is
+            # pulled down.
+            json_ = None
+
+        if parts > 1:
+            # Throw away the full page and shard the window instead.
+            # Netskope treats the range as (starttime, endtime], so the
+            # sub-windows don't overlap.
+            logging.info(
+                "Window %s-%s for type %s has too many events to paginate. "
+                "Splitting it in %s.",
+                start,
+                end,
+                type_,
+                parts,
+            )
+            await asyncio.gather(
+                *[
+                    self._api_call_2(
+                        session, dict(_params, starttime=sub_start, endtime=sub_end)
+                    )
+                    for sub_start, sub_end in split_window(start, end, parts)
+                ]
+            )
+            return
+
+        complete = True
+        pagination = 1
+        # The page size may change between batches, so keep track of
+        # how far into the window the pages so far have reached.
+        offset = received
+        need_more = need_more or not self._last_page(type_, limit, received)
+        while need_more:
+            limit = self.page_size(type_)
+            if not self._page_size_served(type_, limit):
+                # A short page at this size may just be capped by the
+                # API, so ask for it alone and move on by what came back.
+                received = await self._fetch_page(
+                    session,
+                    _params,
+                    pagination=pagination,
+                    skip=offset,
+                    stage=stage,
+                    limit=limit,
+                    count=True,
+                )
+                complete = received is not None
+                need_more = complete and (
+                    received >= limit or not self._last_page(type_, limit, received)
+                )
+                pagination += 1
+                offset += received or 0
+                continue
+            results = await asyncio.gather(
+                *[
+                    self._fetch_page(
+                        session,
+                        _params,
+                        pagination=pagination + index,
+                        skip=offset + index * limit,
+                        stage=stage,
+                        limit=limit,
+                    )
+                    for index in range(self.page_concurrency)
+                ]
+            )
+            # Every page in the batch has to be full for there to be
+            # anything left past the end of it.
+            need_more = all(results)
+            complete = None not in results
+            pagination += self.page_concurrency
+            offset += self.page_concurrency * limit
+
+        self.metrics.pagination_depth.observe(
+            *self._metric_labels(type_), value=pagination
+        )
 
-    async def _api_call_2(self, session, _params, pagination=0, skip=0):
-        """ Pulls down logs from the Netskope API endpoint.
+        if stage is None:
+            return
+        if complete:
+            await self.writer.commit_stage(stage, self.checkpoints)
+            if self.dedup is not None:
+                self.dedup.commit(stage)
+        else:
+            logging.error(
+                "Window %s-%s for type %s was not committed. "
+                "It will be pulled down again on the next run.",
+                start,
+                end,
+                type_,
+            )
+            await self.writer.discard_stage(stage)
+            if self.dedup is not None:
+                self.dedup.discard(stage)
+
+    async def _fetch_page(
+        self,
+        session,
+        _params,
+        pagination=0,
+        skip=0,
+        stage=None,
+        limit=None,
+        count=False,
+    ):
+        """ Pulls down a single page of logs and delivers it.
 
-            Uses non-blocking HTTP requests to pull down the logs from
-            the API endpoint. Once the response is received, validate
-            the response and save data to self.log_dictionary.
+        Parameters
+        ----------
+        session: aiohttp.ClientSession object
+            Used for non-blocking HTTP requests
+        _params: dict
+            Dictonary that contains parameters to be passed in the
+            query string of the API call.
+        pagination: int
+            Keeps track of which page of logs is in scope.
+        skip: int
+            Skip logs up until this number. Used in pagination.
+        stage: netskope_fetcher.writer.WindowStage
+            Staging file for the window when checkpoints are enabled.
+        limit: int
+            Page size to ask for. The type's current page size if None.
+        count: bool
+            Return how many logs the API sent instead.
+
+        Returns
+        ----------
+        bool or None
+            True: The page was full and there may be more logs to grab.
+            False: The page was short or empty.
+            None: The request failed.
+        """
+
+        type_ = _params["type"]
+        limit = limit or self.page_size(type_)
+        async with self._semaphore(type_):
+            json_ = await self._request_page(
+                session, _params, pagination, skip, limit
+            )
+            if json_ is None:
+                return None
+
+            need_more = bool(self._api_has_more_logs_to_grab(json_, type_, limit))
+            received = json_.get("received", len(json_.get("data") or []))
+            await self._deliver_page(
+                type_, json_.get("data") or [], stage, json_.get("received")
+            )
+        return received if count else need_more
+
+    async def _request_page(self, session, _params, pagination=0, skip=0, limit=None):
+        """ Pulls down a single page of logs from the Netskope API
+            endpoint and validates the response.
 
-            Performs pagination if necessary.
+            Every request goes through the shared RequestScheduler.
+            Callers hold the type's semaphore (see _semaphore) until
+            the page has been handed off.
 
         Parameters
         ----------
@@ -142,61 +509,128 @@ class BaseNetskopeClient:
             Dictonary that contains parameters to be passed in the
             query string of the API call.
         pagination: int
-            Keeps track of which iteration of pagination is in scope.
+            Keeps track of which page of logs is in scope.
         skip: int
             Skip logs up until this number. Used in pagination.
+        limit: int
+            Page size to ask for. The type's current page size if None.
+
+        Returns
+        ----------
+        dict or None
+            The response json, or None if the response wasn't valid.
         """
 
         type_ = _params["type"]
-        need_recursion = False
+        limit = limit or self.page_size(type_)
 
-        # If this is a recursive call to pull down more logs for a
+        # If this is a pagination call to pull down more logs for a
         # particular type, then make sure the logs reflect it.
-        self._log_api_call_context(type_, pagination)
+        self._log_api_call_context(type_, pagination, limit)
 
-        # If skip is defined, then this is a second pass at pulling
-        # down logs that couldn't be grabbed in the original call.
-        # Add the skip value to the parameters so netskope will not
-        # return logs we have already received.
+        # Add the page size, and skip if it's defined so netskope will
+        # not return logs we have already received, to a copy of the
+        # parameters. Pages are requested concurrently so they can't
+        # share a dict.
+        params = dict(_params, limit=limit)
         if skip:
-            _params["skip"] = skip
+            params["skip"] = skip
 
-        # Start async session to pull down logs.
-        async with session.get(self.url, params=_params) as resp:
+        try:
+            with self.timers.time(self.endpoint_type, type_, "fetch"):
+                resp = await self.scheduler.fetch(
+                    session,
+                    self.url,
+                    params=params,
+                    share=self.tenant,
+                    flow="{}/{}".format(self.endpoint_type, type_),
+                    **self._request_kwargs()
+                )
+        except Exception:
+            self.metrics.requests.inc(*self._metric_labels(type_), "error")
+            if self.page_tuner is not None:
+                self.page_tuner.failed(self.endpoint_type, type_, limit)
+            raise
+        self._observe_response(type_, resp)
+        if self._use_passthrough(type_):
+            handler = self._handle_passthrough_response
+        elif self._use_offload(resp):
+            handler = self._handle_offloaded_response
+        else:
+            handler = self._handle_response
+        with self.timers.time(self.endpoint_type, type_, "decode"):
+            status_code, json_ = await handler(_params=params, _type=type_, _resp=resp)
+
+        # Check to make sure status was 200 or 'success'
+        if not _status_check(json_, type_, status_code, pagination):
+            if self.page_tuner is not None:
+                self.page_tuner.failed(self.endpoint_type, type_, limit)
+            return None
+        if self.page_tuner is not None:
+            body = getattr(resp, "body", None)
+            self.page_tuner.observe(
+                self.endpoint_type,
+                type_,
+                limit,
+                json_.get("received", len(json_.get("data") or [])),
+                latency=getattr(resp, "latency", 0.0),
+                size=len(body) if body is not None else 0,
+                retries=getattr(resp, "attempts", 1) - 1,
+            )
+        return json_
 
-            status_code, json_ = await self._handle_response(
-                _params=_params, _type=type_, _resp=resp
+    async def _handle_passthrough_response(self, _params=None, _type=None, _resp=None):
+        """ Like _handle_response, but leaves the logs as raw json bytes
+            (netskope_fetcher.passthrough.RawRecords) instead of decoding
+            them. Only the 'status' of the response is decoded.
+
+            Anything that isn't a successful json response is handed to
+            _handle_response so errors are reported the same way.
+        """
+
+        body = await _resp.read()
+        try:
+            status, records = split_response(body)
+        except ValueError:
+            return await self._handle_response(
+                _params=_params, _type=_type, _resp=_resp
             )
 
-            # Check to make sure status was 200 or 'success'
-            if not _status_check(json_, type_, status_code, pagination):
-                return
+        if _resp.status != 200 or status != "success" or records is None:
+            return await self._handle_response(
+                _params=_params, _type=_type, _resp=_resp
+            )
+        return _resp.status, {"status": status, "data": records}
 
-            # Did we hit our log limit in the response and need to go
-            # grab more?  (Also tests if data was returned or not)
-            if self._api_has_more_logs_to_grab(json_, type_):
-                need_recursion = True
-
-            # Initializing an empty list enables us to just use one
-            # '+=' line to add initial logs or supplemental logs
-            # (logs we had to go back and get due to the log
-            # limit in the response)
-            self._prep_type_if_no_logs_already_present(type_)
-
-            # And since we have the former function, we can do this.
-            # It covers both first and recursive calls.
-            self.log_dictionary[type_] += json_["data"]
-
-            # If we need to, pull down supplemental logs.
-            if need_recursion:
-                await self._get_remaining_logs(type_, session, _params, pagination)
-
-            # If this is NOT a supplemental request for logs, we can
-            # now know the total count of the logs we pulled down for
-            # this type.
-            if not skip:
-                length = str(len(self.log_dictionary[type_]))
-                logging.info("Consumed %s logs for type: %s", length, type_)
+    async def _handle_offloaded_response(self, _params=None, _type=None, _resp=None):
+        """ Like _handle_response, but the body is decoded, its logs
+            filtered and encoded again in a worker process
+            (self.offloader). The logs come back as raw json bytes
+            (netskope_fetcher.passthrough.RawRecords), and the number of
+            logs the API sent as 'received'.
+
+            Anything that isn't a successful json response is handed to
+            _handle_response so errors are reported the same way.
+        """
+
+        body = await _resp.read()
+        content_type = _resp.headers.get("Content-Type", "").lower()
+        if _resp.status != 200 or "application/json" not in content_type:
+            return await self._handle_response(
+                _params=_params, _type=_type, _resp=_resp
+            )
+
+        spec = None
+        if self.filters is not None:
+            spec = self.filters.spec(self.endpoint_type, _type)
+        status, records, received = await self.offloader.encode_page(
+            body, self.codec, spec
+        )
+        if status != "success" or records is None:
+            return await self._handle_response(
+                _params=_params, _type=_type, _resp=_resp
+            )
+        return _resp.status, {"status": status, "data": records, "received": received}
 
     async def _handle_response(
         self, _params=None, _type=None, _resp=None, test_error_output=False
@@ -221,7 +655,7 @@ class BaseNetskopeClient:
         status_code = _resp.status
 
         try:
-            json_ = await _resp.json()
+            json_ = await _resp.json(loads=self.codec.loads)
 
         except ContentTypeError:
             text = await _resp.text()
@@ -259,16 +693,122 @@ class BaseNetskopeClient:
         else:
             return status_code, json_
 
-    async def _get_remaining_logs(self, type_, session, _params, pagination):
-        """ Make another call to pull down the remaining logs for the
-            current type.
+    def _use_passthrough(self, type_):
+        """ Should this type's logs be kept as raw json bytes? Only in
+            streaming mode, since write_logs expects dicts, and not if
+            the type has a filter, since that needs the logs decoded.
+        """
+
+        if not self.passthrough or self.writer is None:
+            return False
+        if self._filter(type_) is not None:
+            return False
+        return not self.passthrough_types or type_ in self.passthrough_types
+
+    def _use_offload(self, resp):
+        """ Should this response be handed to a worker process? Only in
+            streaming mode, and only if it is big enough to pay for the
+            trip.
+        """
+
+        if self.offloader is None or self.writer is None:
+            return False
+        body = getattr(resp, "body", None)
+        return body is not None and self.offloader.wants(body)
+
+    def _request_kwargs(self):
+        """ Extra keyword arguments for session.get. Carries the
+            per-endpoint timeouts when http_settings is set.
+        """
+
+        if self.http_settings is None:
+            return {}
+        return {"timeout": self.http_settings.timeout()}
+
+    def _semaphore(self, type_):
+        """ The type's semaphore. It is held from a page's request until
+            the page has been handed off, so no more than
+            self.page_concurrency requests of the type are in flight and
+            no more pages than that are held waiting on the writer,
+            however many sub-windows there are.
+        """
+
+        semaphore = self._semaphores.get(type_)
+        if semaphore is None:
+            semaphore = self._semaphores[type_] = asyncio.Semaphore(
+                self.page_concurrency
+            )
+        return semaphore
+
+    def _window_parts(self, log_list, start, end):
+        """ How many sub-windows to split (start, end] into after its
+            first page, log_list, came back full. 1 keeps the window
+            whole: the first page is used and the rest is paginated
+            with 'skip'.
+
+            Pages come oldest first, so the window is taken to hold
+            about (end - start) / (newest - start) pages, where newest
+            is the newest timestamp in the first page. Only a window
+            that holds more than self.split_depth pages is split, into
+            enough sub-windows to bring each within it (but none
+            narrower than self.min_window). A page without timestamps
+            to go by splits the window in half.
+        """
+
+        width = end - start
+        # A one second window would come back from split_window as is.
+        if width <= self.min_window or width < 2:
+            return 1
+        newest = _newest_timestamp(log_list)
+        if newest is None or newest <= start:
+            return 2
+        pages = -(-width // (min(newest, end) - start))
+        if pages <= self.split_depth:
+            return 1
+        parts = -(-pages // self.split_depth)
+        return int(min(parts, max(2, width // self.min_window)))
+
+    def page_size(self, type_):
+        """ Page size ('limit') for the type's next request: the tuned
+            size with a page_tuner, else the configured size.
         """
 
-        next_skip = len(self.log_dictionary[type_])
-        pagination += 1
-        await self._api_call_2(session, _params, pagination=pagination, skip=next_skip)
+        size = configured_page_size(self.endpoint_type, type_, self.max_logs)
+        if self.page_tuner is None:
+            return size
+        return self.page_tuner.size(self.endpoint_type, type_, size)
 
-    def _api_has_more_logs_to_grab(self, json_, type_):
+    def _page_size_served(self, type_, limit):
+        """ Has the API sent a full page of this size for the type? Always
+            taken to be so for the configured size.
+        """
+
+        if self.page_tuner is None:
+            return True
+        return self.page_tuner.served(self.endpoint_type, type_, limit)
+
+    def _last_page(self, type_, limit, received):
+        """ Is a short page the last one of the window? See
+            netskope_fetcher.paging.PageTuner.last_page.
+        """
+
+        if self.page_tuner is None:
+            return True
+        return self.page_tuner.last_page(self.endpoint_type, type_, limit, received)
+
+    def pending_windows(self, type_):
+        """ Return the (start, end) windows of this run that still
+            need to be pulled down for the type. Without checkpoints
+            that is always the whole run interval.
+        """
+
+        if self.checkpoints is None:
+            return [(self.start, self.end)]
+        return self.checkpoints.pending_windows(
+            self.endpoint_type, type_, self.start, self.end
+        )
+
+    def _api_has_more_logs_to_grab(self, json_, type_, limit=None):
         """ Two purposes:
                 1. Check to see if we need to make further
                    calls to acquire all the logs available for the
@@ -279,6 +819,8 @@ class BaseNetskopeClient:
         ----------
         json_: dict
             Dictionary of the response from Netskope API
+        limit: int
+            Page size the request asked for. max_logs if None.
 
         Returns
         ----------
@@ -289,9 +831,109 @@ class BaseNetskopeClient:
         """
 
         try:
-            return len(json_["data"]) >= self.max_logs
+            received = len(json_["data"])
         except KeyError:
             logging.error("Missing 'data' key in response for %s", type_)
+            return None
+        # A page filtered in a worker process was full if the API sent
+        # a full page, however many logs were left.
+        return json_.get("received", received) >= (limit or self.max_logs)
+
+    async def _deliver_page(self, type_, log_list, stage=None, received=None):
+        """ Hand a page of logs to the window's staging file or the
+            writer in streaming mode, or add it to self.log_dictionary
+            otherwise.
+
+        Parameters
+        ----------
+        type_: str
+            Represents the 'type' of the log
+        log_list: list
+            The 'data' list from the Netskope API response.
+        stage: netskope_fetcher.writer.WindowStage
+            Staging file for the window when checkpoints are enabled.
+        received: int
+            Set if log_list was already filtered (in a worker process):
+            the number of logs the API sent.
+        """
+
+        if received is None:
+            received = len(log_list)
+            filter_ = self._filter(type_)
+            if filter_ is not None:
+                log_list = filter_(log_list)
+        self.log_counts[type_] = self.log_counts.get(type_, 0) + received
+        self._observe_page(type_, log_list, received)
+        if self.dedup is not None:
+            log_list = self.dedup.filter_page(
+                self.endpoint_type, type_, log_list, stage
+            )
+
+        if stage is not None:
+            await stage.write_page(log_list)
+            return
+
+        if self.writer is not None:
+            await self.writer.write_page(self.endpoint_type, type_, log_list)
+            return
+
+        # Initializing an empty list enables us to just use one
+        # '+=' line to add initial logs or supplemental logs
+        # (logs we had to go back and get due to the log
+        # limit in the response)
+        self._prep_type_if_no_logs_already_present(type_)
+        self.log_dictionary[type_] += log_list
+
+    def _metric_labels(self, type_):
+        """ Tenant, endpoint and type labels of the type's metrics """
+
+        return (self.tenant or "", self.endpoint_type, type_)
+
+    def _observe_response(self, type_, resp):
+        """ Count a response and its retries and time it """
+
+        labels = self._metric_labels(type_)
+        self.metrics.requests.inc(*labels, str(resp.status))
+        self.metrics.retries.inc(*labels, amount=getattr(resp, "attempts", 1) - 1)
+        self.metrics.request_latency.observe(
+            *labels, value=getattr(resp, "latency", 0.0)
+        )
+        body = getattr(resp, "body", None)
+        if body is not None:
+            self.metrics.response_bytes.inc(*labels, amount=len(body))
+        if getattr(resp, "hedged", False):
+            self.metrics.hedges.inc(*labels)
+        if getattr(resp, "hedge_won", False):
+            self.metrics.hedges_won.inc(*labels)
+
+    def _observe_page(self, type_, log_list, received=None):
+        """ Count a page, its logs and the logs filtered out of it, and
+            work out how far behind the newest log in it is.
+        """
+
+        labels = self._metric_labels(type_)
+        received = len(log_list) if received is None else received
+        self.metrics.pages.inc(*labels)
+        self.metrics.records.inc(*labels, amount=received)
+        if received > len(log_list):
+            self.metrics.filtered.inc(*labels, amount=received - len(log_list))
+        newest = _newest_timestamp(log_list)
+        if newest is not None:
+            self.metrics.observe_newest(*labels, timestamp=newest)
+
+    def _filter(self, type_):
+        """ The type's compiled filter, or None """
+
+        if self.filters is None:
+            return None
+        return self.filters.get(self.endpoint_type, type_)
+
+    def _suppressed(self, type_):
+        """ Duplicates of the type dropped so far """
+
+        if self.dedup is None:
+            return 0
+        return self.dedup.suppressed.get("{}/{}".format(self.endpoint_type, type_), 0)
 
     def _prep_type_if_no_logs_already_present(self, type_):
         """ Initialize a list for the current type """
@@ -299,7 +941,7 @@ class BaseNetskopeClient:
         if type_ not in self.log_dictionary.keys():
             self.log_dictionary[type_] = []
 
-    def _log_api_call_context(self, type_, pagination):
+    def _log_api_call_context(self, type_, pagination, limit=None):
         """ If this is a recursive call to pull down more logs for a
             particular type, then make sure the logs reflect it. We can
             tell if this is a second+ call to the API for a type by
@@ -313,6 +955,8 @@ class BaseNetskopeClient:
             0 if this is not a secondary call to Netskope to pull down
             more logs due to limit of the original call. >0 if this is
             a secondary call to gather all logs available.
+        limit: int
+            Page size of the call.
         """
 
         if pagination:
@@ -320,7 +964,7 @@ class BaseNetskopeClient:
                 "Async API with event type %s has more than %s"
                 " events. Now making pagination request number %s",
                 type_,
-                self.max_logs,
+                limit or self.max_logs,
                 str(pagination),
             )
         else:
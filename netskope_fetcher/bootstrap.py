@@ -5,7 +5,9 @@ the async operation of the script.
 
 
 import asyncio
-import aiohttp
+
+from netskope_fetcher.connection import create_session
+from netskope_fetcher.scheduler import RequestScheduler
 
 
 class NetskopeAsyncBootstrap:
@@ -13,15 +15,29 @@ class NetskopeAsyncBootstrap:
         netskope API.
     """
 
-    def __init__(self, client_list):
+    def __init__(self, client_list, scheduler=None, session=None, http_settings=None):
         """
         Parameters
         ----------
         client_list: list
             List of netskope_fetcher.base.BaseNetskopeClient children
+        scheduler: netskope_fetcher.scheduler.RequestScheduler
+            Shared by every client so there is one global budget of
+            in-flight requests. A new one is created if not given.
+        session: aiohttp.ClientSession
+            An existing session (and its pool of open connections) to
+            reuse. It is left open once the clients are done. If not
+            given, a session is created for the run and closed after.
+        http_settings: netskope_fetcher.connection.HttpSettings
+            Connection pool settings used when creating a session.
         """
 
         self.client_list = client_list
+        self.session = session
+        self.http_settings = http_settings
+        self.scheduler = scheduler or RequestScheduler()
+        for client in self.client_list:
+            client.scheduler = self.scheduler
 
     def run(self):
         """ Sets up the asyncio event loop and then starts it.
@@ -35,15 +51,25 @@ class NetskopeAsyncBootstrap:
         loop.run_until_complete(self.run_async_clients(loop))
 
     async def run_async_clients(self, loop):
-        """ Sets up client session to be used by all aiohttp calls.
+        """ Sets up client session to be used by all aiohttp calls
+            (unless one was handed to us).
 
             Gets a list of the coroutines for each client which will be
             added to the event loop (passes them the current loop and
             the session) then awaits all of them.
         """
 
-        async with aiohttp.ClientSession(loop=loop) as session:
-            # Clients are children of
-            # netskope_fetcher.base.BaseNetskopeClient
-            tasks = [client.get_logs(session, loop) for client in self.client_list]
-            await asyncio.gather(*tasks, loop=loop)
+        if self.session is not None:
+            await self._gather_clients(self.session, loop)
+            return
+
+        async with create_session(self.http_settings) as session:
+            await self._gather_clients(session, loop)
+
+    async def _gather_clients(self, session, loop):
+        """ Run every client's get_logs coroutine on the session """
+
+        # Clients are children of
+        # netskope_fetcher.base.BaseNetskopeClient
+        tasks = [client.get_logs(session, loop) for client in self.client_list]
+        await asyncio.gather(*tasks)
@@ -0,0 +1,187 @@
+"""Defines the CheckpointStore class which records, per endpoint and
+per log type, which sub-windows of time have been pulled down and
+committed to the log files.
+
+A restart only has to pull down the windows that are missing for each
+type instead of the whole interval for every type.
+"""
+
+import json
+import logging
+import os
+import threading
+
+
+class CheckpointStore:
+
+    """ Durable record of committed windows and log file sizes.
+
+        The state is kept in a json file which is rewritten atomically
+        (write to a temporary file, fsync, rename) on every commit:
+        {
+            'windows': {
+                'event/page': [[start, end], ...],
+            },
+            'offsets': {
+                'logs/event/page.log': <size in bytes after last commit>,
+            },
+        }
+
+        Windows follow Netskope's (starttime, endtime] semantics and
+        adjacent windows are merged as they're committed.
+
+        Changes are made under a lock, so they can be made from the
+        writer's threads, off the event loop, while the loop reads the
+        state. The lock isn't held while the file is written, so reads
+        don't wait for an fsync.
+
+    Attributes
+    ----------
+    file_path: str
+        Path to the checkpoint json file.
+    state: dict
+        The in-memory copy of the checkpoint file.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.state = self._load()
+        self._lock = threading.RLock()
+        # Serializes saves, so a save never overwrites a newer one.
+        self._save_lock = threading.Lock()
+
+    def pending_windows(self, endpoint_type, type_, start, end):
+        """ Return the parts of (start, end] that haven't been committed
+            for the endpoint and type.
+
+        Returns
+        ----------
+        list
+            List of (start, end) tuples, oldest first.
+        """
+
+        pending = []
+        cursor = start
+        for done_start, done_end in self._windows(endpoint_type, type_):
+            if done_end <= cursor:
+                continue
+            if done_start >= end:
+                break
+            if done_start > cursor:
+                pending.append((cursor, done_start))
+            cursor = max(cursor, done_end)
+        if cursor < end:
+            pending.append((cursor, end))
+        return pending
+
+    def commit_window(self, endpoint_type, type_, start, end, offsets=None):
+        """ Mark (start, end] as committed for the endpoint and type,
+            record the log file sizes that go with it and save.
+
+        Parameters
+        ----------
+        offsets: dict
+            Log file paths (relative to the 'logs' base directory) and
+            their sizes once the window's logs have been appended.
+        """
+
+        with self._lock:
+            windows = self._windows(endpoint_type, type_) + [[start, end]]
+            self.state["windows"][_key(endpoint_type, type_)] = _merge(windows)
+            self.state["offsets"].update(offsets or {})
+        self.save()
+
+    def log_offset(self, log_file):
+        """ Return the committed size of a log file, or None if nothing
+            has been committed to it yet.
+        """
+
+        with self._lock:
+            return self.state["offsets"].get(log_file)
+
+    def log_offsets(self):
+        """ Return a copy of the committed sizes of every log file """
+
+        with self._lock:
+            return dict(self.state["offsets"])
+
+    def set_log_offset(self, log_file, offset):
+        """ Record the committed size of a log file and save. """
+
+        with self._lock:
+            self.state["offsets"][log_file] = offset
+        self.save()
+
+    def forget_log_offset(self, log_file):
+        """ Stop tracking a log file that won't be appended to again
+            (a closed segment) and save.
+        """
+
+        with self._lock:
+            forgotten = self.state["offsets"].pop(log_file, None) is not None
+        if forgotten:
+            self.save()
+
+    def prune(self, before):
+        """ Forget committed windows that end at or before 'before'.
+            Called once time.log has moved past them.
+        """
+
+        with self._lock:
+            for key, windows in self.state["windows"].items():
+                self.state["windows"][key] = [
+                    window for window in windows if window[1] > before
+                ]
+        self.save()
+
+    def save(self):
+        """ Atomically write the state to self.file_path """
+
+        with self._save_lock:
+            with self._lock:
+                data = json.dumps(self.state)
+            temp_path = "{}.tmp".format(self.file_path)
+            with open(temp_path, "w") as _file:
+                _file.write(data)
+                _file.flush()
+                os.fsync(_file.fileno())
+            os.replace(temp_path, self.file_path)
+
+    def _windows(self, endpoint_type, type_):
+        """ Committed windows for the endpoint and type, oldest first """
+
+        with self._lock:
+            return list(self.state["windows"].get(_key(endpoint_type, type_), []))
+
+    def _load(self):
+        """ Read the checkpoint file, or start empty if there isn't a
+            usable one.
+        """
+
+        state = {"windows": {}, "offsets": {}}
+        try:
+            with open(self.file_path, "r") as _file:
+                state.update(json.load(_file))
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logging.error("Checkpoint file %s is corrupt. Ignoring it.", self.file_path)
+        return state
+
+
+def _key(endpoint_type, type_):
+    """ Key used to store windows. Ex: 'alert/Compromised Credential' """
+
+    return "{}/{}".format(endpoint_type, type_)
+
+
+def _merge(windows):
+    """ Merge overlapping and adjacent windows """
+
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
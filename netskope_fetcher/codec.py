@@ -0,0 +1,155 @@
+"""Defines the JsonCodec classes used to decode API responses and to
+encode logs for the log files.
+
+By default ('auto') responses are decoded with the fastest JSON library
+installed (orjson, then ujson, then the standard library), but logs are
+always encoded with json.dumps, so the log files look the same whatever
+is installed. NETSKOPE_JSON_CODEC selects a backend explicitly: 'auto',
+'orjson', 'ujson' or 'stdlib'. orjson and ujson also encode the logs,
+which is faster but changes their format (no spaces after separators,
+non-ASCII characters left unescaped).
+"""
+
+import importlib
+import json
+
+from netskope_fetcher.config import env_str
+
+
+class JsonCodec:
+
+    """ Standard library backend. Also the base class for the others.
+
+    Attributes
+    ----------
+    name: str
+        Name of the backend, as used in NETSKOPE_JSON_CODEC.
+    """
+
+    name = "stdlib"
+
+    def loads(self, data):
+        """ Decode json from bytes or str """
+
+        return json.loads(data)
+
+    def dumps(self, obj):
+        """ Encode obj as json bytes (without a trailing newline).
+            Matches the output of json.dumps(obj).
+        """
+
+        return json.dumps(obj).encode()
+
+    def dumps_lines(self, objects):
+        """ Encode a list of objects as newline delimited json bytes """
+
+        dumps = self.dumps
+        return b"".join([dumps(obj) + b"\n" for obj in objects])
+
+
+class OrjsonCodec(JsonCodec):
+
+    """ orjson backend. Output is compact (no spaces after separators). """
+
+    name = "orjson"
+
+    def __init__(self):
+        self._orjson = importlib.import_module("orjson")
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+    def dumps(self, obj):
+        return self._orjson.dumps(obj)
+
+
+class UjsonCodec(JsonCodec):
+
+    """ ujson backend. """
+
+    name = "ujson"
+
+    def __init__(self):
+        self._ujson = importlib.import_module("ujson")
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+    def dumps(self, obj):
+        return self._ujson.dumps(obj, ensure_ascii=False).encode()
+
+
+class AutoCodec(JsonCodec):
+
+    """ Decodes with the fastest backend installed and encodes with
+        json.dumps, so the output format doesn't depend on what is
+        installed.
+
+    Attributes
+    ----------
+    decoder: JsonCodec
+        The backend used by loads().
+    """
+
+    name = "auto"
+
+    def __init__(self):
+        for candidate in AUTO_ORDER:
+            try:
+                self.decoder = CODECS[candidate]()
+            except ImportError:
+                continue
+            break
+        self.loads = self.decoder.loads
+
+
+CODECS = {
+    OrjsonCodec.name: OrjsonCodec,
+    UjsonCodec.name: UjsonCodec,
+    JsonCodec.name: JsonCodec,
+}
+
+# Order in which backends are tried when NETSKOPE_JSON_CODEC is 'auto'
+AUTO_ORDER = (OrjsonCodec.name, UjsonCodec.name, JsonCodec.name)
+
+_CACHE = {}
+
+
+def get_codec(name=None):
+    """ Return the JsonCodec for 'name' (or NETSKOPE_JSON_CODEC).
+
+        'auto' decodes with the fastest backend that is installed and
+        encodes like json.dumps. Asking for a backend that isn't
+        installed raises ImportError, and an unknown name raises
+        ValueError.
+    """
+
+    name = (name or env_str("NETSKOPE_JSON_CODEC", "auto")).lower()
+    if name in _CACHE:
+        return _CACHE[name]
+
+    if name == AutoCodec.name:
+        codec = AutoCodec()
+    elif name in CODECS:
+        codec = CODECS[name]()
+    else:
+        raise ValueError(
+            "Unknown NETSKOPE_JSON_CODEC '{}'. Choose from: auto, {}".format(
+                name, ", ".join(AUTO_ORDER)
+            )
+        )
+
+    _CACHE[name] = codec
+    return codec
+
+
+def available_codecs():
+    """ Return a JsonCodec for every backend that is installed """
+
+    codecs = []
+    for name in AUTO_ORDER:
+        try:
+            codecs.append(get_codec(name))
+        except ImportError:
+            continue
+    return codecs
@@ -0,0 +1,61 @@
+"""Helpers for reading typed configuration values from the environment.
+
+All of the script's settings live in the '.env' file which is loaded
+into the environment by python-dotenv before anything else runs. These
+helpers keep the parsing (and the defaults) in one place.
+"""
+
+import os
+
+
+_TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+def env_str(name, default=None):
+    """ Return the environment variable as a string, or the default if
+        it is unset or empty.
+    """
+
+    value = os.environ.get(name, "").strip()
+    return value or default
+
+
+def env_int(name, default=None):
+    """ Return the environment variable as an int, or the default if it
+        is unset or empty.
+    """
+
+    value = env_str(name)
+    return int(value) if value is not None else default
+
+
+def env_float(name, default=None):
+    """ Return the environment variable as a float, or the default if
+        it is unset or empty.
+    """
+
+    value = env_str(name)
+    return float(value) if value is not None else default
+
+
+def env_bool(name, default=False):
+    """ Return the environment variable as a bool. '1', 'true', 'yes'
+        and 'on' (any case) are True, anything else is False.
+    """
+
+    value = env_str(name)
+    if value is None:
+        return default
+    return value.lower() in _TRUE_VALUES
+
+
+def env_list(name, default=None):
+    """ Return a comma separated environment variable as a list of
+        stripped, non-empty strings, or the default if it is unset or
+        empty.
+    """
+
+    value = env_str(name)
+    if value is None:
+        return default if default is not None else []
+    return [item.strip() for item in value.split(",") if item.strip()]
@@ -0,0 +1,104 @@
+"""Defines the HttpSettings class which holds the connection pool and
+timeout settings used to talk to the Netskope API, and a helper to
+create a tuned aiohttp.ClientSession from them.
+
+Every setting is read from the environment ('.env'). Timeouts may be
+overridden per endpoint, for example NETSKOPE_EVENT_HTTP_READ_TIMEOUT
+takes precedence over NETSKOPE_HTTP_READ_TIMEOUT for the events URL.
+"""
+
+import aiohttp
+
+from netskope_fetcher.config import env_float, env_int
+
+
+class HttpSettings:
+
+    """ Connection pool and timeout settings.
+
+    Attributes
+    ----------
+    limit: int
+        Maximum number of open connections in the pool.
+    limit_per_host: int
+        Maximum number of open connections to a single host.
+    keepalive_timeout: float
+        Seconds an idle connection is kept open for reuse.
+    dns_ttl: int
+        Seconds a DNS lookup is cached for.
+    connect_timeout: float
+        Seconds allowed to establish a connection.
+    read_timeout: float
+        Seconds allowed between reads of the response.
+    total_timeout: float
+        Seconds allowed for the whole request. None for no limit.
+    """
+
+    def __init__(self, endpoint_type=None):
+        """
+        Parameters
+        ----------
+        endpoint_type: str
+            'event' or 'alert'. Used to look up per-endpoint timeout
+            overrides. None for the global settings.
+        """
+
+        self.limit = env_int("NETSKOPE_HTTP_LIMIT", 100)
+        self.limit_per_host = env_int("NETSKOPE_HTTP_LIMIT_PER_HOST", 32)
+        self.keepalive_timeout = env_float("NETSKOPE_HTTP_KEEPALIVE_TIMEOUT", 60.0)
+        self.dns_ttl = env_int("NETSKOPE_HTTP_DNS_TTL", 300)
+        self.connect_timeout = self._endpoint_float(
+            endpoint_type, "CONNECT_TIMEOUT", 10.0
+        )
+        self.read_timeout = self._endpoint_float(endpoint_type, "READ_TIMEOUT", 120.0)
+        self.total_timeout = self._endpoint_float(endpoint_type, "TOTAL_TIMEOUT", None)
+
+    def timeout(self):
+        """ Return the aiohttp.ClientTimeout for a single request """
+
+        return aiohttp.ClientTimeout(
+            total=self.total_timeout,
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+
+    def connector(self):
+        """ Return a new aiohttp.TCPConnector using these settings """
+
+        kwargs = {
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "keepalive_timeout": self.keepalive_timeout,
+            "use_dns_cache": True,
+            "ttl_dns_cache": self.dns_ttl,
+        }
+        return aiohttp.TCPConnector(**kwargs)
+
+    @staticmethod
+    def _endpoint_float(endpoint_type, setting, default):
+        """ Read NETSKOPE_<ENDPOINT>_HTTP_<SETTING>, falling back to
+            NETSKOPE_HTTP_<SETTING> and then the default.
+        """
+
+        value = env_float("NETSKOPE_HTTP_{}".format(setting), default)
+        if endpoint_type:
+            value = env_float(
+                "NETSKOPE_{}_HTTP_{}".format(endpoint_type.upper(), setting), value
+            )
+        return value
+
+
+def create_session(http_settings=None):
+    """ Create an aiohttp.ClientSession with a tuned connection pool.
+        Must be called from within the running event loop.
+
+    Parameters
+    ----------
+    http_settings: HttpSettings
+        Settings to use. Read from the environment if not given.
+    """
+
+    http_settings = http_settings or HttpSettings()
+    return aiohttp.ClientSession(
+        connector=http_settings.connector(), timeout=http_settings.timeout()
+    )
@@ -0,0 +1,312 @@
+"""Defines the NetskopeDaemon class which keeps one event loop and one
+aiohttp session alive and pulls down logs on a fixed interval, instead
+of relying on cron to start the script over and over again.
+
+run_daemons runs one daemon per tenant on the same event loop and
+session when several tenants are configured.
+"""
+
+from datetime import datetime
+import asyncio
+import logging
+import signal
+import time
+
+from netskope_fetcher.base import split_window
+from netskope_fetcher.connection import create_session
+from netskope_fetcher.metrics import start_http_server
+
+
+class NetskopeDaemon:
+
+    """ Long-running poller.
+
+        Each cycle pulls down the window from the last committed end
+        time up to 'now'. As soon as a window commits, time.log is
+        moved forward and the next window is scheduled 'interval'
+        seconds after the end of the previous one.
+
+        When the daemon falls more than 'max_window' seconds behind,
+        the backlog is cut into max_window sized windows and up to
+        'max_cycles' of them are pulled down at once (overlapping
+        cycles), the next one starting as soon as one finishes.
+        time.log only ever moves forward over a contiguous run of
+        committed windows.
+
+        On shutdown, windows still in flight after 'shutdown_timeout'
+        seconds are cancelled and the writer drops whatever they had
+        staged.
+
+    Attributes
+    ----------
+    run_window: coroutine function
+        Called as run_window(session, start, end). Pulls down and
+        writes every log in (start, end] and returns True once all of
+        it has been committed.
+    time_writer: TinyTimeWriter
+        Reads and saves the end time of the last committed window.
+    interval: int
+        Seconds between polls once the daemon has caught up.
+    max_window: int
+        Widest window (in seconds) a single cycle will pull down.
+    max_cycles: int
+        How many windows may be in flight at once when catching up.
+    default_interval: int
+        How far back to start if there is no time.log yet.
+    shutdown_timeout: float
+        Seconds to let in-flight cycles finish after SIGTERM before
+        they are cancelled.
+    on_commit: function
+        Optional. Called with the new end time after time.log moves.
+    writer: LogWriter
+        Optional. The writer run_window writes to. Its workers are
+        stopped and its open stages discarded when the daemon stops.
+    metrics_port: int
+        Optional. Serve the metrics at http://<host>:<port>/metrics
+        while the daemon runs.
+    """
+
+    def __init__(self, run_window, time_writer, **kwargs):
+        self.run_window = run_window
+        self.time_writer = time_writer
+        self.interval = kwargs.get("interval") or 60
+        self.max_window = kwargs.get("max_window") or 3600
+        self.max_cycles = kwargs.get("max_cycles") or 1
+        self.default_interval = kwargs.get("default_interval") or 600
+        self.shutdown_timeout = kwargs.get("shutdown_timeout") or 30
+        self.on_commit = kwargs.get("on_commit")
+        self.writer = kwargs.get("writer")
+        self.http_settings = kwargs.get("http_settings")
+        self.metrics_port = kwargs.get("metrics_port")
+        self.metrics_host = kwargs.get("metrics_host") or "0.0.0.0"
+        self._stopping = None
+        self._deadline = None
+
+    def run(self):
+        """ Start the event loop and poll until SIGTERM or SIGINT """
+
+        run_daemons([self], self.http_settings)
+
+    def stop(self):
+        """ Ask the daemon to shut down once in-flight windows finish """
+
+        if not self._stop_event().is_set():
+            logging.info("Shutdown requested. Finishing in-flight windows.")
+            self._stop_event().set()
+
+    async def run_async(self, session=None):
+        """ Poll until stop() is called, reusing one session (and its
+            pool of open connections) for every cycle.
+
+        Parameters
+        ----------
+        session: aiohttp.ClientSession
+            Session shared with other daemons. It is left open. If not
+            given, one is created and closed when the daemon stops.
+        """
+
+        metrics_server = None
+        if self.metrics_port:
+            metrics_server = await start_http_server(
+                self.metrics_port, self.metrics_host
+            )
+
+        try:
+            if session is not None:
+                await self._poll(session)
+            else:
+                async with create_session(self.http_settings) as session:
+                    await self._poll(session)
+        finally:
+            await self._stop_writer()
+            if metrics_server is not None:
+                await metrics_server.cleanup()
+
+        logging.info("Daemon stopped.")
+
+    async def _poll(self, session):
+        """ Pull down new windows until stop() is called """
+
+        while not self._stop_event().is_set():
+            last_end = self._last_end()
+            if not self.next_windows(last_end, int(time.time())):
+                await self._sleep(last_end + self.interval - time.time())
+                continue
+
+            committed = await self._run_cycles(session, last_end)
+            if not committed:
+                # Nothing moved forward. Don't hammer the API.
+                await self._sleep(self.interval)
+
+    def next_windows(self, last_end, now):
+        """ Return the windows to pull down next.
+
+            Nothing if less than 'interval' seconds have passed since
+            last_end, one window if we're caught up and up to
+            max_cycles consecutive windows if we're behind.
+        """
+
+        if now - last_end < self.interval:
+            return []
+        parts = -(-(now - last_end) // self.max_window)
+        return split_window(last_end, now, parts)[: self.max_cycles]
+
+    async def _run_cycles(self, session, last_end):
+        """ Pull down the windows from last_end onwards, up to
+            max_cycles at once, starting the next one as soon as one
+            finishes, and move time.log forward over the ones that
+            committed, in order. No new window is started once one
+            fails or stop() is called.
+
+        Returns
+        ----------
+        bool
+            True if time.log moved forward.
+        """
+
+        running = {}
+        # Start of each finished window -> (end, committed)
+        finished = {}
+        scheduled_end = committed_end = last_end
+        failed = False
+        stop_waiter = asyncio.ensure_future(self._stop_event().wait())
+        try:
+            while True:
+                if not failed and not self._stop_event().is_set():
+                    windows = self.next_windows(scheduled_end, int(time.time()))
+                    for start, end in windows[: self.max_cycles - len(running)]:
+                        task = asyncio.ensure_future(self._run_one(session, start, end))
+                        running[task] = (start, end)
+                        scheduled_end = end
+                if not running:
+                    break
+
+                if self._stop_event().is_set():
+                    done = await self._cancel_after_timeout(list(running))
+                else:
+                    done, _ = await asyncio.wait(
+                        list(running) + [stop_waiter],
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+
+                for task in done:
+                    if task is stop_waiter:
+                        continue
+                    start, end = running.pop(task)
+                    committed = not task.cancelled() and task.result()
+                    finished[start] = (end, committed)
+                    failed = failed or not committed
+
+                moved_to = committed_end
+                while finished.get(moved_to, (None, False))[1]:
+                    moved_to = finished.pop(moved_to)[0]
+                if moved_to != committed_end:
+                    committed_end = moved_to
+                    self.time_writer.save_last_log_time(committed_end)
+                    if self.on_commit is not None:
+                        self.on_commit(committed_end)
+        finally:
+            stop_waiter.cancel()
+
+        return committed_end != last_end
+
+    async def _cancel_after_timeout(self, tasks):
+        """ SIGTERM arrived. Give in-flight windows a chance to commit,
+            then cancel whatever is left. Returns the tasks, all done.
+        """
+
+        self._deadline = time.monotonic() + self.shutdown_timeout
+        await asyncio.wait(tasks, timeout=self.shutdown_timeout)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return tasks
+
+    async def _stop_writer(self):
+        """ Let the writer finish what's queued until the shutdown
+            deadline, then stop its workers and discard the stages of
+            windows that were cancelled. They're pulled down again on
+            the next run.
+        """
+
+        if self.writer is None:
+            return
+        timeout = 0
+        if self._deadline is not None:
+            timeout = max(0, self._deadline - time.monotonic())
+        await self.writer.abort(timeout)
+
+    async def _run_one(self, session, start, end):
+        """ Pull down a single window, logging instead of raising """
+
+        logging.info(
+            "Running from %s to %s",
+            datetime.strftime(datetime.fromtimestamp(start), "%c"),
+            datetime.strftime(datetime.fromtimestamp(end), "%c"),
+        )
+        try:
+            return await self.run_window(session, start, end)
+        except asyncio.CancelledError:
+            raise
+        except Exception as _e:  # pylint: disable=broad-except
+            logging.exception("Exception Occurred: %s.", _e)
+            return False
+
+    def _stop_event(self):
+        """ The asyncio.Event set by stop(). Created on first use so it
+            belongs to the running loop.
+        """
+
+        if self._stopping is None:
+            self._stopping = asyncio.Event()
+        return self._stopping
+
+    def _last_end(self):
+        """ End of the last committed window, or default_interval
+            seconds ago if there isn't one.
+        """
+
+        return self.time_writer.get_last_log_time() or (
+            int(time.time()) - self.default_interval
+        )
+
+    async def _sleep(self, seconds):
+        """ Sleep, but wake up early if stop() is called """
+
+        if seconds <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._stop_event().wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+def run_daemons(daemons, http_settings=None):
+    """ Run the daemons on one event loop and one session (one pool of
+        open connections) until SIGTERM or SIGINT, which stops all of
+        them.
+
+    Parameters
+    ----------
+    daemons: list
+        NetskopeDaemon objects, one per tenant.
+    http_settings: netskope_fetcher.connection.HttpSettings
+        Connection pool settings for the shared session.
+    """
+
+    def stop():
+        for daemon in daemons:
+            daemon.stop()
+
+    async def run_all():
+        async with create_session(http_settings) as session:
+            await asyncio.gather(*[daemon.run_async(session) for daemon in daemons])
+
+    loop = asyncio.get_event_loop()
+    for signal_ in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_, stop)
+    try:
+        loop.run_until_complete(run_all())
+    finally:
+        for signal_ in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(signal_)
@@ -0,0 +1,303 @@
+"""Defines the Deduplicator class which drops logs that were already
+written by an earlier page, window or run.
+
+Duplicates show up at the edges of runs (each run starts where the last
+one ended) and when new events shift the 'skip' offsets while a window
+is being paged through. Logs are keyed on their '_id' (or a hash of the
+fields in NETSKOPE_DEDUP_FIELDS) and looked up in a rotating Bloom
+filter: a few fixed-size generations, the oldest of which is dropped
+when the newest fills up. Memory stays flat no matter how long the
+daemon runs, at the cost of forgetting keys after roughly
+capacity * (generations - 1) logs and of a small false positive rate
+(a log wrongly taken for a duplicate).
+"""
+
+from hashlib import blake2b
+import asyncio
+import json
+import logging
+import math
+import os
+import struct
+
+from netskope_fetcher.config import env_float, env_int, env_list
+from netskope_fetcher.passthrough import RawRecords, extract_field
+
+
+_MAGIC = b"NSDEDUP1"
+
+_UNPACK = struct.Struct("<QQ").unpack
+
+
+class BloomFilter:
+
+    """ Fixed-size Bloom filter.
+
+    Attributes
+    ----------
+    size: int
+        Number of bits.
+    hashes: int
+        Number of bits set per key.
+    count: int
+        Number of keys added.
+    bits: bytearray
+        The filter itself.
+    """
+
+    def __init__(self, size, hashes, count=0, bits=None):
+        self.size = size
+        self.hashes = hashes
+        self.count = count
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+
+    def contains(self, indexes):
+        """ Are all of a key's bits (from indexes()) set? """
+
+        bits = self.bits
+        for index in indexes:
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def add(self, indexes):
+        """ Set a key's bits (from indexes()) """
+
+        bits = self.bits
+        for index in indexes:
+            bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def indexes(self, digest):
+        """ Bit positions for a key (a 16 byte digest), by double
+            hashing. The same for every filter of the same size.
+        """
+
+        first, second = _UNPACK(digest)
+        second |= 1
+        size = self.size
+        return [(first + i * second) % size for i in range(self.hashes)]
+
+
+class Deduplicator:
+
+    """ Persistent, bounded record of the logs that have been written.
+
+        Keys of logs in a window that is still being staged are held
+        aside until the window commits, so a window that is discarded
+        and pulled down again isn't mistaken for a duplicate of itself.
+
+    Attributes
+    ----------
+    file_path: str
+        Where the filter is saved between runs. None to keep it in
+        memory only.
+    fields: list
+        Log fields the key is built from. ['_id'] by default.
+    capacity: int
+        Keys per generation before a new generation is started.
+    error_rate: float
+        Target false positive rate of each generation.
+    generations: int
+        Generations kept. Keys are remembered for between
+        capacity * (generations - 1) and capacity * generations logs.
+    suppressed: dict
+        Duplicates dropped so far, keyed by 'endpoint/type'.
+    """
+
+    def __init__(self, file_path=None, **kwargs):
+        self.file_path = file_path
+        self.fields = kwargs.get("fields") or env_list("NETSKOPE_DEDUP_FIELDS") or [
+            "_id"
+        ]
+        self.capacity = kwargs.get("capacity") or env_int(
+            "NETSKOPE_DEDUP_CAPACITY", 1000000
+        )
+        self.error_rate = kwargs.get("error_rate") or env_float(
+            "NETSKOPE_DEDUP_ERROR_RATE", 0.001
+        )
+        self.generations = max(
+            2, kwargs.get("generations") or env_int("NETSKOPE_DEDUP_GENERATIONS", 3)
+        )
+        self.suppressed = {}
+
+        # Optimal Bloom filter size and number of hashes for the
+        # capacity and error rate.
+        self._size = int(
+            math.ceil(-self.capacity * math.log(self.error_rate) / math.log(2) ** 2)
+        )
+        self._hashes = max(1, int(round(self._size / self.capacity * math.log(2))))
+        self._filters = self._load()
+        self._pending = {}
+
+    def filter_page(self, endpoint_type, type_, log_list, scope=None):
+        """ Return the logs of a page that haven't been seen before.
+
+        Parameters
+        ----------
+        endpoint_type: str
+            'event' or 'alert'
+        type_: str
+            The log 'type'
+        log_list: list
+            Logs as dicts, or RawRecords in passthrough mode.
+        scope: object
+            The window (WindowStage) the page belongs to. Its keys are
+            only remembered once commit(scope) is called. None to
+            remember them straight away.
+        """
+
+        prefix = "{}/{}".format(endpoint_type, type_).encode()
+        pending = self._pending.setdefault(scope, set()) if scope is not None else None
+        raw = isinstance(log_list, RawRecords)
+        kept = RawRecords() if raw else []
+
+        for log in log_list:
+            key = self._key(log, raw)
+            if key is None:
+                # Nothing to go on. Better a duplicate than a lost log.
+                kept.append(log)
+                continue
+
+            digest = blake2b(prefix + key, digest_size=16).digest()
+            if (pending is not None and digest in pending) or self._seen(digest):
+                continue
+            if pending is None:
+                self._remember(digest)
+            else:
+                pending.add(digest)
+            kept.append(log)
+
+        dropped = len(log_list) - len(kept)
+        if dropped:
+            name = prefix.decode()
+            self.suppressed[name] = self.suppressed.get(name, 0) + dropped
+        return kept
+
+    def commit(self, scope):
+        """ Remember the keys of a window once it has been committed """
+
+        for digest in self._pending.pop(scope, ()):
+            self._remember(digest)
+
+    def discard(self, scope):
+        """ Forget the keys of a window that was thrown away """
+
+        self._pending.pop(scope, None)
+
+    def save(self):
+        """ Write the filter to file_path atomically """
+
+        if self.file_path is not None:
+            self._write(self._dump())
+
+    async def save_async(self):
+        """ Like save, but the file is written (and fsynced) in a thread
+            so the event loop isn't held up. The filter is copied first,
+            so it can go on changing in the meantime.
+        """
+
+        if self.file_path is not None:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self._write, self._dump()
+            )
+
+    def _dump(self):
+        """ The filter as the bytes of its file """
+
+        header = json.dumps(
+            {
+                "size": self._size,
+                "hashes": self._hashes,
+                "counts": [filter_.count for filter_ in self._filters],
+            }
+        ).encode()
+        return b"".join(
+            [_MAGIC, struct.pack("<I", len(header)), header]
+            + [filter_.bits for filter_ in self._filters]
+        )
+
+    def _write(self, data):
+        """ Atomically replace file_path with data """
+
+        temporary = self.file_path + ".tmp"
+        with open(temporary, "wb") as _f:
+            _f.write(data)
+            _f.flush()
+            os.fsync(_f.fileno())
+        os.replace(temporary, self.file_path)
+
+    def _key(self, log, raw):
+        """ Bytes the log is identified by, or None if it has none of
+            the key fields.
+        """
+
+        if raw:
+            values = [extract_field(log, field) for field in self.fields]
+        else:
+            values = [log.get(field) for field in self.fields]
+        if all(value is None for value in values):
+            return None
+        if len(values) == 1 and isinstance(values[0], str):
+            return values[0].encode()
+        return json.dumps(values, sort_keys=True, default=str).encode()
+
+    def _seen(self, digest):
+        """ Is the key in any generation? """
+
+        indexes = self._filters[-1].indexes(digest)
+        for filter_ in reversed(self._filters):
+            if filter_.contains(indexes):
+                return True
+        return False
+
+    def _remember(self, digest):
+        """ Add a key to the newest generation, starting a new one (and
+            dropping the oldest) when it's full.
+        """
+
+        if self._filters[-1].count >= self.capacity:
+            self._filters = self._filters[1:] + [self._new_filter()]
+        self._filters[-1].add(self._filters[-1].indexes(digest))
+
+    def _new_filter(self):
+        return BloomFilter(self._size, self._hashes)
+
+    def _load(self):
+        """ Read the filter saved by an earlier run. Starts over if there
+            isn't one or it was saved with different settings.
+        """
+
+        fresh = [self._new_filter() for _ in range(self.generations)]
+        if self.file_path is None or not os.path.exists(self.file_path):
+            return fresh
+
+        try:
+            with open(self.file_path, "rb") as _f:
+                if _f.read(len(_MAGIC)) != _MAGIC:
+                    raise ValueError("not a dedup file")
+                (length,) = struct.unpack("<I", _f.read(4))
+                header = json.loads(_f.read(length).decode())
+                if (header["size"], header["hashes"], len(header["counts"])) != (
+                    self._size,
+                    self._hashes,
+                    self.generations,
+                ):
+                    logging.warning(
+                        "Dedup settings changed. Starting with an empty filter."
+                    )
+                    return fresh
+                filters = []
+                for count in header["counts"]:
+                    bits = bytearray(_f.read((self._size + 7) // 8))
+                    if len(bits) != (self._size + 7) // 8:
+                        raise ValueError("truncated")
+                    filters.append(BloomFilter(self._size, self._hashes, count, bits))
+                return filters
+        except (ValueError, KeyError, struct.error) as _e:
+            logging.error(
+                "Could not read %s (%s). Starting with an empty filter.",
+                self.file_path,
+                _e,
+            )
+            return fresh
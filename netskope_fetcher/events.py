@@ -7,6 +7,9 @@ logs for Nestkope Events.
 import os
 
 from netskope_fetcher.base import BaseNetskopeClient
+from netskope_fetcher.config import env_str
+from netskope_fetcher.connection import HttpSettings
+from netskope_fetcher.tenants import base_url
 
 
 class EventClient(BaseNetskopeClient):
@@ -27,17 +30,25 @@ class EventClient(BaseNetskopeClient):
     endpoint_type: str
         The netskope rest endpoint that this object relates to.
     url: str
-        The URL of the endpoint
+        The URL of the endpoint. Built from 'base_url' if given, or
+        from NETSKOPE_TENANT_NAME and NETSKOPE_REGION otherwise.
+    http_settings: netskope_fetcher.connection.HttpSettings
+        Connect/read timeouts for the endpoint. Read from the
+        NETSKOPE_EVENT_HTTP_* settings if not given.
     """
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.type_list = ["page", "application", "audit", "infrastructure"]
         self.endpoint_type = "event"
+        if kwargs.get("types") is not None:
+            # Only the types configured for the tenant.
+            self.type_list = list(kwargs["types"].get(self.endpoint_type, []))
+        self.http_settings = self.http_settings or HttpSettings(self.endpoint_type)
 
         url = kwargs.get("url", None)
 
-        self.url = url or (
-            "https://{}.eu.goskope.com/api/v1/events"
-            "".format(os.environ["NETSKOPE_TENANT_NAME"])
+        self.url = url or "{}/events".format(
+            kwargs.get("base_url")
+            or base_url(os.environ["NETSKOPE_TENANT_NAME"], env_str("NETSKOPE_REGION"))
         )
@@ -0,0 +1,280 @@
+"""Defines the FieldFilters class which trims logs down to the fields
+and records that are actually wanted before they are written.
+
+Filters are set per type in a json file (NETSKOPE_FILTERS_FILE), keyed
+by 'endpoint/type':
+
+    {
+        "event/page": {"keep": ["_id", "timestamp", "user", "app", "url"]},
+        "event/audit": {
+            "drop": ["organization_unit"],
+            "exclude": [
+                {"field": "audit_log_event", "in": ["Login Successful"]},
+                {"field": "supporting_data", "regex": "^Admin"}
+            ]
+        },
+        "alert/DLP": {"include": [{"field": "severity", "min": 3}]}
+    }
+
+    keep     Only these fields are written.
+    drop     These fields are removed.
+    include  A log is only written if it matches every predicate.
+    exclude  A log is dropped if it matches any predicate.
+
+A predicate tests one top-level field with one of:
+
+    {"field": f, "equals": value}
+    {"field": f, "in": [value, ...]}
+    {"field": f, "regex": pattern}     (searched in string values)
+    {"field": f, "min": n, "max": n}   (numbers; either end may be left out)
+
+Add "not": true to a predicate to negate it. A missing field never
+matches (so 'not' makes it match).
+
+Each type's filter is compiled once, when the file is loaded, into a
+single function over a page of logs. Filters run before duplicates are
+looked up, so keep the NETSKOPE_DEDUP_FIELDS ('_id') when using 'keep'.
+"""
+
+import json
+import re
+
+
+_MISSING = object()
+
+_OPERATORS = ("equals", "in", "regex", "min", "max")
+
+_SPEC_KEYS = ("keep", "drop", "include", "exclude")
+
+
+def compile_predicate(predicate):
+    """ Compile a predicate into a function of a log that returns True
+        if it matches.
+
+    Raises
+    ----------
+    ValueError
+        If the predicate isn't valid.
+    """
+
+    if not isinstance(predicate, dict) or not isinstance(predicate.get("field"), str):
+        raise ValueError("Every predicate needs a 'field': {}".format(predicate))
+    field = predicate["field"]
+    operators = [key for key in predicate if key in _OPERATORS]
+    unknown = set(predicate) - set(_OPERATORS) - {"field", "not"}
+    if unknown or not operators:
+        raise ValueError(
+            "Unknown or missing operator in predicate: {}".format(predicate)
+        )
+
+    if operators in (["min"], ["max"], ["min", "max"], ["max", "min"]):
+        test = _range_test(predicate.get("min"), predicate.get("max"), predicate)
+    elif len(operators) > 1:
+        raise ValueError("One operator per predicate: {}".format(predicate))
+    elif operators == ["equals"]:
+        test = _equals_test(predicate["equals"])
+    elif operators == ["in"]:
+        test = _in_test(predicate["in"], predicate)
+    else:
+        test = _regex_test(predicate["regex"], predicate)
+
+    if predicate.get("not"):
+
+        def matches(log):
+            value = log.get(field, _MISSING)
+            return value is _MISSING or not test(value)
+
+    else:
+
+        def matches(log):
+            value = log.get(field, _MISSING)
+            return value is not _MISSING and test(value)
+
+    return matches
+
+
+def _equals_test(expected):
+    return lambda value: value == expected
+
+
+def _in_test(values, predicate):
+    if not isinstance(values, list):
+        raise ValueError("'in' takes a list: {}".format(predicate))
+    if any(isinstance(value, (dict, list)) for value in values):
+        # Lists and objects can't go in a set. Rare enough to compare
+        # them one by one.
+        return lambda value: value in values
+
+    hashable = frozenset(values)
+
+    def test(value):
+        try:
+            return value in hashable
+        except TypeError:
+            # The log's value is a list or an object.
+            return False
+
+    return test
+
+
+def _regex_test(pattern, predicate):
+    try:
+        search = re.compile(pattern).search
+    except (TypeError, re.error) as _e:
+        raise ValueError("Bad regex in predicate {}: {}".format(predicate, _e))
+    return lambda value: isinstance(value, str) and search(value) is not None
+
+
+def _range_test(low, high, predicate):
+    for bound in (low, high):
+        if bound is not None and not _is_number(bound):
+            raise ValueError("'min' and 'max' take numbers: {}".format(predicate))
+
+    def test(value):
+        if not _is_number(value):
+            return False
+        return (low is None or value >= low) and (high is None or value <= high)
+
+    return test
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def compile_filter(spec):
+    """ Compile a type's filter spec (see the module docstring) into a
+        function that takes a list of logs and returns the logs to
+        write, trimmed down to the wanted fields. Returns None if the
+        spec doesn't change anything.
+
+    Raises
+    ----------
+    ValueError
+        If the spec isn't valid.
+    """
+
+    if not isinstance(spec, dict) or set(spec) - set(_SPEC_KEYS):
+        raise ValueError(
+            "A filter may only have {}: {}".format(", ".join(_SPEC_KEYS), spec)
+        )
+    for key in _SPEC_KEYS:
+        if not isinstance(spec.get(key, []), list):
+            raise ValueError("'{}' takes a list: {}".format(key, spec))
+
+    project = _projection(spec.get("keep"), spec.get("drop"))
+    accept = _acceptance(
+        [compile_predicate(predicate) for predicate in spec.get("include", [])],
+        [compile_predicate(predicate) for predicate in spec.get("exclude", [])],
+    )
+
+    # One specialised comprehension per case so no call is wasted on a
+    # step that does nothing.
+    if project is None and accept is None:
+        return None
+    if accept is None:
+        return lambda log_list: [project(log) for log in log_list]
+    if project is None:
+        return lambda log_list: [log for log in log_list if accept(log)]
+    return lambda log_list: [project(log) for log in log_list if accept(log)]
+
+
+def _projection(keep, drop):
+    """ Function of a log that returns the fields to write, or None to
+        write every field.
+    """
+
+    drop = frozenset(drop or ())
+    if keep is not None:
+        keep = tuple(field for field in keep if field not in drop)
+        return lambda log: {field: log[field] for field in keep if field in log}
+    if drop:
+        return lambda log: {
+            field: value for field, value in log.items() if field not in drop
+        }
+    return None
+
+
+def _acceptance(include, exclude):
+    """ Function of a log that returns True if it is to be written, or
+        None to write every log.
+    """
+
+    if not include and not exclude:
+        return None
+    if len(include) == 1 and not exclude:
+        return include[0]
+    if len(exclude) == 1 and not include:
+        rejects = exclude[0]
+        return lambda log: not rejects(log)
+
+    # Plain loops: any()/all() over a generator cost more than the
+    # predicates themselves.
+    def accept(log):
+        for test in include:
+            if not test(log):
+                return False
+        for test in exclude:
+            if test(log):
+                return False
+        return True
+
+    return accept
+
+
+class FieldFilters:
+
+    """ The compiled filter of every type that has one.
+
+    Attributes
+    ----------
+    specs: dict
+        Filter specs keyed by 'endpoint/type', as read from the file.
+        Handed to worker processes (netskope_fetcher.offload), which
+        compile them on their side.
+    """
+
+    def __init__(self, specs):
+        self.specs = {}
+        self._compiled = {}
+        for key, spec in specs.items():
+            if not isinstance(key, str) or key.count("/") != 1:
+                raise ValueError(
+                    "Filters are keyed by 'endpoint/type', ex: 'event/page'. "
+                    "Got: {}".format(key)
+                )
+            compiled = compile_filter(spec)
+            if compiled is not None:
+                self.specs[key] = spec
+                self._compiled[key] = compiled
+
+    def get(self, endpoint_type, type_):
+        """ The compiled filter for a type, or None """
+
+        return self._compiled.get("{}/{}".format(endpoint_type, type_))
+
+    def spec(self, endpoint_type, type_):
+        """ The filter spec for a type, or None """
+
+        return self.specs.get("{}/{}".format(endpoint_type, type_))
+
+
+def load_filters(file_path):
+    """ Read and compile the filters file.
+
+    Raises
+    ----------
+    ValueError
+        If the file isn't valid.
+    """
+
+    with open(file_path) as _f:
+        try:
+            specs = json.load(_f)
+        except ValueError as _e:
+            raise ValueError("{} is not valid json: {}".format(file_path, _e))
+    if not isinstance(specs, dict):
+        raise ValueError(
+            "{} must hold an object keyed by 'endpoint/type'.".format(file_path)
+        )
+    return FieldFilters(specs)
@@ -0,0 +1,504 @@
+"""Defines the LogIndex class which keeps an optional SQLite index of the
+logs written by the LogWriter, so a user, app, source IP or _id can be
+looked up without grepping every log file.
+
+The index maps the values of NETSKOPE_INDEX_FIELDS in each log to the
+file and byte offset of the log's line. Find matching logs with:
+    (venv) $ python -m netskope_fetcher.query user=alice@example.com
+
+Indexing never holds up writing. The writer only reports which byte
+range of which file it appended to. A background thread reads those
+ranges back (from the page cache), picks the indexed fields out of each
+line without decoding the rest of it, and inserts their rows in batched
+transactions. If that thread falls more than NETSKOPE_INDEX_QUEUE_SIZE
+appends behind, further appends aren't queued (the writer never waits
+on it) but are noted, and read back once it catches up. If indexing
+fails, the error is logged and nothing more is indexed for the rest of
+the run.
+
+Only uncompressed log files can be indexed, since an offset into a
+compressed segment is meaningless.
+"""
+
+from collections import defaultdict
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from netskope_fetcher.codec import get_codec
+from netskope_fetcher.config import env_int, env_list
+from netskope_fetcher.passthrough import extract_field
+
+
+DEFAULT_FIELDS = ["user", "app", "srcip", "_id", "timestamp"]
+
+# The field that is kept as a column of its own so time ranges can be
+# searched.
+TIMESTAMP = "timestamp"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    endpoint TEXT NOT NULL,
+    type TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    file INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    timestamp INTEGER
+);
+CREATE INDEX IF NOT EXISTS records_file_offset ON records (file, offset);
+CREATE INDEX IF NOT EXISTS records_timestamp ON records (timestamp);
+"""
+
+# Every other indexed field is a column of records, named f_<field>,
+# with an index of its own. Columns are added as fields are configured.
+_COLUMN_PREFIX = "f_"
+
+# Queued to stop the indexing thread
+_STOP = None
+
+
+class LogIndex:
+
+    """ SQLite index of where each log was written.
+
+    Attributes
+    ----------
+    path: str
+        Path to the SQLite database.
+    base_dir: str
+        Directory the indexed log file paths are relative to.
+    fields: list
+        Fields of a log that are indexed.
+    batch_rows: int
+        Logs inserted per transaction, at most.
+    """
+
+    def __init__(self, path, base_dir, **kwargs):
+        self.path = path
+        self.base_dir = base_dir
+        self.fields = kwargs.get("fields") or env_list(
+            "NETSKOPE_INDEX_FIELDS", DEFAULT_FIELDS
+        )
+        self.batch_rows = kwargs.get("batch_rows") or env_int(
+            "NETSKOPE_INDEX_BATCH_ROWS", 50000
+        )
+        self._queue = queue.Queue(
+            maxsize=kwargs.get("queue_size")
+            or env_int("NETSKOPE_INDEX_QUEUE_SIZE", 1024)
+        )
+        self._thread = None
+        self._failed = False
+        self._lock = threading.Lock()
+        # Appends that didn't fit in the queue, to be indexed once the
+        # thread has caught up: [endpoint, type, path, start, end],
+        # with back to back appends to a file merged.
+        self._missed = []
+
+    def appended(self, endpoint_type, type_, file_path, start, end):
+        """ Queue the logs appended to file_path between byte offsets
+            start and end for indexing. Never blocks; called from the
+            writer's threads once the bytes have reached the file.
+        """
+
+        if end <= start or self._failed:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="netskope-index", daemon=True
+                )
+                self._thread.start()
+        relative_path = os.path.relpath(file_path, self.base_dir)
+        try:
+            self._queue.put_nowait((endpoint_type, type_, relative_path, start, end))
+        except queue.Full:
+            with self._lock:
+                if self._failed:
+                    return
+                if not self._missed:
+                    logging.warning(
+                        "Index is behind. Appends will be indexed once it "
+                        "catches up."
+                    )
+                for missed in reversed(self._missed):
+                    if missed[2] == relative_path:
+                        if missed[4] == start:
+                            missed[4] = end
+                            return
+                        break
+                self._missed.append([endpoint_type, type_, relative_path, start, end])
+
+    def truncate(self, file_path, size):
+        """ Forget the logs at or past 'size' in a log file that was
+            rolled back. Only called before anything is queued.
+        """
+
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "DELETE FROM records WHERE file = "
+                    "(SELECT id FROM files WHERE path = ?) AND offset >= ?",
+                    (os.path.relpath(file_path, self.base_dir), size),
+                )
+        finally:
+            connection.close()
+
+    def lookup(self, conditions, **kwargs):
+        """ Find the logs whose fields have the given values.
+
+        Parameters
+        ----------
+        conditions: dict
+            Indexed field -> value. A log must match all of them.
+        kwargs:
+            start and end: only logs with start < timestamp <= end.
+            types: only logs of these 'endpoint/type's.
+            limit: return at most this many.
+
+        Returns
+        ----------
+        list
+            (path relative to base_dir, offset, length) of each matching
+            log, oldest first.
+        """
+
+        connection = self._connect()
+        try:
+            return self._lookup(connection, conditions, **kwargs)
+        finally:
+            connection.close()
+
+    def _lookup(self, connection, conditions, **kwargs):
+        """ See lookup """
+
+        # The fields that are indexed are whatever was configured when
+        # the logs were written, so ask the index.
+        columns = _columns(connection)
+        where, params = [], []
+        for field, value in conditions.items():
+            if field == TIMESTAMP:
+                where.append("r.timestamp = ?")
+                params.append(int(value))
+            elif _column(field) in columns:
+                where.append("r.{} = ?".format(_quote(_column(field))))
+                params.append(str(value))
+            else:
+                raise ValueError(
+                    "{} is not indexed. Indexed fields: {}".format(
+                        field,
+                        ", ".join(
+                            [TIMESTAMP]
+                            + [
+                                column[len(_COLUMN_PREFIX) :]
+                                for column in columns
+                                if column.startswith(_COLUMN_PREFIX)
+                            ]
+                        ),
+                    )
+                )
+        if kwargs.get("start") is not None:
+            where.append("r.timestamp > ?")
+            params.append(kwargs["start"])
+        if kwargs.get("end") is not None:
+            where.append("r.timestamp <= ?")
+            params.append(kwargs["end"])
+        if kwargs.get("types"):
+            pairs = [type_.split("/", 1) for type_ in kwargs["types"]]
+            where.append(
+                "({})".format(
+                    " OR ".join(["(f.endpoint = ? AND f.type = ?)"] * len(pairs))
+                )
+            )
+            params.extend(value for pair in pairs for value in pair)
+        if not where:
+            raise ValueError("Give at least one field or a time range to look up.")
+
+        sql = (
+            "SELECT f.path, r.offset, r.length FROM records r "
+            "JOIN files f ON f.id = r.file WHERE {} "
+            "ORDER BY r.timestamp, r.id".format(" AND ".join(where))
+        )
+        if kwargs.get("limit"):
+            sql += " LIMIT ?"
+            params.append(kwargs["limit"])
+        return connection.execute(sql, params).fetchall()
+
+    def close(self):
+        """ Wait for everything queued to be indexed and stop the
+            indexing thread.
+        """
+
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            if thread.is_alive():
+                self._queue.put(_STOP)
+            thread.join()
+        if self._missed:
+            logging.warning(
+                "%s appends were left out of the index %s.",
+                len(self._missed),
+                self.path,
+            )
+
+    def _connect(self):
+        """ Open the database, creating the tables and the columns of
+            newly configured fields if needed.
+        """
+
+        connection = sqlite3.connect(self.path)
+        connection.executescript(_SCHEMA)
+        columns = _columns(connection)
+        for field in self._columns:
+            column = _column(field)
+            if column not in columns:
+                connection.execute(
+                    "ALTER TABLE records ADD COLUMN {} TEXT".format(_quote(column))
+                )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS {} ON records ({})".format(
+                    _quote("records_" + column), _quote(column)
+                )
+            )
+        connection.commit()
+        return connection
+
+    @property
+    def _columns(self):
+        """ Indexed fields that get a column of their own """
+
+        return [field for field in self.fields if field != TIMESTAMP]
+
+    def _run(self):
+        """ Indexing thread: insert queued appends in batches until
+            _STOP is queued.
+        """
+
+        # Linux lets a thread have a nice value of its own. Indexing
+        # gets the CPU last so it doesn't take it from fetching.
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        connection = None
+        try:
+            connection = self._connect()
+            # The index can always be rebuilt, so it isn't worth an
+            # fsync per batch.
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            files = dict(
+                (path, file_id)
+                for file_id, path in connection.execute("SELECT id, path FROM files")
+            )
+            last_id = connection.execute("SELECT MAX(id) FROM records").fetchone()[0]
+            next_id = (last_id or 0) + 1
+            stopping = False
+            while not stopping:
+                # Take everything that's queued so it goes into as few
+                # transactions as possible.
+                batch = [self._queue.get()]
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stopping = _STOP in batch
+                batch = [append for append in batch if append is not _STOP]
+                next_id = self._index(
+                    connection, files, batch + self._take_missed(), next_id
+                )
+        except Exception as _e:  # pylint: disable=broad-except
+            logging.exception(
+                "Indexing failed: %s. Nothing more will be indexed this run.", _e
+            )
+            # Stop taking appends, so neither the queue nor the missed
+            # appends grow while nothing reads them.
+            with self._lock:
+                self._failed = True
+                self._missed = []
+            self._drain_queue()
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def _take_missed(self):
+        """ Appends that didn't fit in the queue, now that there's room """
+
+        with self._lock:
+            missed, self._missed = self._missed, []
+        return [tuple(append) for append in missed]
+
+    def _drain_queue(self):
+        """ Empty the queue after a failure so nothing waits on it """
+
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _index(self, connection, files, batch, next_id):
+        """ Read back and insert the logs of a batch of appends, at most
+            batch_rows per transaction. Returns the next free record id.
+        """
+
+        columns = self._columns
+        timestamped = TIMESTAMP in self.fields
+        insert = (
+            "INSERT INTO records (id, file, offset, length, timestamp{}) "
+            "VALUES (?, ?, ?, ?, ?{})".format(
+                "".join(", " + _quote(_column(field)) for field in columns),
+                ", ?" * len(columns),
+            )
+        )
+
+        rows = []
+        for endpoint_type, type_, relative_path, start, end in batch:
+            file_id = files.get(relative_path)
+            if file_id is None:
+                cursor = connection.execute(
+                    "INSERT INTO files (path, endpoint, type) VALUES (?, ?, ?)",
+                    (relative_path, endpoint_type, type_),
+                )
+                file_id = files[relative_path] = cursor.lastrowid
+            for offset, line in _read_lines(
+                os.path.join(self.base_dir, relative_path), start, end
+            ):
+                if not line.startswith(b"{"):
+                    continue
+                try:
+                    get = {
+                        field: extract_field(line, field) for field in self.fields
+                    }.get
+                except ValueError:
+                    continue
+                row = [
+                    next_id,
+                    file_id,
+                    offset,
+                    len(line),
+                    _timestamp(get(TIMESTAMP)) if timestamped else None,
+                ]
+                for field in columns:
+                    value = get(field)
+                    row.append(value if value.__class__ is str else _text(value))
+                rows.append(row)
+                next_id += 1
+                if len(rows) >= self.batch_rows:
+                    _insert(connection, insert, rows)
+                    rows = []
+
+        _insert(connection, insert, rows)
+        return next_id
+
+
+def _read_lines(file_path, start, end):
+    """ (offset, line) of each complete line between two offsets of a
+        file. Stops early if the file was truncated since.
+    """
+
+    try:
+        with open(file_path, "rb") as _f:
+            _f.seek(start)
+            data = _f.read(end - start)
+    except FileNotFoundError:
+        return []
+    lines = []
+    offset = start
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b"\n"):
+            break
+        lines.append((offset, line))
+        offset += len(line)
+    return lines
+
+
+def _insert(connection, insert, rows):
+    """ Insert rows in one transaction """
+
+    if rows:
+        with connection:
+            connection.executemany(insert, rows)
+
+
+def _timestamp(value):
+    """ A timestamp as an int, or None if it isn't a number """
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    return None
+
+
+def _text(value):
+    """ A field value as it's indexed: numbers as text, anything else
+        (missing, objects, lists) not at all.
+    """
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+
+def _column(field):
+    """ Name of the column of an indexed field """
+
+    return _COLUMN_PREFIX + field
+
+
+def _quote(identifier):
+    """ Quote a table, column or index name for SQL """
+
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def _columns(connection):
+    """ Names of the columns of the records table """
+
+    return {row[1] for row in connection.execute("PRAGMA table_info(records)")}
+
+
+def read_records(base_dir, matches, codec=None):
+    """ Read the logs found by LogIndex.lookup by seeking straight to
+        them.
+
+    Returns
+    ----------
+    list
+        (path, log dict) of every match that is still in its file.
+    """
+
+    codec = codec or get_codec()
+    by_file = defaultdict(list)
+    for path, offset, length in matches:
+        by_file[path].append((offset, length))
+
+    found = {}
+    for path, locations in by_file.items():
+        try:
+            _f = open(os.path.join(base_dir, path), "rb")
+        except FileNotFoundError:
+            continue
+        with _f:
+            for offset, length in locations:
+                _f.seek(offset)
+                line = _f.read(length)
+                if len(line) == length and line.endswith(b"\n"):
+                    try:
+                        found[(path, offset)] = codec.loads(line)
+                    except ValueError:
+                        pass
+
+    return [
+        (path, found[(path, offset)])
+        for path, offset, _ in matches
+        if (path, offset) in found
+    ]
@@ -0,0 +1,314 @@
+"""Defines the metrics kept while pulling down logs, and exporters that
+publish them in the Prometheus text format.
+
+Every metric is labelled by tenant, endpoint ('event' or 'alert') and
+type, so a throughput drop can be traced back to the tenant and type
+that cause it. The tenant label is left out when there is no tenant (a
+single tenant set up from NETSKOPE_TENANT_NAME). The
+metrics are exported either as a textfile for the node_exporter
+textfile collector (NETSKOPE_METRICS_TEXTFILE), rewritten after every
+run or daemon cycle, or served over HTTP at /metrics in daemon mode
+(NETSKOPE_METRICS_PORT).
+
+Metrics are only updated from the event loop, so there is no locking.
+"""
+
+import logging
+import os
+import time
+
+from aiohttp import web
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+WRITE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+DEPTH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class Metric:
+
+    """ Base class for metrics. Holds one value per set of labels.
+
+    Attributes
+    ----------
+    name: str
+        Metric name, ex: netskope_requests_total
+    documentation: str
+        The HELP text.
+    labelnames: tuple
+        Names of the labels, in order. Labels set to "" aren't
+        rendered.
+    """
+
+    kind = "untyped"
+
+    def __init__(
+        self, name, documentation, labelnames=("tenant", "endpoint", "type")
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def value(self, *labels):
+        """ Current value for a set of labels """
+
+        return self._values.get(labels, 0)
+
+    def render(self):
+        """ Lines of Prometheus text format for this metric """
+
+        lines = [
+            "# HELP {} {}".format(self.name, _escape_help(self.documentation)),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        for labels, value in sorted(self._values.items()):
+            lines.append(
+                "{}{} {}".format(self.name, self._label_text(labels), _number(value))
+            )
+        return lines
+
+    def _label_text(self, labels, extra=()):
+        pairs = [
+            (name, value) for name, value in zip(self.labelnames, labels) if value != ""
+        ] + list(extra)
+        if not pairs:
+            return ""
+        return "{{{}}}".format(
+            ",".join('{}="{}"'.format(name, _escape(value)) for name, value in pairs)
+        )
+
+
+class Counter(Metric):
+
+    """ Value that only goes up """
+
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        """ Add amount to the counter for a set of labels """
+
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+
+    """ Value that can go up and down """
+
+    kind = "gauge"
+
+    def set(self, *labels, value):
+        """ Set the gauge for a set of labels """
+
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+
+    """ Distribution of observed values in cumulative buckets """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets, **kwargs):
+        super().__init__(name, documentation, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value):
+        """ Record one observation for a set of labels """
+
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][index] += 1
+        state[1] += value
+        state[2] += 1
+
+    def count(self, *labels):
+        """ Number of observations for a set of labels """
+
+        state = self._values.get(labels)
+        return state[2] if state else 0
+
+    def value(self, *labels):
+        """ Sum of the observations for a set of labels """
+
+        state = self._values.get(labels)
+        return state[1] if state else 0
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, _escape_help(self.documentation)),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            for bound, bucket in zip(self.buckets, counts):
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        self.name,
+                        self._label_text(labels, [("le", _number(bound))]),
+                        bucket,
+                    )
+                )
+            lines.append(
+                "{}_bucket{} {}".format(
+                    self.name, self._label_text(labels, [("le", "+Inf")]), count
+                )
+            )
+            lines.append(
+                "{}_sum{} {}".format(self.name, self._label_text(labels), _number(total))
+            )
+            lines.append("{}_count{} {}".format(self.name, self._label_text(labels), count))
+        return lines
+
+
+class NetskopeMetrics:
+
+    """ Every metric kept by the clients and the writer. """
+
+    def __init__(self):
+        self.requests = Counter(
+            "netskope_requests_total",
+            "API requests by response status, after retries.",
+            labelnames=("tenant", "endpoint", "type", "status"),
+        )
+        self.retries = Counter(
+            "netskope_retries_total", "API requests retried (throttled or failed)."
+        )
+        self.request_latency = Histogram(
+            "netskope_request_duration_seconds",
+            "Time taken by the last attempt of each API request.",
+            LATENCY_BUCKETS,
+        )
+        self.response_bytes = Counter(
+            "netskope_response_bytes_total", "Bytes of API response bodies."
+        )
+        self.hedges = Counter(
+            "netskope_hedged_requests_total",
+            "API requests that were slow enough to send a duplicate for.",
+        )
+        self.hedges_won = Counter(
+            "netskope_hedges_won_total",
+            "Duplicate (hedged) API requests that responded first.",
+        )
+        self.pages = Counter("netskope_pages_total", "Pages of logs received.")
+        self.records = Counter("netskope_records_total", "Logs received.")
+        self.filtered = Counter(
+            "netskope_filtered_records_total",
+            "Logs dropped by the field filters (NETSKOPE_FILTERS_FILE).",
+        )
+        self.pagination_depth = Histogram(
+            "netskope_pagination_depth",
+            "Pages requested per window.",
+            DEPTH_BUCKETS,
+        )
+        self.write_latency = Histogram(
+            "netskope_write_duration_seconds",
+            "Time taken to write a batch of logs or commit a window.",
+            WRITE_BUCKETS,
+        )
+        self.ingestion_lag = Gauge(
+            "netskope_ingestion_lag_seconds",
+            "Seconds between now and the newest log timestamp received.",
+        )
+        # Newest log timestamp received per set of labels.
+        self._newest = {}
+
+    def observe_newest(self, *labels, timestamp):
+        """ Set the ingestion lag from a page's newest log timestamp. Only
+            a timestamp newer than any seen before moves it, so a page of
+            an older window that comes in late doesn't make the lag look
+            worse than it is.
+        """
+
+        if timestamp <= self._newest.get(labels, float("-inf")):
+            return
+        self._newest[labels] = timestamp
+        self.ingestion_lag.set(*labels, value=time.time() - timestamp)
+
+    def all(self):
+        """ Every metric, in the order they're rendered """
+
+        return [
+            self.requests,
+            self.retries,
+            self.request_latency,
+            self.response_bytes,
+            self.hedges,
+            self.hedges_won,
+            self.pages,
+            self.records,
+            self.filtered,
+            self.pagination_depth,
+            self.write_latency,
+            self.ingestion_lag,
+        ]
+
+    def render(self):
+        """ The metrics in Prometheus text format """
+
+        lines = []
+        for metric in self.all():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """ Write the metrics to path for the node_exporter textfile
+            collector. The file is replaced atomically so the collector
+            never reads half of it.
+        """
+
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "w") as _f:
+            _f.write(self.render())
+        os.replace(temporary, path)
+
+
+# Shared by every client and writer in the process.
+METRICS = NetskopeMetrics()
+
+
+async def start_http_server(port, host="0.0.0.0", metrics=None):
+    """ Serve the metrics at http://host:port/metrics from the running
+        event loop.
+
+    Returns
+    ----------
+    aiohttp.web.AppRunner
+        Call its cleanup() coroutine to stop serving.
+    """
+
+    metrics = metrics or METRICS
+
+    async def handler(request):  # pylint: disable=unused-argument
+        return web.Response(
+            text=metrics.render(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return runner
+
+
+def _number(value):
+    """ Format a sample value """
+
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+
+def _escape(value):
+    """ Escape a label value """
+
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
@@ -0,0 +1,153 @@
+"""Defines the PageOffloader class which moves the CPU-heavy part of
+handling a page (decoding the response and encoding every log again for
+the log files) off the event loop and onto a pool of worker processes.
+
+Decoding and encoding a full page of 5000 logs takes long enough to
+hold up every other request in flight, and with a dozen types being
+pulled down at once the event loop runs out of CPU before the network
+does. Offloaded pages are sent to a worker as the raw response body
+and come back as the raw json bytes of each log (RawRecords), ready to
+be written. Streaming mode only, since write_logs expects dicts.
+
+Handing a page to another process costs a copy of the body each way,
+so only bodies of at least NETSKOPE_OFFLOAD_MIN_BYTES are offloaded.
+Find the crossover on your hardware with:
+    (venv) $ python -m benchmarks.bench_offload
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import json
+
+from netskope_fetcher.codec import get_codec
+from netskope_fetcher.config import env_int
+from netskope_fetcher.filters import compile_filter
+from netskope_fetcher.passthrough import RawRecords
+
+
+# Filters compiled by this worker process, keyed by their spec.
+_FILTERS = {}
+
+
+def encode_page(body, codec_name, spec=None):
+    """ Decode a response body, filter its logs and encode each of them
+        on its own. Runs in a worker process.
+
+    Parameters
+    ----------
+    body: bytes
+        The raw response body.
+    codec_name: str
+        Name of the JsonCodec to use (see netskope_fetcher.codec).
+    spec: dict
+        The type's filter spec (see netskope_fetcher.filters), if it
+        has one.
+
+    Returns
+    ----------
+    tuple
+        (status, list of json bytes per log, number of logs before
+        filtering). All None if the body couldn't be decoded; the last
+        two are None if there's no 'data' array.
+    """
+
+    codec = get_codec(codec_name)
+    try:
+        json_ = codec.loads(body)
+    except (TypeError, ValueError):
+        # Left for the event loop to report, the same way as any other
+        # bad response.
+        return None, None, None
+    if not isinstance(json_, dict):
+        return None, None, None
+
+    data = json_.get("data")
+    if not isinstance(data, list):
+        return json_.get("status"), None, None
+    received = len(data)
+    if spec is not None:
+        data = _filter(spec)(data)
+    dumps = codec.dumps
+    return json_.get("status"), [dumps(log) for log in data], received
+
+
+def _filter(spec):
+    """ The compiled filter for a spec, compiled on first use """
+
+    key = json.dumps(spec, sort_keys=True)
+    filter_ = _FILTERS.get(key)
+    if filter_ is None:
+        filter_ = _FILTERS[key] = compile_filter(spec)
+    return filter_
+
+
+class PageOffloader:
+
+    """ Pool of worker processes that decode and encode pages.
+
+    Attributes
+    ----------
+    workers: int
+        Number of worker processes. 0 to leave every page on the event
+        loop.
+    min_bytes: int
+        Smallest response body worth sending to a worker.
+    """
+
+    def __init__(self, **kwargs):
+        self.workers = kwargs.get("workers")
+        if self.workers is None:
+            self.workers = env_int("NETSKOPE_OFFLOAD_WORKERS", 0)
+        self.min_bytes = kwargs.get("min_bytes")
+        if self.min_bytes is None:
+            self.min_bytes = env_int("NETSKOPE_OFFLOAD_MIN_BYTES", 262144)
+        self._executor = None
+
+    @property
+    def enabled(self):
+        """ Are pages offloaded at all? """
+
+        return self.workers > 0
+
+    def wants(self, body):
+        """ Is the body big enough to be worth offloading? """
+
+        return self.enabled and len(body) >= self.min_bytes
+
+    async def encode_page(self, body, codec, spec=None):
+        """ Decode, filter and re-encode a response body in a worker
+            process.
+
+        Parameters
+        ----------
+        body: bytes
+            The raw response body.
+        codec: netskope_fetcher.codec.JsonCodec
+            The workers use the same backend.
+        spec: dict
+            The type's filter spec, if it has one.
+
+        Returns
+        ----------
+        tuple
+            (status, RawRecords, number of logs before filtering). See
+            encode_page.
+        """
+
+        if self._executor is None:
+            # Started on first use so nothing is forked until there is
+            # a page to hand over.
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        status, records, received = await asyncio.get_event_loop().run_in_executor(
+            self._executor, encode_page, body, codec.name, spec
+        )
+        if records is not None:
+            records = RawRecords(records)
+        return status, records, received
+
+    def close(self):
+        """ Stop the worker processes """
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
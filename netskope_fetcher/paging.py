@@ -0,0 +1,215 @@
+"""Defines the page size settings and the PageTuner class which picks
+the page size ('limit') of each request per endpoint and type.
+
+The page size is sent to the API as 'limit' and read, most specific
+first, from:
+
+    NETSKOPE_PAGE_SIZES=event/page=2000,alert/DLP=1000   (per type)
+    NETSKOPE_EVENT_PAGE_SIZE / NETSKOPE_ALERT_PAGE_SIZE  (per endpoint)
+    NETSKOPE_PAGE_SIZE                                   (everything)
+
+and capped at NETSKOPE_PAGE_SIZE_MAX, the most the API returns for one
+request. A page is only taken to be the last one when it holds fewer
+logs than were asked for, so a size above what the API really returns
+would end pagination early.
+
+With NETSKOPE_PAGE_AUTO_TUNE, a PageTuner starts from the configured
+size and adjusts it from what the responses look like:
+
+    - a failed request or a high rate of retried ones halves it,
+    - a response slower than NETSKOPE_PAGE_TARGET_LATENCY seconds or
+      bigger than NETSKOPE_PAGE_MAX_BYTES shrinks it in proportion,
+    - a full page that came back in under half of both grows it by a
+      quarter, up to NETSKOPE_PAGE_SIZE_MAX.
+
+Only the size of the next request changes. Pagination keeps track of
+the offset it has reached, so 'skip' stays right whatever size each
+page was asked for with.
+
+The API may quietly cap pages below NETSKOPE_PAGE_SIZE_MAX, and a short
+page is how pagination knows it has reached the end. So a size bigger
+than any the API has sent a full page for yet is only ever asked for
+one page at a time, and pagination moves on by the logs that came
+back. If that page is short, it may just be capped: the tuner goes back
+to the largest size that was served in full, keeps the type below the
+count received from then on, and pagination carries on with the next
+page instead of stopping.
+"""
+
+from netskope_fetcher.config import env_float, env_int, env_list
+
+
+class PageTuner:
+
+    """ Page size per endpoint and type, tuned from the responses.
+
+    Attributes
+    ----------
+    min_size: int
+        Smallest page size it will go down to (or the configured size,
+        if that is smaller).
+    max_size: int
+        Largest page size it will go up to.
+    target_latency: float
+        Seconds a response should take at most.
+    max_bytes: int
+        Bytes a response should hold at most.
+    max_error_rate: float
+        Share of retried or failed requests above which the size is
+        halved.
+    sizes: dict
+        Current page size keyed by (endpoint_type, type_).
+    """
+
+    def __init__(self, **kwargs):
+        self.min_size = kwargs.get("min_size") or env_int(
+            "NETSKOPE_PAGE_SIZE_MIN", 500
+        )
+        self.max_size = kwargs.get("max_size") or page_size_max()
+        self.target_latency = kwargs.get("target_latency") or env_float(
+            "NETSKOPE_PAGE_TARGET_LATENCY", 10.0
+        )
+        self.max_bytes = kwargs.get("max_bytes") or env_int(
+            "NETSKOPE_PAGE_MAX_BYTES", 33554432
+        )
+        self.max_error_rate = kwargs.get("max_error_rate") or env_float(
+            "NETSKOPE_PAGE_MAX_ERROR_RATE", 0.2
+        )
+        self.sizes = {}
+        self._floors = {}
+        self._error_rates = {}
+        # Largest size the API has sent a full page for (or the
+        # configured size), and the most a short page has shown it to
+        # send, per type.
+        self._served = {}
+        self._caps = {}
+
+    def size(self, endpoint_type, type_, configured):
+        """ Page size for the next request of the type. Starts at the
+            configured size.
+        """
+
+        key = (endpoint_type, type_)
+        if key not in self.sizes:
+            self.sizes[key] = min(configured, self.max_size)
+            self._floors[key] = min(configured, self.min_size)
+            self._served[key] = self.sizes[key]
+        return self.sizes[key]
+
+    def served(self, endpoint_type, type_, limit):
+        """ Has the API sent a full page at this size (or a bigger one)
+            for the type? A short page is only the last one if so.
+        """
+
+        self.size(endpoint_type, type_, limit)
+        return limit <= self._served[(endpoint_type, type_)]
+
+    def last_page(self, endpoint_type, type_, limit, received):
+        """ Can a short page be taken as the last one? Not if it was
+            asked for at a size the API hasn't served in full yet: the
+            API may cap pages at what it sent. The size then goes back
+            to the largest one served in full and never grows past what
+            was received.
+        """
+
+        key = (endpoint_type, type_)
+        if self.served(endpoint_type, type_, limit) or not received:
+            return True
+        served = self._served[key]
+        self._caps[key] = max(received, served)
+        self.sizes[key] = min(self.sizes[key], served)
+        return False
+
+    def observe(self, endpoint_type, type_, limit, received, **kwargs):
+        """ Adjust the size from a response.
+
+        Parameters
+        ----------
+        limit: int
+            Page size the request asked for.
+        received: int
+            Logs in the response.
+        kwargs:
+            latency (seconds), size (bytes of the body) and retries (how
+            many times the request was retried).
+        """
+
+        key = (endpoint_type, type_)
+        retries = kwargs.get("retries") or 0
+        error_rate = self._record(key, retries / (retries + 1.0))
+        latency = kwargs.get("latency") or 0.0
+        body_size = kwargs.get("size") or 0
+        current = self.size(endpoint_type, type_, limit)
+        if received >= limit:
+            self._served[key] = max(self._served[key], limit)
+
+        factor = 1.0
+        if error_rate > self.max_error_rate:
+            factor = 0.5
+        if latency > self.target_latency:
+            factor = min(factor, self.target_latency / latency)
+        if body_size > self.max_bytes:
+            factor = min(factor, float(self.max_bytes) / body_size)
+        if factor < 1.0 and limit <= current:
+            # Requests sent at a bigger size, before it came down, don't
+            # bring it down again.
+            self.sizes[key] = self._clamp(key, int(current * max(factor, 0.5)))
+        elif (
+            factor == 1.0
+            and received >= limit == current
+            and latency < self.target_latency / 2
+            and body_size < self.max_bytes / 2
+        ):
+            # Only a full page at the current size says anything about
+            # whether a bigger one would be fine.
+            self.sizes[key] = self._clamp(key, int(current * 1.25))
+
+    def failed(self, endpoint_type, type_, limit):
+        """ Halve the size after a failed request """
+
+        key = (endpoint_type, type_)
+        self._record(key, 1.0)
+        current = self.size(endpoint_type, type_, limit)
+        if limit <= current:
+            self.sizes[key] = self._clamp(key, current // 2)
+
+    def _record(self, key, errors):
+        """ Fold a request's share of errors into the type's moving
+            average error rate and return it.
+        """
+
+        rate = self._error_rates.get(key, 0.0) * 0.8 + errors * 0.2
+        self._error_rates[key] = rate
+        return rate
+
+    def _clamp(self, key, size):
+        """ Keep a type's size between its floor and max_size (or the
+            cap found for it)
+        """
+
+        cap = min(self.max_size, self._caps.get(key, self.max_size))
+        return max(min(size, cap), self._floors[key])
+
+
+def page_size_max():
+    """ The most logs the API returns for one request """
+
+    return env_int("NETSKOPE_PAGE_SIZE_MAX", 5000)
+
+
+def configured_page_size(endpoint_type, type_, default):
+    """ Page size set for an endpoint and type in the environment (see
+        the module docstring), or the default (NETSKOPE_PAGE_SIZE),
+        capped at NETSKOPE_PAGE_SIZE_MAX.
+    """
+
+    if endpoint_type is None:
+        return min(default, page_size_max())
+    size = env_int("NETSKOPE_{}_PAGE_SIZE".format(endpoint_type.upper()), default)
+    wanted = "{}/{}".format(endpoint_type, type_)
+    for entry in env_list("NETSKOPE_PAGE_SIZES"):
+        name, _, value = entry.rpartition("=")
+        if name.strip() == wanted:
+            size = int(value)
+    return min(size, page_size_max())
+
@@ -0,0 +1,405 @@
+"""Defines the PartitionSettings and PartitionManifest classes used to
+write each log type partitioned by the hour of its logs' 'timestamp'
+instead of to one ever-growing log file.
+
+Partitions live in logs/<endpoint>/<type>/YYYY/MM/DD/HH.ndjson (UTC),
+so one hour of logs can be read without scanning everything else:
+
+    logs/event/page/2026/10/17/14.ndjson
+    logs/event/page/2026/10/17/14.manifest.json
+
+Each partition has a small json manifest next to it:
+
+    {
+        "file": "14.ndjson",
+        "start": 1792245600,
+        "end": 1792249200,
+        "min_timestamp": 1792245601,
+        "max_timestamp": 1792249187,
+        "count": 48211,
+        "bytes": 61440012,
+        "checksum": "crc32:5f1c0a3e"
+    }
+
+The partition covers [start, end). The checksum is a crc32 of the whole
+partition file, kept up to date as logs are appended. Logs without a
+numeric timestamp go to logs/<endpoint>/<type>/undated.ndjson.
+
+The manifest is rewritten after the logs it describes, so a crash can
+leave it behind its partition. The writer checks 'bytes' against the
+size of the file before appending and rebuilds a stale manifest from
+the partition. Readers can do the same with load_manifest().
+"""
+
+from bisect import bisect_left
+from datetime import datetime, timezone
+import json
+import os
+import zlib
+
+from netskope_fetcher.config import env_bool, env_str
+from netskope_fetcher.passthrough import RawRecords, extract_field
+
+
+PARTITION_SECONDS = 3600
+
+UNDATED = "undated"
+
+PARTITION_SUFFIX = ".ndjson"
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+_NAME_FORMAT = "%Y/%m/%d/%H"
+
+
+class PartitionSettings:
+
+    """ Partitioning settings.
+
+    Attributes
+    ----------
+    enabled: bool
+        Are logs written to hourly partitions at all?
+    field: str
+        Epoch time field of a log that picks its partition.
+    """
+
+    def __init__(self, **kwargs):
+        self.enabled = kwargs.get("enabled")
+        if self.enabled is None:
+            self.enabled = env_bool("NETSKOPE_PARTITION_LOGS")
+        self.field = kwargs.get("field") or env_str(
+            "NETSKOPE_PARTITION_FIELD", "timestamp"
+        )
+
+
+class PartitionManifest:
+
+    """ What a partition file holds.
+
+    Attributes
+    ----------
+    file: str
+        Name of the partition file, relative to the manifest.
+    start: int
+        Epoch start of the hour the partition covers. None for the
+        undated partition.
+    end: int
+        Epoch end (exclusive) of that hour.
+    min_timestamp: int
+        Oldest timestamp in the partition. None while it's empty.
+    max_timestamp: int
+        Newest timestamp in the partition.
+    count: int
+        Number of logs in the partition.
+    bytes: int
+        Size of the partition file.
+    crc: int
+        crc32 of the partition file.
+    """
+
+    def __init__(self, file_, start=None, **kwargs):
+        self.file = file_
+        self.start = start
+        self.end = start + PARTITION_SECONDS if start is not None else None
+        self.min_timestamp = kwargs.get("min_timestamp")
+        self.max_timestamp = kwargs.get("max_timestamp")
+        self.count = kwargs.get("count", 0)
+        self.bytes = kwargs.get("bytes", 0)
+        self.crc = kwargs.get("crc", 0)
+
+    def add(self, data, count, min_timestamp=None, max_timestamp=None):
+        """ Account for 'count' logs appended to the partition as 'data' """
+
+        self.count += count
+        self.bytes += len(data)
+        self.crc = zlib.crc32(data, self.crc)
+        if min_timestamp is not None:
+            if self.min_timestamp is None or min_timestamp < self.min_timestamp:
+                self.min_timestamp = min_timestamp
+            if self.max_timestamp is None or max_timestamp > self.max_timestamp:
+                self.max_timestamp = max_timestamp
+
+    def to_dict(self):
+        """ The manifest as it's written to file """
+
+        return {
+            "file": self.file,
+            "start": self.start,
+            "end": self.end,
+            "min_timestamp": self.min_timestamp,
+            "max_timestamp": self.max_timestamp,
+            "count": self.count,
+            "bytes": self.bytes,
+            "checksum": "crc32:{:08x}".format(self.crc),
+        }
+
+    @classmethod
+    def from_dict(cls, manifest):
+        """ Read a manifest back from its dict. Raises ValueError if it
+            isn't one.
+        """
+
+        try:
+            algorithm, crc = manifest["checksum"].split(":")
+            if algorithm != "crc32":
+                raise ValueError("Unknown checksum {}".format(algorithm))
+            return cls(
+                manifest["file"],
+                manifest["start"],
+                min_timestamp=manifest["min_timestamp"],
+                max_timestamp=manifest["max_timestamp"],
+                count=manifest["count"],
+                bytes=manifest["bytes"],
+                crc=int(crc, 16),
+            )
+        except (AttributeError, KeyError, TypeError) as _e:
+            raise ValueError("Not a partition manifest: {!r}".format(_e))
+
+    def save(self, path, sync=False):
+        """ Atomically write the manifest to path """
+
+        temporary = "{}.tmp".format(path)
+        with open(temporary, "w") as _f:
+            json.dump(self.to_dict(), _f)
+            if sync:
+                _f.flush()
+                os.fsync(_f.fileno())
+        os.replace(temporary, path)
+
+
+def partition_name(timestamp):
+    """ Partition (relative path without suffix) a timestamp belongs
+        in. Ex: 2026/10/17/14, or 'undated' if it isn't a number.
+    """
+
+    start = partition_start(timestamp)
+    if start is None:
+        return UNDATED
+    return datetime.fromtimestamp(start, timezone.utc).strftime(_NAME_FORMAT)
+
+
+def partition_start(timestamp):
+    """ Epoch start of the hour a timestamp is in, or None if it isn't
+        a number.
+    """
+
+    if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool):
+        return None
+    return int(timestamp // PARTITION_SECONDS * PARTITION_SECONDS)
+
+
+def partition_path(directory, name):
+    """ Path to a partition file in a type's directory """
+
+    return os.path.join(directory, *name.split("/")) + PARTITION_SUFFIX
+
+
+def manifest_path(path):
+    """ Path to the manifest of a partition file """
+
+    return path[: -len(PARTITION_SUFFIX)] + MANIFEST_SUFFIX
+
+
+def group_by_partition(pages, field, codec):
+    """ Sort the logs of several pages into the partitions they belong
+        in, keeping their order.
+
+    Parameters
+    ----------
+    pages: list
+        Pages of logs, as dicts or RawRecords.
+    field: str
+        Timestamp field that picks the partition.
+    codec: netskope_fetcher.codec.JsonCodec
+        Encodes dicts, and decodes raw logs whose timestamp can't be
+        picked out on its own.
+
+    Returns
+    ----------
+    dict
+        Partition name -> [list of newline terminated json chunks,
+        count, min timestamp, max timestamp].
+    """
+
+    groups = {}
+    for page in pages:
+        raw = isinstance(page, RawRecords)
+        if raw:
+            timestamps = [_raw_timestamp(log, field, codec) for log in page]
+        else:
+            timestamps = [log.get(field) for log in page]
+
+        # A page almost always falls in a single hour, so check that
+        # first and encode it in one go.
+        try:
+            lowest, highest = min(timestamps), max(timestamps)
+        except (TypeError, ValueError):
+            lowest = highest = None
+        start = partition_start(lowest)
+        if start is not None and start == partition_start(highest):
+            chunk = page.to_lines() if raw else codec.dumps_lines(page)
+            _add(groups, partition_name(start), chunk, len(page), lowest, highest)
+            continue
+        if start is not None and partition_start(highest) is not None:
+            if all(a <= b for a, b in zip(timestamps, timestamps[1:])):
+                # Pages come oldest first, so one that straddles an hour
+                # is cut where the hour changes.
+                _add_sorted(groups, page, timestamps, codec)
+                continue
+
+        dumps = codec.dumps
+        names = {None: UNDATED}
+        for log, timestamp in zip(page, timestamps):
+            line = (log if raw else dumps(log)) + b"\n"
+            start = partition_start(timestamp)
+            name = names.get(start)
+            if name is None:
+                name = names[start] = partition_name(start)
+            if start is None:
+                _add(groups, name, line, 1)
+            else:
+                _add(groups, name, line, 1, timestamp, timestamp)
+    return groups
+
+
+def _add_sorted(groups, page, timestamps, codec):
+    """ Add a page of logs sorted by timestamp, an hour at a time """
+
+    raw = isinstance(page, RawRecords)
+    first = 0
+    while first < len(page):
+        start = partition_start(timestamps[first])
+        last = bisect_left(timestamps, start + PARTITION_SECONDS, first)
+        logs = page[first:last]
+        chunk = RawRecords(logs).to_lines() if raw else codec.dumps_lines(logs)
+        _add(
+            groups,
+            partition_name(start),
+            chunk,
+            last - first,
+            timestamps[first],
+            timestamps[last - 1],
+        )
+        first = last
+
+
+def _add(groups, name, chunk, count, lowest=None, highest=None):
+    """ Add a chunk of logs to its partition's group """
+
+    group = groups.get(name)
+    if group is None:
+        group = groups[name] = [[], 0, None, None]
+    group[0].append(chunk)
+    group[1] += count
+    if lowest is not None:
+        if group[2] is None or lowest < group[2]:
+            group[2] = lowest
+        if group[3] is None or highest > group[3]:
+            group[3] = highest
+
+
+def _raw_timestamp(record, field, codec):
+    """ Timestamp of a raw log, or None. Only decodes the whole log if
+        the field can't be picked out of it on its own.
+    """
+
+    stamp = extract_field(record, field)
+    if stamp is not None:
+        return stamp
+    decoded = codec.loads(record)
+    return decoded.get(field) if isinstance(decoded, dict) else None
+
+
+def new_manifest(path):
+    """ Empty manifest for a partition file """
+
+    name = os.path.basename(path)
+    start = None
+    if name != UNDATED + PARTITION_SUFFIX:
+        parts = path[: -len(PARTITION_SUFFIX)].split(os.sep)[-4:]
+        start = int(
+            datetime.strptime("/".join(parts), _NAME_FORMAT)
+            .replace(tzinfo=timezone.utc)
+            .timestamp()
+        )
+    return PartitionManifest(name, start)
+
+
+def rebuild_manifest(path, field, codec):
+    """ Build a partition's manifest by reading the partition """
+
+    manifest = new_manifest(path)
+    if not os.path.exists(path):
+        return manifest
+    with open(path, "rb") as _f:
+        for line in _f:
+            if not line.strip():
+                manifest.add(line, 0)
+                continue
+            decoded = codec.loads(line)
+            timestamp = decoded.get(field) if isinstance(decoded, dict) else None
+            if partition_start(timestamp) is None:
+                timestamp = None
+            manifest.add(line, 1, timestamp, timestamp)
+    return manifest
+
+
+def load_manifest(path, field, codec):
+    """ The manifest of a partition file. Rebuilt (and saved) from the
+        partition if it's missing, unreadable or doesn't match the size
+        of the file.
+    """
+
+    manifest_file = manifest_path(path)
+    try:
+        with open(manifest_file) as _f:
+            manifest = PartitionManifest.from_dict(json.load(_f))
+    except (FileNotFoundError, ValueError):
+        manifest = None
+
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if manifest is None or manifest.bytes != size:
+        manifest = rebuild_manifest(path, field, codec)
+        if size:
+            manifest.save(manifest_file)
+    return manifest
+
+
+def find_partitions(directory, start, end):
+    """ Manifests of the partitions in a type's directory that may hold
+        logs in (start, end], oldest first. Only the hours in the range
+        are looked at, so the cost doesn't grow with the data kept.
+
+    Parameters
+    ----------
+    directory: str
+        The type's directory. Ex: logs/event/page
+    start: int
+        Epoch start of the range (exclusive, like the API).
+    end: int
+        Epoch end of the range.
+
+    Returns
+    ----------
+    list
+        Manifest dicts, each with the full 'path' to its partition
+        added.
+    """
+
+    manifests = []
+    hour = partition_start(start)
+    while hour is not None and hour <= end:
+        partition = partition_path(directory, partition_name(hour))
+        try:
+            with open(manifest_path(partition)) as _f:
+                manifest = json.load(_f)
+        except FileNotFoundError:
+            manifest = None
+        if manifest is not None and manifest.get("max_timestamp") is not None:
+            lowest, highest = manifest["min_timestamp"], manifest["max_timestamp"]
+            if highest > start and lowest <= end:
+                manifest["path"] = partition
+                manifests.append(manifest)
+        hour += PARTITION_SECONDS
+    return manifests
@@ -0,0 +1,228 @@
+"""Splits a raw Netskope API response body into the raw bytes of each
+log in its 'data' array, without decoding the logs into dicts.
+
+Used by passthrough mode: only the top-level 'status' is decoded and
+each log is written to file exactly as the API sent it.
+"""
+
+import json
+import re
+
+
+# A json string, including its quotes (written 'unrolled' so the regex
+# engine consumes runs of plain characters at once).
+_STRING_PATTERN = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_STRING = re.compile(_STRING_PATTERN)
+
+# Strings and brackets. Used to find the end of an object or array.
+_TOKEN = re.compile(_STRING_PATTERN + rb"|[\[\]{}]")
+
+# A number, true, false or null.
+_SCALAR = re.compile(rb"[^,\]}\s]+")
+
+_WHITESPACE = re.compile(rb"\s*")
+
+
+def _object_pattern(depth):
+    """ Build a regex matching a json object with objects/arrays nested
+        no deeper than 'depth'. Lets the regex engine find the end of a
+        typical (mostly flat) log in a single call.
+
+        Written as plain* (special plain*)* so there is only one way to
+        match any input. That keeps a failed match (a log nested deeper
+        than 'depth') linear instead of backtracking exponentially.
+    """
+
+    plain = rb'[^{}\[\]"]*'
+    content = plain + rb"(?:" + _STRING_PATTERN + plain + rb")*"
+    for _ in range(depth):
+        special = _STRING_PATTERN + rb"|\{" + content + rb"\}|\[" + content + rb"\]"
+        content = plain + rb"(?:(?:" + special + rb")" + plain + rb")*"
+    return re.compile(rb"\{" + content + rb"\}")
+
+
+_RECORD = _object_pattern(2)
+
+
+class RawRecords(list):
+
+    """ List of logs as raw json bytes (one bytes object per log).
+
+        The writer recognizes this type and writes each item as one
+        line instead of encoding it.
+    """
+
+    def to_lines(self):
+        """ Newline delimited json bytes """
+
+        if not self:
+            return b""
+        return b"\n".join(self) + b"\n"
+
+
+def split_response(body):
+    """ Split a response body into its 'status' and the raw logs in
+        its 'data' array.
+
+    Parameters
+    ----------
+    body: bytes
+        The raw response body.
+
+    Returns
+    ----------
+    tuple
+        (status, RawRecords). status is None if the body has no
+        'status' key. RawRecords is None if there's no 'data' array.
+
+    Raises
+    ----------
+    ValueError
+        If the body isn't a json object.
+    """
+
+    status = None
+    records = None
+
+    pos = _skip_whitespace(body, 0)
+    _expect(body, pos, b"{")
+    pos = _skip_whitespace(body, pos + 1)
+    if body[pos : pos + 1] == b"}":
+        return status, records
+
+    while True:
+        match = _STRING.match(body, pos)
+        if match is None:
+            raise ValueError("Expected a key at position {}".format(pos))
+        key = match.group()
+        pos = _skip_whitespace(body, match.end())
+        _expect(body, pos, b":")
+        pos = _skip_whitespace(body, pos + 1)
+
+        if key == b'"data"' and body[pos : pos + 1] == b"[":
+            records, pos = _split_array(body, pos)
+        else:
+            end = _skip_value(body, pos)
+            if key == b'"status"':
+                status = json.loads(body[pos:end].decode("utf-8"))
+            pos = end
+
+        pos = _skip_whitespace(body, pos)
+        if body[pos : pos + 1] == b"}":
+            return status, records
+        _expect(body, pos, b",")
+        pos = _skip_whitespace(body, pos + 1)
+
+
+def extract_field(record, field):
+    """ Pull a single top-level string or number field out of a raw log
+        without decoding the whole thing. Returns None if it's missing.
+
+        Only accepts '"field":' as a key of the outer object, so a value
+        or nested object that happens to contain the same text can't
+        fool it.
+    """
+
+    key = json.dumps(field).encode()
+    pos = 0
+    while True:
+        pos = record.find(key, pos)
+        if pos == -1:
+            return None
+        after = _skip_whitespace(record, pos + len(key))
+        if record[after : after + 1] == b":" and _is_top_level_key(record, pos):
+            value_start = _skip_whitespace(record, after + 1)
+            value_end = _skip_value(record, value_start)
+            return json.loads(record[value_start:value_end].decode("utf-8"))
+        pos += len(key)
+
+
+def _split_array(body, pos):
+    """ Return the raw items of the array starting at pos, and the
+        position just after it.
+    """
+
+    records = RawRecords()
+    pos = _skip_whitespace(body, pos + 1)
+    if body[pos : pos + 1] == b"]":
+        return records, pos + 1
+
+    while True:
+        match = _RECORD.match(body, pos)
+        end = match.end() if match is not None else _skip_value(body, pos)
+        record = body[pos:end]
+        if b"\n" in record:
+            # Raw newlines can only be whitespace between tokens (they
+            # must be escaped inside strings), so they're safe to drop.
+            record = record.replace(b"\r\n", b" ").replace(b"\n", b" ")
+        records.append(record)
+
+        pos = _skip_whitespace(body, end)
+        if body[pos : pos + 1] == b"]":
+            return records, pos + 1
+        _expect(body, pos, b",")
+        pos = _skip_whitespace(body, pos + 1)
+
+
+def _skip_value(body, pos):
+    """ Return the position just after the json value starting at pos """
+
+    first = body[pos : pos + 1]
+    if first == b'"':
+        match = _STRING.match(body, pos)
+        if match is None:
+            raise ValueError("Unterminated string at position {}".format(pos))
+        return match.end()
+
+    if first in (b"{", b"["):
+        depth = 0
+        for token in _TOKEN.finditer(body, pos):
+            char = token.group()
+            if char in (b"{", b"["):
+                depth += 1
+            elif char in (b"}", b"]"):
+                depth -= 1
+                if depth == 0:
+                    return token.end()
+        raise ValueError("Unterminated value at position {}".format(pos))
+
+    match = _SCALAR.match(body, pos)
+    if match is None:
+        raise ValueError("Expected a value at position {}".format(pos))
+    return match.end()
+
+
+def _is_top_level_key(record, pos):
+    """ Does the string starting at pos of a raw log sit directly in
+        the log's outer object (not inside a string or nested value)?
+    """
+
+    depth = 0
+    for token in _TOKEN.finditer(record):
+        if token.start() == pos:
+            return depth == 1
+        if token.start() > pos or token.end() > pos:
+            return False
+        char = token.group()
+        if char in (b"{", b"["):
+            depth += 1
+        elif char in (b"}", b"]"):
+            depth -= 1
+    return False
+
+
+def _skip_whitespace(body, pos):
+    """ Return the position of the next non-whitespace byte """
+
+    return _WHITESPACE.match(body, pos).end()
+
+
+def _expect(body, pos, char):
+    """ Raise ValueError unless body[pos] is char """
+
+    if body[pos : pos + 1] != char:
+        raise ValueError(
+            "Expected {!r} at position {} but found {!r}".format(
+                char, pos, body[pos : pos + 1]
+            )
+        )
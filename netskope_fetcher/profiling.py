@@ -0,0 +1,237 @@
+"""Defines the PhaseTimers class which adds up the wall-clock time spent
+in each phase (fetch, decode, write, checkpoint) per endpoint and type,
+and the Profiler used by 'netskope_log_fetcher.py --profile' to find
+out why a run is slow.
+
+The Profiler can capture any of:
+    cpu     cProfile stats of the event loop thread.
+    memory  The top allocators according to tracemalloc.
+    loop    asyncio debug mode. Callbacks that block the event loop
+            for longer than NETSKOPE_PROFILE_SLOW_CALLBACK seconds are
+            logged.
+
+Everything is written to logs/system/profile-<time>-*.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+import cProfile
+import json
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+
+from netskope_fetcher.config import env_float, env_int
+
+
+PHASES = ("fetch", "decode", "write", "checkpoint")
+
+PROFILE_OPTIONS = ("cpu", "memory", "loop")
+
+
+class PhaseTimers:
+
+    """ Wall-clock seconds and number of calls per endpoint, type and
+        phase. Phases overlap across types (they run concurrently), so
+        the totals can add up to more than the length of the run.
+    """
+
+    def __init__(self):
+        self._totals = {}
+
+    def add(self, endpoint_type, type_, phase, seconds):
+        """ Add 'seconds' to a phase """
+
+        key = (endpoint_type, type_, phase)
+        total = self._totals.get(key)
+        if total is None:
+            total = self._totals[key] = [0.0, 0]
+        total[0] += seconds
+        total[1] += 1
+
+    @contextmanager
+    def time(self, endpoint_type, type_, phase):
+        """ Time the body of a 'with' block """
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(endpoint_type, type_, phase, time.perf_counter() - started)
+
+    def seconds(self, endpoint_type, type_, phase):
+        """ Total seconds spent in a phase """
+
+        return self._totals.get((endpoint_type, type_, phase), [0.0, 0])[0]
+
+    def as_dict(self):
+        """ {'endpoint/type': {'phase': {'seconds': s, 'calls': n}}} """
+
+        report = OrderedDict()
+        for (endpoint_type, type_, phase), (seconds, calls) in sorted(
+            self._totals.items()
+        ):
+            name = "{}/{}".format(endpoint_type, type_)
+            report.setdefault(name, OrderedDict())[phase] = {
+                "seconds": round(seconds, 6),
+                "calls": calls,
+            }
+        return report
+
+    def render(self):
+        """ Table of seconds per phase, one row per endpoint/type """
+
+        lines = [
+            "{:<36}".format("endpoint/type")
+            + "".join("{:>12}".format(phase) for phase in PHASES)
+        ]
+        for name, phases in self.as_dict().items():
+            lines.append(
+                "{:<36}".format(name)
+                + "".join(
+                    "{:>12.3f}".format(phases.get(phase, {}).get("seconds", 0.0))
+                    for phase in PHASES
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """ Forget everything timed so far """
+
+        self._totals = {}
+
+
+# Shared by every client and writer in the process.
+TIMERS = PhaseTimers()
+
+
+class Profiler:
+
+    """ Captures cProfile, tracemalloc and asyncio debug output for the
+        length of a run.
+
+    Attributes
+    ----------
+    directory: str
+        Where the profile files are written.
+    options: set
+        Which of PROFILE_OPTIONS are captured.
+    prefix: str
+        Common path prefix of the files written.
+    """
+
+    def __init__(self, directory, options=PROFILE_OPTIONS, timers=None):
+        unknown = set(options) - set(PROFILE_OPTIONS)
+        if unknown:
+            raise ValueError(
+                "Unknown --profile option(s) {}. Choose from: {}".format(
+                    ", ".join(sorted(unknown)), ", ".join(PROFILE_OPTIONS)
+                )
+            )
+        self.directory = directory
+        self.options = set(options)
+        self.timers = timers or TIMERS
+        self.prefix = os.path.join(
+            directory, "profile-{}".format(datetime.now().strftime("%Y%m%dT%H%M%S"))
+        )
+        self._profile = None
+        self._loop = None
+        self._loop_handler = None
+        self._started = None
+
+    def start(self, loop):
+        """ Start capturing. Call before the run starts. """
+
+        self.timers.reset()
+        self._started = time.perf_counter()
+
+        if "loop" in self.options:
+            self._loop = loop
+            loop.set_debug(True)
+            loop.slow_callback_duration = env_float(
+                "NETSKOPE_PROFILE_SLOW_CALLBACK", 0.1
+            )
+            self._loop_handler = logging.FileHandler(self.prefix + "-asyncio.log")
+            self._loop_handler.setFormatter(
+                logging.Formatter("%(asctime)s;%(levelname)s:%(message)s")
+            )
+            logging.getLogger("asyncio").addHandler(self._loop_handler)
+
+        if "memory" in self.options:
+            tracemalloc.start(env_int("NETSKOPE_PROFILE_FRAMES", 10))
+
+        if "cpu" in self.options:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self):
+        """ Stop capturing and write the results.
+
+        Returns
+        ----------
+        list
+            Paths of the files written.
+        """
+
+        written = []
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.prefix + ".pstats")
+            with open(self.prefix + "-cpu.txt", "w") as _f:
+                stats = pstats.Stats(self._profile, stream=_f)
+                stats.sort_stats("cumulative").print_stats(50)
+                stats.sort_stats("tottime").print_stats(50)
+            written += [self.prefix + ".pstats", self.prefix + "-cpu.txt"]
+            self._profile = None
+
+        if "memory" in self.options and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(self.prefix + "-memory.txt", "w") as _f:
+                _f.write(
+                    "Current: {:.1f} MB, peak: {:.1f} MB\n\n".format(
+                        current / 1e6, peak / 1e6
+                    )
+                )
+                for stat in snapshot.statistics("lineno")[:25]:
+                    _f.write("{}\n".format(stat))
+            written.append(self.prefix + "-memory.txt")
+
+        if self._loop_handler is not None:
+            logging.getLogger("asyncio").removeHandler(self._loop_handler)
+            self._loop_handler.close()
+            self._loop.set_debug(False)
+            self._loop_handler = None
+            written.append(self.prefix + "-asyncio.log")
+
+        elapsed = time.perf_counter() - self._started
+        with open(self.prefix + "-phases.txt", "w") as _f:
+            _f.write("Wall clock: {:.3f} seconds\n\n".format(elapsed))
+            _f.write(self.timers.render())
+        with open(self.prefix + "-phases.json", "w") as _f:
+            json.dump(
+                {"wall_clock_seconds": elapsed, "phases": self.timers.as_dict()},
+                _f,
+                indent=2,
+            )
+        written += [self.prefix + "-phases.txt", self.prefix + "-phases.json"]
+
+        logging.info("Profile written to %s", ", ".join(written))
+        return written
+
+
+def parse_profile_options(value):
+    """ Options from the --profile argument: a comma separated list of
+        PROFILE_OPTIONS, or 'all'.
+    """
+
+    options = {option.strip() for option in value.split(",") if option.strip()}
+    if not options or "all" in options:
+        return set(PROFILE_OPTIONS)
+    if not options <= set(PROFILE_OPTIONS):
+        raise ValueError(value)
+    return options
@@ -0,0 +1,127 @@
+"""Command line lookup of logs in the SQLite index kept with
+NETSKOPE_INDEX (see netskope_fetcher.index).
+
+Prints every matching log as a line of json, read straight from its
+offset in the log file:
+
+    (venv) $ python -m netskope_fetcher.query user=alice@example.com app=Box
+    (venv) $ python -m netskope_fetcher.query _id=f3a9... --type event/page
+    (venv) $ python -m netskope_fetcher.query srcip=10.0.0.7 --from 1792245600
+
+Run it from the directory that holds the 'logs' directory and the index
+(or a tenant's output_dir), or point --dir at it.
+"""
+
+import argparse
+import os
+import sys
+
+from netskope_fetcher.codec import get_codec
+from netskope_fetcher.index import LogIndex, read_records
+
+
+def parse_condition(text):
+    """ Parse a field=value argument """
+
+    field, separator, value = text.partition("=")
+    if not separator or not field:
+        raise argparse.ArgumentTypeError(
+            "Expected field=value, ex: user=alice@example.com. Got: {}".format(text)
+        )
+    return field, value
+
+
+def parse_args(argv=None):
+    """ Parse the command line arguments """
+
+    parser = argparse.ArgumentParser(
+        description="Look up logs in the index kept with NETSKOPE_INDEX."
+    )
+    parser.add_argument(
+        "conditions",
+        nargs="*",
+        type=parse_condition,
+        metavar="field=value",
+        help="Indexed field values a log must all have.",
+    )
+    parser.add_argument(
+        "--from",
+        dest="start",
+        type=int,
+        help="Only logs with a timestamp after this epoch time.",
+    )
+    parser.add_argument(
+        "--to",
+        dest="end",
+        type=int,
+        help="Only logs with a timestamp up to this epoch time.",
+    )
+    parser.add_argument(
+        "--type",
+        dest="types",
+        action="append",
+        metavar="ENDPOINT/TYPE",
+        help="Only logs of this type, ex: event/page. May be repeated.",
+    )
+    parser.add_argument("--limit", type=int, help="Print at most this many logs.")
+    parser.add_argument(
+        "--dir",
+        default=".",
+        help="Directory holding the 'logs' directory (default: current).",
+    )
+    parser.add_argument(
+        "--index",
+        help="Path to the index (default: index.sqlite in --dir).",
+    )
+    parser.add_argument(
+        "--with-path",
+        action="store_true",
+        help="Print the log file before each log, tab separated.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None, out=None):
+    """ Print the logs matching the command line. Returns the exit
+        status: 0 if any were found, 1 if none were.
+    """
+
+    args = parse_args(argv)
+    out = out or sys.stdout.buffer
+    index_path = args.index or os.path.join(args.dir, "index.sqlite")
+    if not os.path.exists(index_path):
+        raise SystemExit("No index at {}.".format(index_path))
+
+    codec = get_codec()
+    index = LogIndex(index_path, args.dir)
+    try:
+        matches = index.lookup(
+            dict(args.conditions),
+            start=args.start,
+            end=args.end,
+            types=args.types,
+            limit=args.limit,
+        )
+    except ValueError as _e:
+        raise SystemExit(str(_e))
+
+    found = 0
+    for path, log in read_records(args.dir, matches, codec):
+        if not _matches(log, args.conditions):
+            # The log file was rewritten since it was indexed.
+            continue
+        if args.with_path:
+            out.write(path.encode() + b"\t")
+        out.write(codec.dumps(log) + b"\n")
+        found += 1
+    return 0 if found else 1
+
+
+def _matches(log, conditions):
+    """ Does the log still have the values it was found by? """
+
+    return all(str(log.get(field)) == value for field, value in conditions)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
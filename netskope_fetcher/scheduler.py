@@ -0,0 +1,589 @@
+"""Defines the RequestScheduler class which owns the global budget of
+in-flight requests to the Netskope API.
+
+Every page request of every client goes through the scheduler. The
+budget is adjusted AIMD-style: it grows by one slot per 'round' of
+healthy responses and is halved when the API pushes back (429s, 5xx
+responses, connection errors or latency well above normal). Throttled
+and failed requests are retried with jittered exponential backoff,
+honoring any Retry-After header.
+
+Requests can be tagged with a 'share' (the tenant they're made for).
+Free slots are handed out round-robin between the shares that are
+waiting, so one busy tenant can't starve the others, and a Retry-After
+from one tenant's API only pauses that tenant.
+
+Within a share, requests are also tagged with a 'flow' (the endpoint
+and type they're for, ex: 'alert/quarantine'). Waiting requests of a
+flow with a higher priority (NETSKOPE_TYPE_PRIORITIES) always go first.
+Flows of the same priority get slots in proportion to their weights
+(NETSKOPE_TYPE_WEIGHTS) through weighted fair queuing. A quiet type
+that is waiting for a few pages doesn't queue behind the hundreds of
+pages of a busy one: it's served at its fair share, and the busy type
+gets whatever capacity is left.
+
+Each attempt has a deadline (NETSKOPE_REQUEST_DEADLINE): one that hasn't
+responded by then is given up on and retried like a failed request, so
+a stalled connection can't hold up a type's pagination (and the whole
+run) indefinitely. With NETSKOPE_HEDGE_PERCENTILE set, an attempt that
+hasn't responded by that percentile of its flow's recent latencies is
+hedged: a duplicate request goes out and the first response wins.
+Hedges only use a slot that's free right away (never one a waiting
+request could have had) and are capped at NETSKOPE_HEDGE_BUDGET of the
+requests made, so they can't add much load to an API that's already
+struggling.
+"""
+
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import random
+import time
+
+from aiohttp.client_exceptions import ClientError, ContentTypeError
+
+from netskope_fetcher.config import env_float, env_int, env_list
+
+# Recent latencies kept per flow to pick the hedge delay from.
+LATENCY_HISTORY = 200
+
+
+class FetchedResponse:
+
+    """ A response whose body has already been read. Quacks like the
+        parts of aiohttp.ClientResponse that are used by
+        BaseNetskopeClient._handle_response.
+
+    Attributes
+    ----------
+    status: int
+        HTTP status code.
+    headers: multidict.CIMultiDictProxy
+        Response headers.
+    body: bytes
+        The raw response body.
+    attempts: int
+        How many times the request was made (1 if it wasn't retried).
+    latency: float
+        Seconds taken by the last attempt.
+    hedged: bool
+        Whether a duplicate of the last attempt was sent.
+    hedge_won: bool
+        Whether the duplicate responded first.
+    """
+
+    def __init__(self, resp, body):
+        self.status = resp.status
+        self.headers = resp.headers
+        self.body = body
+        self.attempts = 1
+        self.latency = 0.0
+        self.hedged = False
+        self.hedge_won = False
+        self.request_info = getattr(resp, "request_info", None)
+        self.history = getattr(resp, "history", ())
+
+    async def read(self):
+        """ Return the raw body """
+
+        return self.body
+
+    async def text(self):
+        """ Return the body as a string """
+
+        return self.body.decode("utf-8", errors="replace")
+
+    async def json(self, loads=json.loads):
+        """ Decode the json body. Raises ContentTypeError (like aiohttp
+            does) if the response isn't json.
+        """
+
+        content_type = self.headers.get("Content-Type", "").lower()
+        if "application/json" not in content_type:
+            raise ContentTypeError(
+                self.request_info,
+                self.history,
+                message="Attempt to decode JSON with unexpected mimetype: {}".format(
+                    content_type
+                ),
+                headers=self.headers,
+            )
+        if not self.body.strip():
+            return None
+        return loads(self.body)
+
+
+class RequestScheduler:
+
+    """ Shared, self-adjusting limit on in-flight API requests.
+
+    Attributes
+    ----------
+    limit: float
+        Current in-flight request budget. Moves between min_limit and
+        max_limit.
+    in_flight: int
+        Requests currently holding a slot.
+    max_retries: int
+        How many times a throttled or failed request is retried.
+    backoff_base: float
+        Seconds of backoff for the first retry. Doubles each retry.
+    backoff_max: float
+        Cap on the backoff between retries.
+    latency_tolerance: float
+        A response slower than this multiple of the average latency
+        counts as congestion.
+    priorities: dict
+        Priority of each flow ('endpoint/type'). Waiting requests of a
+        higher priority flow are served first. 0 if not listed.
+    weights: dict
+        Weight of each flow ('endpoint/type'). Flows of the same
+        priority get slots in proportion to their weights. 1 if not
+        listed.
+    deadline: float
+        Seconds an attempt may take before it's given up on and
+        retried. None for no deadline.
+    hedge_percentile: float
+        Percentile of a flow's recent latencies after which an attempt
+        is hedged. 0 to never hedge.
+    hedge_budget: float
+        Most hedges that may be sent, as a share of the requests made.
+    hedge_min_samples: int
+        Latencies needed for a flow before its requests are hedged.
+    hedge_min_delay: float
+        Least seconds to wait before hedging.
+    stats: dict
+        Counters of requests, retries, throttled responses, errors,
+        attempts that ran past the deadline, and hedges sent and won.
+    """
+
+    def __init__(self, **kwargs):
+        self.min_limit = kwargs.get("min_limit") or 1
+        self.max_limit = kwargs.get("max_limit") or env_int(
+            "NETSKOPE_MAX_IN_FLIGHT", 32
+        )
+        self.limit = float(
+            kwargs.get("initial_limit") or env_int("NETSKOPE_INITIAL_IN_FLIGHT", 8)
+        )
+        self.max_retries = kwargs.get("max_retries")
+        if self.max_retries is None:
+            self.max_retries = env_int("NETSKOPE_MAX_RETRIES", 5)
+        self.backoff_base = kwargs.get("backoff_base") or env_float(
+            "NETSKOPE_BACKOFF_BASE", 1.0
+        )
+        self.backoff_max = kwargs.get("backoff_max") or env_float(
+            "NETSKOPE_BACKOFF_MAX", 60.0
+        )
+        self.latency_tolerance = kwargs.get("latency_tolerance") or env_float(
+            "NETSKOPE_LATENCY_TOLERANCE", 3.0
+        )
+        self.priorities = kwargs.get("priorities")
+        if self.priorities is None:
+            self.priorities = _flow_values("NETSKOPE_TYPE_PRIORITIES", int)
+        self.weights = kwargs.get("weights")
+        if self.weights is None:
+            self.weights = _flow_values("NETSKOPE_TYPE_WEIGHTS", float)
+        self.deadline = kwargs.get("deadline") or env_float(
+            "NETSKOPE_REQUEST_DEADLINE", 300.0
+        )
+        self.hedge_percentile = kwargs.get("hedge_percentile") or env_float(
+            "NETSKOPE_HEDGE_PERCENTILE", 0.0
+        )
+        self.hedge_budget = kwargs.get("hedge_budget") or env_float(
+            "NETSKOPE_HEDGE_BUDGET", 0.05
+        )
+        self.hedge_min_samples = kwargs.get("hedge_min_samples") or env_int(
+            "NETSKOPE_HEDGE_MIN_SAMPLES", 20
+        )
+        self.hedge_min_delay = kwargs.get("hedge_min_delay") or env_float(
+            "NETSKOPE_HEDGE_MIN_DELAY", 1.0
+        )
+        self.in_flight = 0
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "throttled": 0,
+            "errors": 0,
+            "deadlines": 0,
+            "hedges": 0,
+            "hedges_won": 0,
+        }
+        # Flow -> latencies of its recent requests.
+        self._latencies = {}
+        # Share -> FairQueue of futures waiting for a slot, in the
+        # order the shares take turns.
+        self._waiters = OrderedDict()
+        self._queues = {}
+        self._paused_until = {}
+        self._latency_average = None
+        self._last_decrease = 0.0
+
+    async def fetch(self, session, url, params=None, share=None, flow=None, **kwargs):
+        """ Make a GET request once a slot is available, retrying
+            throttled (429), 5xx and failed requests with backoff.
+
+        Parameters
+        ----------
+        session: aiohttp.ClientSession object
+            Used for non-blocking HTTP requests
+        url: str
+            URL to request.
+        params: dict
+            Query string parameters.
+        share: str
+            Who the request is made for (the tenant name). Shares take
+            turns when requests have to wait for a slot.
+        flow: str
+            What the request is for ('endpoint/type'). Picks its
+            priority and weight within the share.
+        kwargs:
+            Passed on to session.get.
+
+        Returns
+        ----------
+        FetchedResponse
+            The last response received. May still be a 429/5xx if the
+            retries ran out.
+        """
+
+        attempt = 0
+        while True:
+            await self._acquire(share, flow)
+            started = time.monotonic()
+            self.stats["requests"] += 1
+            try:
+                response = await asyncio.wait_for(
+                    self._race(session, url, params, share, flow, kwargs),
+                    self.deadline or None,
+                )
+            except (ClientError, asyncio.TimeoutError) as _e:
+                self._release()
+                self.stats["errors"] += 1
+                if self.deadline and time.monotonic() - started >= self.deadline:
+                    self.stats["deadlines"] += 1
+                self._decrease()
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logging.warning(
+                    "Request to %s failed (%r). Retrying in %.1f seconds "
+                    "(retry %s of %s).",
+                    url,
+                    _e,
+                    delay,
+                    attempt + 1,
+                    self.max_retries,
+                )
+            else:
+                self._release()
+                response.attempts = attempt + 1
+                response.latency = time.monotonic() - started
+                if not _is_throttled(response.status):
+                    self._on_success(response.latency)
+                    self._latencies.setdefault(
+                        flow, deque(maxlen=LATENCY_HISTORY)
+                    ).append(response.latency)
+                    return response
+
+                self.stats["throttled"] += 1
+                retry_after = _retry_after(response.headers)
+                self._decrease()
+                if retry_after:
+                    self._pause(retry_after, share)
+                if attempt >= self.max_retries:
+                    return response
+                delay = max(retry_after or 0.0, self._backoff(attempt))
+                logging.warning(
+                    "Received %s from %s. Retrying in %.1f seconds "
+                    "(retry %s of %s).",
+                    response.status,
+                    url,
+                    delay,
+                    attempt + 1,
+                    self.max_retries,
+                )
+
+            self.stats["retries"] += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _race(self, session, url, params, share, flow, kwargs):
+        """ Make one attempt at the request. If it hasn't responded by
+            the flow's hedge delay, send a duplicate and return whichever
+            response comes first. Raises if every request sent failed.
+        """
+
+        primary = asyncio.ensure_future(_get(session, url, params, kwargs))
+        delay = self._hedge_delay(flow)
+        if delay is None:
+            return await primary
+
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._may_hedge(share):
+                # The hedge holds a slot of its own until it's done.
+                self.in_flight += 1
+                self.stats["hedges"] += 1
+                hedge = asyncio.ensure_future(_get(session, url, params, kwargs))
+                hedge.add_done_callback(lambda _: self._release())
+                tasks.append(hedge)
+            hedged = len(tasks) > 1
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in tasks:
+                    if task in done and task.exception() is None:
+                        response = task.result()
+                        response.hedged = hedged
+                        if task is not primary:
+                            response.hedge_won = True
+                            self.stats["hedges_won"] += 1
+                        return response
+            # Every request sent failed. Only wait on the ones still in
+            # flight, and raise the primary's error once none are left.
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _hedge_delay(self, flow):
+        """ Seconds after which an attempt for the flow is hedged, or
+            None if it isn't (hedging is off or there isn't enough
+            history yet).
+        """
+
+        history = self._latencies.get(flow)
+        if not self.hedge_percentile or not history:
+            return None
+        if len(history) < self.hedge_min_samples:
+            return None
+        ordered = sorted(history)
+        index = int(len(ordered) * self.hedge_percentile / 100.0)
+        return max(ordered[min(index, len(ordered) - 1)], self.hedge_min_delay)
+
+    def _may_hedge(self, share=None):
+        """ Is there budget for a hedge and a slot no one is waiting for? """
+
+        if self.stats["hedges"] >= self.hedge_budget * self.stats["requests"]:
+            return False
+        return not self._waiters and self._can_grant(share)
+
+    async def _acquire(self, share=None, flow=None):
+        """ Wait for a free slot. Slots are handed out by priority and
+            weighted fair queuing between the flows of a share, and
+            round-robin between shares.
+        """
+
+        if not self._waiters and self._can_grant(share):
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_event_loop().create_future()
+        # A share keeps its queue (and the flows' virtual finish times)
+        # while it has nothing waiting, so a flow can't get ahead by
+        # pausing.
+        queue = self._queues.setdefault(share, FairQueue())
+        self._waiters.setdefault(share, queue)
+        queue.push(
+            waiter,
+            flow,
+            self.priorities.get(flow, 0),
+            self.weights.get(flow, 1.0),
+        )
+        # Other shares may be paused while this one isn't.
+        self._wake()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # We were handed a slot just as we got cancelled.
+                self._release()
+            else:
+                queue = self._waiters.get(share)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiters[share]
+            raise
+
+    def _release(self):
+        """ Give a slot back and hand it on to the next waiter """
+
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        """ Grant slots to waiters while the budget allows it. The share
+            that was just served goes to the back of the line, and
+            paused shares are skipped.
+        """
+
+        while self.in_flight < int(self.limit):
+            ready = [share for share in self._waiters if not self._paused(share)]
+            if not ready:
+                return
+            queue = self._waiters.pop(ready[0])
+            waiter = queue.pop()
+            if queue:
+                self._waiters[ready[0]] = queue
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _can_grant(self, share=None):
+        """ Is there room in the budget (and is the share not paused)? """
+
+        return self.in_flight < int(self.limit) and not self._paused(share)
+
+    def _paused(self, share):
+        """ Has the share been asked to back off? """
+
+        return time.monotonic() < self._paused_until.get(share, 0.0)
+
+    def _pause(self, seconds, share=None):
+        """ Stop handing out slots to a share for 'seconds' (from
+            Retry-After)
+        """
+
+        resume = time.monotonic() + seconds
+        if resume <= self._paused_until.get(share, 0.0):
+            return
+        self._paused_until[share] = resume
+        logging.warning("API asked us to back off. Pausing for %s seconds.", seconds)
+        asyncio.get_event_loop().call_later(seconds, self._wake)
+
+    def _on_success(self, latency):
+        """ Additive increase, unless the response was slow enough to
+            suggest the API is struggling.
+        """
+
+        average = self._latency_average
+        if average is not None and latency > average * self.latency_tolerance:
+            self._decrease()
+        else:
+            # Roughly one extra slot per 'round' of successful requests.
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._wake()
+
+        if average is None:
+            self._latency_average = latency
+        else:
+            self._latency_average = average * 0.9 + latency * 0.1
+
+    def _decrease(self):
+        """ Multiplicative decrease. Only once per average round trip so
+            a burst of errors from one bad moment doesn't collapse the
+            budget to the minimum.
+        """
+
+        now = time.monotonic()
+        if now - self._last_decrease < (self._latency_average or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit / 2)
+        logging.info("Lowered in-flight request limit to %s.", int(self.limit))
+
+    def _backoff(self, attempt):
+        """ Exponential backoff with full jitter """
+
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        )
+
+
+class FairQueue:
+
+    """ Requests of one share waiting for a slot. Higher priorities are
+        served first. Within a priority, each flow is served in
+        proportion to its weight (start-time weighted fair queuing): a
+        request's finish tag is its flow's previous finish tag (or the
+        queue's virtual time, if the flow has fallen behind) plus
+        1 / weight, and the lowest tag goes first. Requests of the same
+        flow keep their order.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._finish = {}
+        self._virtual = 0.0
+        self._order = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, waiter):
+        return any(entry[-1] is waiter for entry in self._heap)
+
+    def push(self, waiter, flow=None, priority=0, weight=1.0):
+        """ Queue a waiter for a flow """
+
+        start = max(self._virtual, self._finish.get(flow, 0.0))
+        finish = start + 1.0 / weight
+        self._finish[flow] = finish
+        heapq.heappush(
+            self._heap, (-priority, finish, next(self._order), start, waiter)
+        )
+
+    def pop(self):
+        """ Take the next waiter off the queue """
+
+        _, _, _, start, waiter = heapq.heappop(self._heap)
+        self._virtual = max(self._virtual, start)
+        return waiter
+
+    def remove(self, waiter):
+        """ Take a waiter (that gave up) off the queue """
+
+        self._heap = [entry for entry in self._heap if entry[-1] is not waiter]
+        heapq.heapify(self._heap)
+
+
+def _flow_values(name, cast):
+    """ Per flow values from an environment variable holding a comma
+        separated list of 'endpoint/type=value'.
+        Ex: NETSKOPE_TYPE_PRIORITIES=alert/malware=10,alert/DLP=5
+    """
+
+    values = {}
+    for entry in env_list(name):
+        flow, _, value = entry.rpartition("=")
+        values[flow.strip()] = cast(value)
+    return values
+
+
+async def _get(session, url, params, kwargs):
+    """ Make a GET request and read the response """
+
+    async with session.get(url, params=params, **kwargs) as resp:
+        return FetchedResponse(resp, await resp.read())
+
+
+def _is_throttled(status):
+    """ Should a response with this status be retried? """
+
+    return status == 429 or status >= 500
+
+
+def _retry_after(headers):
+    """ Seconds to wait from a Retry-After header (either a number of
+        seconds or an HTTP date), or None.
+    """
+
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,309 @@
+"""Defines the SegmentSettings class and the compression backends used
+to write each log type as a series of rotating segment files instead of
+one ever-growing log file.
+
+Segments live in logs/<endpoint>/<type>/ and are named after the UTC
+time they were opened (20261017T120000Z-0000.log) so they sort in the
+order they were written. A segment is closed once it reaches
+NETSKOPE_SEGMENT_MAX_BYTES or is older than NETSKOPE_SEGMENT_MAX_AGE
+seconds; closed segments are compressed in the background. With
+NETSKOPE_SEGMENT_STREAM_COMPRESSION the segments are written compressed
+to begin with.
+"""
+
+from datetime import datetime, timezone
+import gzip
+import importlib
+import os
+import re
+import shutil
+
+from netskope_fetcher.config import env_bool, env_int, env_str
+
+
+# 20261017T120000Z-0000.log, optionally followed by a compression suffix
+_SEGMENT_NAME = re.compile(r"^(\d{8}T\d{6})Z-(\d{4})\.log(\.gz|\.zst)?$")
+
+_TIME_FORMAT = "%Y%m%dT%H%M%S"
+
+
+class GzipCompression:
+
+    """ gzip backend.
+
+        Each call to compress() returns a complete gzip member. Members
+        can be concatenated and are read back as one stream by gzip and
+        zcat, so a segment can be appended to (and truncated back to a
+        member boundary) without ever rewriting it.
+
+    Attributes
+    ----------
+    name: str
+        Name of the backend, as used in NETSKOPE_SEGMENT_COMPRESSION.
+    suffix: str
+        Appended to the segment name.
+    level: int
+        Compression level.
+    """
+
+    name = "gzip"
+    suffix = ".gz"
+
+    def __init__(self, level=None):
+        self.level = level or 6
+
+    def compress(self, data):
+        """ Compress bytes into a single gzip member """
+
+        return gzip.compress(data, compresslevel=self.level)
+
+    def copy(self, source, destination):
+        """ Compress an open file into another as a single gzip member """
+
+        with gzip.GzipFile(
+            fileobj=destination, mode="wb", compresslevel=self.level
+        ) as compressed:
+            shutil.copyfileobj(source, compressed)
+
+
+class ZstdCompression:
+
+    """ zstd backend (requires the 'zstandard' package). Like gzip
+        members, zstd frames can be concatenated.
+    """
+
+    name = "zstd"
+    suffix = ".zst"
+
+    def __init__(self, level=None):
+        self.level = level or 3
+        self._zstd = importlib.import_module("zstandard")
+
+    def compress(self, data):
+        """ Compress bytes into a single zstd frame """
+
+        return self._zstd.ZstdCompressor(level=self.level).compress(data)
+
+    def copy(self, source, destination):
+        """ Compress an open file into another as a single zstd frame """
+
+        self._zstd.ZstdCompressor(level=self.level).copy_stream(source, destination)
+
+
+COMPRESSIONS = {
+    GzipCompression.name: GzipCompression,
+    ZstdCompression.name: ZstdCompression,
+}
+
+
+def get_compression(name, level=None):
+    """ Return the compression backend for 'name', or None for 'none'.
+
+        Asking for zstd without the zstandard package installed raises
+        ImportError, and an unknown name raises ValueError.
+    """
+
+    name = (name or "none").lower()
+    if name == "none":
+        return None
+    if name not in COMPRESSIONS:
+        raise ValueError(
+            "Unknown NETSKOPE_SEGMENT_COMPRESSION '{}'. Choose from: none, {}".format(
+                name, ", ".join(COMPRESSIONS)
+            )
+        )
+    return COMPRESSIONS[name](level)
+
+
+class SegmentSettings:
+
+    """ Rotation and compression settings for segment files.
+
+    Attributes
+    ----------
+    max_bytes: int
+        Close a segment once it holds this many bytes. 0 for no limit.
+        A segment may overshoot by up to one batch of logs.
+    max_age: int
+        Close a segment once it's this many seconds old. 0 for no
+        limit. Checked whenever logs are written to it.
+    compression: GzipCompression or ZstdCompression
+        Used to compress the segments. None to leave them as plain text.
+    stream_compression: bool
+        Write segments compressed to begin with instead of compressing
+        them once they're closed.
+    """
+
+    def __init__(self, **kwargs):
+        self.max_bytes = kwargs.get("max_bytes")
+        if self.max_bytes is None:
+            self.max_bytes = env_int("NETSKOPE_SEGMENT_MAX_BYTES", 0)
+        self.max_age = kwargs.get("max_age")
+        if self.max_age is None:
+            self.max_age = env_int("NETSKOPE_SEGMENT_MAX_AGE", 0)
+        self.compression = kwargs.get("compression")
+        if self.compression is None:
+            self.compression = get_compression(
+                env_str("NETSKOPE_SEGMENT_COMPRESSION", "none"),
+                env_int("NETSKOPE_SEGMENT_COMPRESSION_LEVEL", 0),
+            )
+        self.stream_compression = kwargs.get("stream_compression")
+        if self.stream_compression is None:
+            self.stream_compression = env_bool("NETSKOPE_SEGMENT_STREAM_COMPRESSION")
+        if self.stream_compression and self.compression is None:
+            raise ValueError(
+                "NETSKOPE_SEGMENT_STREAM_COMPRESSION needs "
+                "NETSKOPE_SEGMENT_COMPRESSION to be gzip or zstd."
+            )
+
+    @property
+    def enabled(self):
+        """ Are logs written as segments at all? """
+
+        return bool(self.max_bytes or self.max_age or self.compression)
+
+    @property
+    def active_suffix(self):
+        """ Suffix of the segment that is being written to """
+
+        if self.stream_compression:
+            return ".log" + self.compression.suffix
+        return ".log"
+
+    def should_rotate(self, segment, now):
+        """ Is the segment full or too old to take more logs? """
+
+        if segment.size <= 0:
+            return False
+        if self.max_bytes and segment.size >= self.max_bytes:
+            return True
+        return bool(self.max_age and now - segment.opened >= self.max_age)
+
+
+class Segment:
+
+    """ The segment a type is currently being written to.
+
+    Attributes
+    ----------
+    path: str
+        Path to the segment file.
+    opened: int
+        Epoch time the segment was opened (from its name).
+    size: int
+        Bytes written to it so far.
+    """
+
+    def __init__(self, path, opened, size=0):
+        self.path = path
+        self.opened = opened
+        self.size = size
+
+
+def segment_name(opened, sequence, suffix=".log"):
+    """ Time-sortable file name for a segment opened at 'opened' """
+
+    return "{}Z-{:04d}{}".format(
+        datetime.fromtimestamp(opened, timezone.utc).strftime(_TIME_FORMAT),
+        sequence,
+        suffix,
+    )
+
+
+def parse_segment_name(name):
+    """ Return (opened, sequence, compression suffix) for a segment file
+        name, or None if it isn't one.
+    """
+
+    match = _SEGMENT_NAME.match(name)
+    if match is None:
+        return None
+    opened = datetime.strptime(match.group(1), _TIME_FORMAT)
+    opened = int(opened.replace(tzinfo=timezone.utc).timestamp())
+    return opened, int(match.group(2)), match.group(3) or ""
+
+
+def new_segment(directory, now, settings):
+    """ Create an empty segment in directory, named after 'now'. Must
+        not be called from the event loop (it touches the disk).
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    taken = {
+        parsed[:2]
+        for parsed in map(parse_segment_name, os.listdir(directory))
+        if parsed is not None
+    }
+    opened = int(now)
+    sequence = 0
+    while (opened, sequence) in taken:
+        sequence += 1
+    path = os.path.join(
+        directory, segment_name(opened, sequence, settings.active_suffix)
+    )
+    open(path, "ab").close()
+    return Segment(path, opened)
+
+
+def find_segments(directory, settings):
+    """ Look for segments left behind by earlier runs.
+
+    Returns
+    ----------
+    tuple
+        (Segment or None, list). The newest segment that may still be
+        written to, and the paths of closed segments that should be
+        compressed.
+    """
+
+    if not os.path.isdir(directory):
+        return None, []
+
+    active = []
+    for name in sorted(os.listdir(directory)):
+        parsed = parse_segment_name(name)
+        if parsed is not None and name.endswith(settings.active_suffix):
+            active.append((name, parsed[0]))
+
+    latest = None
+    if active:
+        name, opened = active.pop()
+        path = os.path.join(directory, name)
+        latest = Segment(path, opened, os.path.getsize(path))
+
+    closed = []
+    if settings.compression is not None and not settings.stream_compression:
+        closed = [os.path.join(directory, name) for name, _ in active]
+    return latest, closed
+
+
+def compress_segment(path, compression):
+    """ Compress a closed segment next to itself and remove the plain
+        text copy. The compressed copy only appears (atomically) once it
+        is complete, so a shipper never sees half a file.
+    """
+
+    if os.path.getsize(path) == 0:
+        os.remove(path)
+        return
+
+    destination = path + compression.suffix
+    temporary = destination + ".tmp"
+    with open(path, "rb") as source, open(temporary, "wb") as _f:
+        compression.copy(source, _f)
+        _f.flush()
+        os.fsync(_f.fileno())
+    os.replace(temporary, destination)
+    os.remove(path)
+
+
+def remove_partial_segments(directory):
+    """ Remove compressed copies that were cut short by a crash. Their
+        plain text segments are still there and get compressed again.
+    """
+
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith(".tmp"):
+            os.remove(os.path.join(directory, name))
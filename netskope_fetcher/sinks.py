@@ -0,0 +1,846 @@
+"""Defines the Sink classes which forward logs to other systems as they
+are written, next to (or instead of) the local log files.
+
+Sinks are set in a json file (NETSKOPE_SINKS_FILE):
+
+    {
+        "sinks": [
+            {"type": "syslog", "host": "siem.example.com", "port": 6514,
+             "protocol": "tcp", "app_name": "netskope"},
+            {"type": "tcp", "host": "127.0.0.1", "port": 5170},
+            {"type": "http", "url": "https://ingest.example.com/bulk",
+             "headers": {"Authorization": "Bearer ..."}, "gzip": true},
+            {"type": "mypackage.sinks:KafkaSink", "topic": "netskope"}
+        ]
+    }
+
+    syslog  RFC5424 messages, one per log, over TCP (octet-counted
+            framing, RFC6587) or UDP.
+    tcp     Newline delimited json over a TCP connection.
+    http    Newline delimited json, POSTed a batch at a time.
+
+A 'module:Class' type loads a Sink subclass from another package. It
+only has to implement _connect, _send and _disconnect.
+
+Each sink batches logs until it holds 'batch_records' logs or
+'batch_bytes' bytes, or its oldest log has waited 'flush_interval'
+seconds, and sends each batch over a connection that is kept open
+between batches. Failed sends are retried with backoff, reconnecting
+first. Up to 'queue_size' sealed batches wait in memory. Once that is
+full, batches spill over to files in 'spool_dir' (if it is set) until
+'spool_max_bytes', and only then does the writer have to wait. Spooled
+batches survive a restart and are sent first the next time. Every sink
+is fed in parallel, so a slow sink only holds the others up once its
+own queue and spool are full.
+
+Delivery is at least once: a window that is pulled down again after a
+failure is sent again.
+"""
+
+from collections import deque
+from datetime import datetime, timezone
+import asyncio
+import gzip
+import importlib
+import json
+import logging
+import os
+import random
+import re
+import socket
+
+import aiohttp
+
+from netskope_fetcher.config import env_float, env_int, env_str
+
+
+# Options every sink takes
+COMMON_OPTIONS = (
+    "type",
+    "name",
+    "batch_records",
+    "batch_bytes",
+    "flush_interval",
+    "queue_size",
+    "spool_dir",
+    "spool_max_bytes",
+    "drain_timeout",
+    "backoff_base",
+    "backoff_max",
+)
+
+_SPOOL_SUFFIX = ".batch"
+
+
+class SinkError(Exception):
+
+    """ A batch couldn't be sent, or a sink couldn't be drained in time """
+
+
+class SinkRejected(SinkError):
+
+    """ The receiving end refused a batch for good (retrying won't help) """
+
+
+class Batch:
+
+    """ Logs to be sent together.
+
+    Attributes
+    ----------
+    entries: list
+        [endpoint_type, type_, list of json lines] per run of logs of
+        the same type, in order. Every line ends with a newline.
+    records: int
+        Number of logs.
+    size: int
+        Number of bytes.
+    started: float
+        Event loop time the first log was added.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.records = 0
+        self.size = 0
+        self.started = None
+
+    def add(self, endpoint_type, type_, lines):
+        """ Add lines of one type """
+
+        if self.entries and self.entries[-1][:2] == [endpoint_type, type_]:
+            self.entries[-1][2].extend(lines)
+        else:
+            self.entries.append([endpoint_type, type_, list(lines)])
+        self.records += len(lines)
+        self.size += sum(map(len, lines))
+
+    def lines(self):
+        """ Every line of the batch, in order """
+
+        return [line for entry in self.entries for line in entry[2]]
+
+
+class Sink:
+
+    """ Base class of the sinks. Does the batching, queueing, spilling
+        and retrying; subclasses only connect and send.
+
+    Attributes
+    ----------
+    name: str
+        Used in log messages and to name the spool directory.
+    batch_records: int
+        Most logs per batch.
+    batch_bytes: int
+        Most bytes per batch. A single larger log gets a batch of its
+        own.
+    flush_interval: float
+        Seconds a log may wait for its batch to fill up.
+    queue_size: int
+        Sealed batches held in memory before spilling to disk.
+    spool_dir: str
+        Where batches spill over to. None to make the writer wait as
+        soon as the memory queue is full.
+    spool_max_bytes: int
+        Most bytes spooled before the writer has to wait.
+    drain_timeout: float
+        Seconds drain() waits for everything queued to be sent.
+    stats: dict
+        Counters of logs and batches sent, retries, batches spilled
+        and logs dropped (refused by the receiving end).
+    """
+
+    kind = None
+
+    # Options of the subclass, on top of COMMON_OPTIONS
+    options = ()
+
+    def __init__(self, name=None, **kwargs):
+        self.name = name or self.kind
+        self.batch_records = kwargs.get("batch_records") or env_int(
+            "NETSKOPE_SINK_BATCH_RECORDS", 500
+        )
+        self.batch_bytes = kwargs.get("batch_bytes") or env_int(
+            "NETSKOPE_SINK_BATCH_BYTES", 1048576
+        )
+        self.flush_interval = kwargs.get("flush_interval") or env_float(
+            "NETSKOPE_SINK_FLUSH_INTERVAL", 1.0
+        )
+        self.queue_size = kwargs.get("queue_size") or env_int(
+            "NETSKOPE_SINK_QUEUE_SIZE", 64
+        )
+        self.spool_dir = kwargs.get("spool_dir")
+        if self.spool_dir is None and env_str("NETSKOPE_SINK_SPOOL_DIR"):
+            self.spool_dir = os.path.join(env_str("NETSKOPE_SINK_SPOOL_DIR"), self.name)
+        self.spool_max_bytes = kwargs.get("spool_max_bytes") or env_int(
+            "NETSKOPE_SINK_SPOOL_MAX_BYTES", 1073741824
+        )
+        self.drain_timeout = kwargs.get("drain_timeout") or env_float(
+            "NETSKOPE_SINK_DRAIN_TIMEOUT", 300.0
+        )
+        self.backoff_base = kwargs.get("backoff_base") or 0.5
+        self.backoff_max = kwargs.get("backoff_max") or 30.0
+        self.stats = {
+            "records": 0,
+            "batches": 0,
+            "retries": 0,
+            "spilled": 0,
+            "dropped": 0,
+        }
+
+        self._open = Batch()
+        self._queue = deque()
+        self._spooled = deque()
+        self._spool_bytes = 0
+        self._sequence = 0
+        # (batch, spool file or None) being sent by the worker
+        self._current = None
+        self._flush_now = False
+        self._worker = None
+        self._wakeup = None
+        self._progress = None
+        if self.spool_dir:
+            self._find_spooled()
+
+    async def put(self, endpoint_type, type_, data):
+        """ Queue newline delimited json logs of a type. Waits if the
+            memory queue and the spool are both full.
+        """
+
+        self._start()
+        lines = data.splitlines(keepends=True)
+        first = 0
+        while first < len(lines):
+            if self._open.started is None:
+                self._open.started = asyncio.get_event_loop().time()
+            last = first + self.batch_records - self._open.records
+            chunk = lines[first:last]
+            size = self._open.size
+            for count, line in enumerate(chunk):
+                size += len(line)
+                if size >= self.batch_bytes:
+                    chunk = chunk[: count + 1]
+                    break
+            self._open.add(endpoint_type, type_, chunk)
+            first += len(chunk)
+            if (
+                self._open.records >= self.batch_records
+                or self._open.size >= self.batch_bytes
+            ):
+                await self._seal()
+        self._wakeup.set()
+
+    async def drain(self, timeout=None):
+        """ Send everything that is queued, including the batch still
+            filling up.
+
+        Raises
+        ----------
+        SinkError
+            If it isn't all sent within 'timeout' (drain_timeout)
+            seconds. Whatever is left stays queued.
+        """
+
+        if self._worker is None:
+            return
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + (timeout or self.drain_timeout)
+        try:
+            while self._pending():
+                if self._worker.done():
+                    raise SinkError("Sink {} stopped.".format(self.name))
+                self._flush_now = True
+                self._progress.clear()
+                self._wakeup.set()
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(self._progress.wait(), remaining)
+        except asyncio.TimeoutError:
+            raise SinkError(
+                "Sink {} couldn't send everything queued in time.".format(self.name)
+            )
+        finally:
+            self._flush_now = False
+
+    async def close(self):
+        """ Stop sending. Whatever is still queued in memory is spooled
+            (or lost, with a warning, if there is no spool_dir). drain()
+            first to send it instead.
+        """
+
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except (asyncio.CancelledError, Exception):  # pylint: disable=broad-except
+                pass
+            self._worker = None
+
+        left = []
+        if self._current is not None and self._current[1] is None:
+            left.append(self._current[0])
+        left.extend(self._queue)
+        if self._open.records:
+            left.append(self._open)
+        self._current, self._queue, self._open = None, deque(), Batch()
+        for batch in left:
+            if self.spool_dir:
+                _write_spool(self._spool_path(), batch)
+            else:
+                logging.warning(
+                    "Sink %s closed with %s logs unsent.", self.name, batch.records
+                )
+        try:
+            await self._disconnect()
+        except (OSError, aiohttp.ClientError):
+            pass
+
+    async def _connect(self):
+        """ Open the connection, unless it's open. Subclasses override. """
+
+    async def _send(self, batch):
+        """ Send a batch. Raises SinkRejected if it's refused for good,
+            or OSError, aiohttp.ClientError or SinkError to retry.
+            Subclasses override.
+        """
+
+        raise NotImplementedError
+
+    async def _disconnect(self):
+        """ Close the connection, if it's open. Subclasses override. """
+
+    def _start(self):
+        """ Start the worker on first use, on the running event loop """
+
+        if self._worker is None:
+            self._wakeup = asyncio.Event()
+            self._progress = asyncio.Event()
+            self._worker = asyncio.ensure_future(self._work())
+
+    def _pending(self):
+        """ Is anything waiting to be sent? """
+
+        return bool(
+            self._open.records or self._queue or self._spooled or self._current
+        )
+
+    async def _seal(self):
+        """ Queue the open batch. In memory if there's room (and nothing
+            older is spooled), else in the spool, else wait for room.
+        """
+
+        batch, self._open = self._open, Batch()
+        while True:
+            if not self._spooled and len(self._queue) < self.queue_size:
+                self._queue.append(batch)
+                break
+            if (
+                self.spool_dir
+                and self._spool_bytes + batch.size <= self.spool_max_bytes
+            ):
+                path = self._spool_path()
+                await asyncio.get_event_loop().run_in_executor(
+                    None, _write_spool, path, batch
+                )
+                self._spooled.append(path)
+                self._spool_bytes += batch.size
+                self.stats["spilled"] += 1
+                break
+            # Backpressure: wait for the worker to send something.
+            self._progress.clear()
+            self._wakeup.set()
+            await self._progress.wait()
+        self._wakeup.set()
+
+    async def _work(self):
+        """ Send batches, oldest first: the memory queue, then the
+            spool, then the open batch once it's old enough.
+        """
+
+        loop = asyncio.get_event_loop()
+        while True:
+            if self._queue:
+                self._current = (self._queue.popleft(), None)
+            elif self._spooled:
+                path = self._spooled[0]
+                try:
+                    batch = await loop.run_in_executor(None, _read_spool, path)
+                except (OSError, ValueError, KeyError) as _e:
+                    logging.error(
+                        "Sink %s can't read spooled batch %s, setting it aside: %s",
+                        self.name,
+                        path,
+                        _e,
+                    )
+                    os.replace(path, path + ".bad")
+                    self._spooled.popleft()
+                    continue
+                self._current = (batch, path)
+            elif self._open.records and (
+                self._flush_now
+                or loop.time() - self._open.started >= self.flush_interval
+            ):
+                self._queue.append(self._open)
+                self._open = Batch()
+                continue
+            else:
+                timeout = None
+                if self._open.records:
+                    timeout = max(
+                        self._open.started + self.flush_interval - loop.time(), 0
+                    )
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._deliver(self._current[0])
+            batch, path = self._current
+            if path is not None:
+                await loop.run_in_executor(None, os.remove, path)
+                self._spooled.popleft()
+                self._spool_bytes -= batch.size
+            self._current = None
+            self._progress.set()
+
+    async def _deliver(self, batch):
+        """ Send a batch, reconnecting and retrying with backoff until
+            it's sent or refused.
+        """
+
+        attempt = 0
+        while True:
+            try:
+                await self._connect()
+                await self._send(batch)
+            except SinkRejected as _e:
+                logging.error(
+                    "Sink %s refused %s logs: %s", self.name, batch.records, _e
+                )
+                self.stats["dropped"] += batch.records
+                return
+            except (
+                OSError,
+                EOFError,
+                aiohttp.ClientError,
+                SinkError,
+                asyncio.TimeoutError,
+            ) as _e:
+                try:
+                    await self._disconnect()
+                except (OSError, aiohttp.ClientError):
+                    pass
+                delay = random.uniform(
+                    0, min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                )
+                logging.warning(
+                    "Sink %s failed to send %s logs (%r). Retrying in %.1f seconds.",
+                    self.name,
+                    batch.records,
+                    _e,
+                    delay,
+                )
+                self.stats["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+            else:
+                self.stats["records"] += batch.records
+                self.stats["batches"] += 1
+                return
+
+    def _spool_path(self):
+        """ Path for the next spooled batch """
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._sequence += 1
+        return os.path.join(
+            self.spool_dir, "{:012d}{}".format(self._sequence, _SPOOL_SUFFIX)
+        )
+
+    def _find_spooled(self):
+        """ Pick up batches spooled by an earlier run """
+
+        if not os.path.isdir(self.spool_dir):
+            return
+        for name in sorted(os.listdir(self.spool_dir)):
+            path = os.path.join(self.spool_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+            elif name.endswith(_SPOOL_SUFFIX):
+                self._spooled.append(path)
+                self._spool_bytes += os.path.getsize(path)
+                self._sequence = max(self._sequence, int(name[: -len(_SPOOL_SUFFIX)]))
+        if self._spooled:
+            logging.info(
+                "Sink %s has %s batches spooled from an earlier run.",
+                self.name,
+                len(self._spooled),
+            )
+
+
+class TcpSink(Sink):
+
+    """ Sends newline delimited json over a TCP connection.
+
+    Attributes
+    ----------
+    host: str
+    port: int
+    tls: bool
+        Wrap the connection in TLS.
+    connect_timeout: float
+        Seconds allowed to connect.
+    """
+
+    kind = "tcp"
+    options = ("host", "port", "tls", "connect_timeout")
+
+    def __init__(self, host, port, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = int(port)
+        self.tls = bool(kwargs.get("tls"))
+        self.connect_timeout = kwargs.get("connect_timeout") or 10.0
+        self._reader = None
+        self._writer = None
+
+    async def _connect(self):
+        if self._writer is not None and not self._reader.at_eof():
+            return
+        await self._disconnect()
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.tls or None),
+            self.connect_timeout,
+        )
+
+    async def _send(self, batch):
+        self._writer.write(self.frame(batch))
+        await self._writer.drain()
+
+    async def _disconnect(self):
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, ConnectionError):
+                pass
+
+    def frame(self, batch):
+        """ Bytes to send for a batch """
+
+        return b"".join(batch.lines())
+
+
+class SyslogSink(TcpSink):
+
+    """ Sends each log as an RFC5424 syslog message whose MSG is the
+        log's json, over TCP (octet-counted framing, RFC6587) or UDP.
+
+    Attributes
+    ----------
+    protocol: str
+        'tcp' or 'udp'.
+    facility: int
+        Syslog facility. 16 (local0) by default.
+    severity: int
+        Syslog severity. 6 (informational) by default.
+    app_name: str
+        APP-NAME of the messages.
+    hostname: str
+        HOSTNAME of the messages. This host's name by default.
+    """
+
+    kind = "syslog"
+    options = TcpSink.options + (
+        "protocol",
+        "facility",
+        "severity",
+        "app_name",
+        "hostname",
+    )
+
+    def __init__(self, host, port=None, **kwargs):
+        self.protocol = (kwargs.get("protocol") or "tcp").lower()
+        if self.protocol not in ("tcp", "udp"):
+            raise ValueError("Syslog protocol must be tcp or udp.")
+        super().__init__(host, port or 514, **kwargs)
+        facility = kwargs.get("facility", 16)
+        severity = kwargs.get("severity", 6)
+        self.priority = facility * 8 + severity
+        self.app_name = _syslog_name(kwargs.get("app_name") or "netskope", 48)
+        self.hostname = _syslog_name(
+            kwargs.get("hostname") or socket.gethostname(), 255
+        )
+        self._transport = None
+
+    async def _connect(self):
+        if self.protocol == "tcp":
+            await super()._connect()
+        elif self._transport is None:
+            loop = asyncio.get_event_loop()
+            self._transport, _ = await loop.create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=(self.host, self.port)
+            )
+
+    async def _send(self, batch):
+        if self.protocol == "tcp":
+            await super()._send(batch)
+            return
+        for message in self.messages(batch):
+            self._transport.sendto(message)
+        # Let the datagrams go out before the next batch is built.
+        await asyncio.sleep(0)
+
+    async def _disconnect(self):
+        transport, self._transport = self._transport, None
+        if transport is not None:
+            transport.close()
+        await super()._disconnect()
+
+    def messages(self, batch):
+        """ One RFC5424 message per log of a batch """
+
+        header = b"<%d>1 %s %s %s - " % (
+            self.priority,
+            datetime.now(timezone.utc).isoformat(timespec="milliseconds").encode(),
+            self.hostname,
+            self.app_name,
+        )
+        messages = []
+        for endpoint_type, type_, lines in batch.entries:
+            prefix = header + _syslog_name(
+                "{}/{}".format(endpoint_type, type_), 32
+            ) + b" - "
+            messages.extend(prefix + line.rstrip(b"\n") for line in lines)
+        return messages
+
+    def frame(self, batch):
+        return b"".join(
+            b"%d %s" % (len(message), message) for message in self.messages(batch)
+        )
+
+
+class HttpSink(Sink):
+
+    """ POSTs each batch as newline delimited json.
+
+    Attributes
+    ----------
+    url: str
+    headers: dict
+        Sent with every request (ex: Authorization).
+    gzip: bool
+        Compress the body (Content-Encoding: gzip).
+    timeout: float
+        Seconds allowed per request.
+    """
+
+    kind = "http"
+    options = ("url", "headers", "gzip", "timeout")
+
+    def __init__(self, url, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.headers = dict(kwargs.get("headers") or {})
+        self.headers.setdefault("Content-Type", "application/x-ndjson")
+        self.gzip = bool(kwargs.get("gzip"))
+        if self.gzip:
+            self.headers["Content-Encoding"] = "gzip"
+        self.timeout = kwargs.get("timeout") or 30.0
+        self._session = None
+
+    async def _connect(self):
+        if self._session is None:
+            # One session per sink keeps its connections alive between
+            # batches.
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+
+    async def _send(self, batch):
+        body = b"".join(batch.lines())
+        if self.gzip:
+            body = gzip.compress(body)
+        post = self._session.post(self.url, data=body, headers=self.headers)
+        async with post as resp:
+            text = await resp.text()
+            if resp.status < 300:
+                return
+            message = "{} {}".format(resp.status, text[:200])
+            if resp.status in (408, 429) or resp.status >= 500:
+                raise SinkError(message)
+            raise SinkRejected(message)
+
+    async def _disconnect(self):
+        session, self._session = self._session, None
+        if session is not None:
+            await session.close()
+
+
+SINK_TYPES = {
+    SyslogSink.kind: SyslogSink,
+    TcpSink.kind: TcpSink,
+    HttpSink.kind: HttpSink,
+}
+
+
+class SinkSet:
+
+    """ Every configured sink. Feeds them all in parallel.
+
+    Attributes
+    ----------
+    sinks: list
+        Sink objects.
+    """
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    async def put(self, endpoint_type, type_, data):
+        """ Queue newline delimited json logs for every sink """
+
+        if not data:
+            return
+        await asyncio.gather(
+            *[sink.put(endpoint_type, type_, data) for sink in self.sinks]
+        )
+
+    async def drain(self):
+        """ Send everything queued by every sink. Raises SinkError if a
+            sink can't.
+        """
+
+        await asyncio.gather(*[sink.drain() for sink in self.sinks])
+
+    async def close(self):
+        """ Close every sink """
+
+        await asyncio.gather(*[sink.close() for sink in self.sinks])
+
+
+def make_sink(config):
+    """ Create a sink from its entry in the sinks file.
+
+    Raises
+    ----------
+    ValueError
+        If the entry isn't valid.
+    """
+
+    if not isinstance(config, dict) or not config.get("type"):
+        raise ValueError("Every sink needs a 'type': {}".format(config))
+    kind = config["type"]
+    if ":" in kind:
+        module, _, name = kind.partition(":")
+        try:
+            sink_class = getattr(importlib.import_module(module), name)
+        except (ImportError, AttributeError) as _e:
+            raise ValueError("Can't load sink {}: {}".format(kind, _e))
+        if not (isinstance(sink_class, type) and issubclass(sink_class, Sink)):
+            raise ValueError("{} is not a Sink.".format(kind))
+    elif kind in SINK_TYPES:
+        sink_class = SINK_TYPES[kind]
+    else:
+        raise ValueError(
+            "Unknown sink type '{}'. Choose from: {}, or module:Class".format(
+                kind, ", ".join(SINK_TYPES)
+            )
+        )
+
+    unknown = set(config) - set(COMMON_OPTIONS) - set(sink_class.options)
+    if unknown:
+        raise ValueError(
+            "Unknown option(s) for a {} sink: {}".format(
+                kind, ", ".join(sorted(unknown))
+            )
+        )
+    options = {key: value for key, value in config.items() if key != "type"}
+    try:
+        return sink_class(**options)
+    except TypeError as _e:
+        raise ValueError("Bad options for a {} sink: {}".format(kind, _e))
+
+
+def load_sinks(file_path, spool_dir=None):
+    """ Read the sinks file and create the sinks. Sinks without a
+        spool_dir of their own spool to spool_dir/<name>, if it's given
+        (instead of NETSKOPE_SINK_SPOOL_DIR/<name>).
+
+    Returns
+    ----------
+    SinkSet
+
+    Raises
+    ----------
+    ValueError
+        If the file isn't valid.
+    """
+
+    with open(file_path) as _f:
+        try:
+            config = json.load(_f)
+        except ValueError as _e:
+            raise ValueError("{} is not valid json: {}".format(file_path, _e))
+    entries = config.get("sinks") if isinstance(config, dict) else None
+    if not entries or not isinstance(entries, list):
+        raise ValueError("{} has no 'sinks' list.".format(file_path))
+
+    if spool_dir is not None:
+        entries = [
+            dict(
+                entry,
+                spool_dir=entry.get("spool_dir")
+                or os.path.join(spool_dir, entry.get("name") or entry.get("type")),
+            )
+            if isinstance(entry, dict)
+            else entry
+            for entry in entries
+        ]
+    sinks = [make_sink(entry) for entry in entries]
+    names = [sink.name for sink in sinks]
+    for name in names:
+        if names.count(name) > 1:
+            raise ValueError(
+                "Sink name {} is used twice. Give the sinks a 'name'.".format(name)
+            )
+    return SinkSet(sinks)
+
+
+def _syslog_name(value, length):
+    """ A syslog header field: printable ascii without spaces """
+
+    return re.sub(r"[^!-~]", "_", value)[:length].encode("ascii") or b"-"
+
+
+def _write_spool(path, batch):
+    """ Write a batch to a spool file: a json header per run of logs of
+        the same type, followed by its lines. Appears atomically.
+    """
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as _f:
+        for endpoint_type, type_, lines in batch.entries:
+            header = {"endpoint": endpoint_type, "type": type_, "records": len(lines)}
+            _f.write(json.dumps(header).encode() + b"\n")
+            _f.write(b"".join(lines))
+        _f.flush()
+        os.fsync(_f.fileno())
+    os.replace(temporary, path)
+
+
+def _read_spool(path):
+    """ Read a batch back from its spool file """
+
+    batch = Batch()
+    with open(path, "rb") as _f:
+        for header in _f:
+            header = json.loads(header)
+            lines = [_f.readline() for _ in range(header["records"])]
+            batch.add(header["endpoint"], header["type"], lines)
+    return batch
@@ -0,0 +1,184 @@
+"""Defines the Tenant class and the loader for the tenants config file
+(NETSKOPE_TENANTS_FILE or --tenants) used to pull down logs for several
+Netskope tenants from one process.
+
+The file is json:
+
+    {
+        "tenants": [
+            {
+                "name": "acme",
+                "region": "eu",
+                "token_env": "ACME_NETSKOPE_TOKEN",
+                "types": {"event": ["page", "application"], "alert": ["DLP"]},
+                "output_dir": "/var/log/netskope/acme"
+            },
+            {
+                "name": "globex",
+                "base_url": "https://globex.goskope.com/api/v1",
+                "token": "...",
+                "output_dir": "globex"
+            }
+        ]
+    }
+
+Only 'name' is required. The API is at
+https://<name>.<region>.goskope.com/api/v1 unless 'base_url' is given
+('region' defaults to 'eu'). The token is read from the environment
+variable named by 'token_env' (NETSKOPE_AUTH_TOKEN by default), or
+given as 'token'. Every type is pulled down unless 'types' lists them
+per endpoint; an endpoint left out of 'types' is skipped. Each tenant
+keeps its logs, time.log, checkpoints and dedup state in its own
+'output_dir' (tenants/<name> by default). Relative paths are relative
+to the config file.
+"""
+
+import json
+import os
+import re
+
+from netskope_fetcher.token import Token
+
+
+DEFAULT_REGION = "eu"
+
+_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+_KEYS = ("name", "region", "base_url", "token", "token_env", "types", "output_dir")
+
+
+def base_url(tenant_name, region=None):
+    """ Base URL of a tenant's API, ex:
+        https://acme.eu.goskope.com/api/v1
+    """
+
+    return "https://{}.{}.goskope.com/api/v1".format(
+        tenant_name, region or DEFAULT_REGION
+    )
+
+
+class Tenant:
+
+    """ Where and how to pull down one tenant's logs.
+
+    Attributes
+    ----------
+    name: str
+        The tenant name. Also used to share the request scheduler
+        fairly between tenants.
+    base_url: str
+        Base URL of the API. '/events' and '/alerts' are added to it.
+    token: netskope_fetcher.token.Token
+        The tenant's API token.
+    types: dict
+        Types to pull down per endpoint ('event' and 'alert'). None for
+        every type.
+    output_dir: str
+        Directory the logs, time.log, checkpoints and dedup state are
+        kept in.
+    """
+
+    def __init__(self, name, token, **kwargs):
+        self.name = name
+        self.token = token
+        self.base_url = (
+            kwargs.get("base_url") or base_url(name, kwargs.get("region"))
+        ).rstrip("/")
+        self.types = kwargs.get("types")
+        self.output_dir = kwargs.get("output_dir") or os.path.join("tenants", name)
+
+    def client_kwargs(self):
+        """ Keyword arguments for EventClient and AlertClient """
+
+        return {
+            "tenant": self.name,
+            "token": self.token,
+            "base_url": self.base_url,
+            "types": self.types,
+        }
+
+
+def load_tenants(file_path):
+    """ Read the tenants config file.
+
+    Returns
+    ----------
+    list
+        Tenant objects, in the order they're listed.
+
+    Raises
+    ----------
+    ValueError
+        If the file isn't valid.
+    """
+
+    with open(file_path) as _f:
+        try:
+            config = json.load(_f)
+        except ValueError as _e:
+            raise ValueError("{} is not valid json: {}".format(file_path, _e))
+
+    entries = config.get("tenants") if isinstance(config, dict) else None
+    if not entries or not isinstance(entries, list):
+        raise ValueError("{} has no 'tenants' list.".format(file_path))
+
+    root = os.path.dirname(os.path.abspath(file_path))
+    tenants = []
+    for entry in entries:
+        tenant = _parse_tenant(entry, root)
+        for other in tenants:
+            if other.name == tenant.name:
+                raise ValueError("Tenant {} is listed twice.".format(tenant.name))
+            if other.output_dir == tenant.output_dir:
+                raise ValueError(
+                    "Tenants {} and {} share an output_dir.".format(
+                        other.name, tenant.name
+                    )
+                )
+        tenants.append(tenant)
+    return tenants
+
+
+def _parse_tenant(entry, root):
+    """ Build a Tenant from its entry in the config file """
+
+    if not isinstance(entry, dict) or not _NAME.match(str(entry.get("name", ""))):
+        raise ValueError("Every tenant needs a 'name' (letters, digits, . _ -).")
+    name = entry["name"]
+
+    unknown = set(entry) - set(_KEYS)
+    if unknown:
+        raise ValueError(
+            "Unknown setting(s) for tenant {}: {}".format(
+                name, ", ".join(sorted(unknown))
+            )
+        )
+
+    types = entry.get("types")
+    if types is not None:
+        if not isinstance(types, dict) or set(types) - {"event", "alert"}:
+            raise ValueError(
+                "'types' of tenant {} must map 'event' and/or 'alert' "
+                "to lists of types.".format(name)
+            )
+        types = {endpoint: list(type_list) for endpoint, type_list in types.items()}
+
+    token = entry.get("token")
+    if not token:
+        variable = entry.get("token_env") or "NETSKOPE_AUTH_TOKEN"
+        token = os.environ.get(variable)
+        if not token:
+            raise ValueError(
+                "No token for tenant {}: {} is not set.".format(name, variable)
+            )
+
+    return Tenant(
+        name,
+        Token(auth_token=token),
+        region=entry.get("region"),
+        base_url=entry.get("base_url"),
+        types=types,
+        output_dir=os.path.join(
+            root, entry.get("output_dir") or os.path.join("tenants", name)
+        ),
+    )
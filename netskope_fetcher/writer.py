@@ -0,0 +1,989 @@
+"""Defines the LogWriter class which writes pages of logs to the
+type-specific log files as soon as they are received from the API.
+
+Used in streaming mode so that a page of logs can be released from
+memory once it has been written, instead of being held in
+BaseNetskopeClient.log_dictionary until every client has finished.
+
+Writes happen off the event loop so the disk never stalls fetching:
+each endpoint/type has a bounded queue drained by a worker that
+encodes and writes the queued pages in batches on a thread pool. When
+the disk falls behind, a full queue makes the fetchers of that type
+wait (backpressure) instead of piling pages up in memory.
+
+When checkpoints are enabled, pages are first written to a staging
+file per sub-window (WindowStage) and only appended to the log file
+once the whole window has been pulled down.
+
+With segments enabled (see netskope_fetcher.segments) each type is
+written to rotating, optionally compressed, segment files instead of a
+single log file. Rotation happens between writes on the worker, and
+closed segments are compressed on a separate thread, so neither holds
+up fetching.
+
+With partitions enabled (see netskope_fetcher.partitions) each log is
+written to the hourly partition of its timestamp instead, and every
+partition's manifest is kept up to date as it's appended to.
+
+Given a LogIndex (see netskope_fetcher.index), every append to a log
+file, segment or partition is reported to it once it's on disk.
+
+Given sinks (see netskope_fetcher.sinks), every page written is also
+forwarded to them. With checkpoints, a window is forwarded when it's
+committed and the checkpoint is only recorded once every sink has sent
+it. With local_files off, the sinks are the only output.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import os
+import re
+import shutil
+import time
+
+from netskope_fetcher.codec import get_codec
+from netskope_fetcher.config import env_bool, env_int
+from netskope_fetcher.metrics import METRICS
+from netskope_fetcher.partitions import (
+    PARTITION_SUFFIX,
+    PartitionSettings,
+    group_by_partition,
+    load_manifest,
+    manifest_path,
+    partition_path,
+    rebuild_manifest,
+)
+from netskope_fetcher.passthrough import RawRecords
+from netskope_fetcher.profiling import TIMERS
+from netskope_fetcher.segments import (
+    SegmentSettings,
+    compress_segment,
+    find_segments,
+    new_segment,
+    remove_partial_segments,
+)
+
+
+# Operations queued for the per-type workers
+_WRITE = "write"
+_COMMIT = "commit"
+_DISCARD = "discard"
+
+# Staging files are forwarded to the sinks this many bytes at a time
+_FORWARD_CHUNK_BYTES = 4194304
+
+
+class LogWriter:
+
+    """ Appends pages of logs to logs/<endpoint>/<type>.log files.
+
+    Attributes
+    ----------
+    base_dir: str
+        Directory which holds the 'logs' directory.
+    handles: dict
+        Open file objects keyed by their file path. Files are kept open
+        for the length of the run so each page doesn't pay for an
+        open/close.
+    codec: netskope_fetcher.codec.JsonCodec
+        Used to serialize the logs.
+    queue_size: int
+        Pages that may be queued per type before write_page waits.
+    batch_records: int
+        Most logs encoded and written by a single write call.
+    segments: netskope_fetcher.segments.SegmentSettings
+        Rotation and compression settings. None to write each type to
+        a single log file.
+    partitions: netskope_fetcher.partitions.PartitionSettings
+        Partitioning settings. None to write each type to a single log
+        file (or to segments).
+    index: netskope_fetcher.index.LogIndex
+        Where each log was written is indexed here. None for no index.
+    sinks: netskope_fetcher.sinks.SinkSet
+        Every page written is forwarded to these. None for no sinks.
+    local_files: bool
+        Are logs written to local files at all? Only sinks get them
+        when this is off.
+    metrics: netskope_fetcher.metrics.NetskopeMetrics
+        Write latency is recorded here. The process wide METRICS by
+        default.
+    tenant: str
+        Name of the tenant the logs belong to, used to label the
+        metrics. None for a single tenant.
+    timers: netskope_fetcher.profiling.PhaseTimers
+        Time spent writing and checkpointing is added up here. The
+        process wide TIMERS by default.
+    """
+
+    def __init__(self, base_dir, codec=None, **kwargs):
+        self.base_dir = base_dir
+        self.handles = {}
+        self.codec = codec or get_codec()
+        self.queue_size = kwargs.get("queue_size") or env_int(
+            "NETSKOPE_WRITER_QUEUE_SIZE", 16
+        )
+        self.batch_records = kwargs.get("batch_records") or env_int(
+            "NETSKOPE_WRITER_BATCH_RECORDS", 20000
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=kwargs.get("threads") or env_int("NETSKOPE_WRITER_THREADS", 4)
+        )
+        self.metrics = kwargs.get("metrics") or METRICS
+        self.tenant = kwargs.get("tenant")
+        self.timers = kwargs.get("timers") or TIMERS
+        self.segments = kwargs.get("segments")
+        if self.segments is None:
+            self.segments = SegmentSettings()
+        if not self.segments.enabled:
+            self.segments = None
+        self.partitions = kwargs.get("partitions")
+        if self.partitions is None:
+            self.partitions = PartitionSettings()
+        if not self.partitions.enabled:
+            self.partitions = None
+        if self.partitions is not None and self.segments is not None:
+            raise ValueError(
+                "NETSKOPE_PARTITION_LOGS can't be combined with segments "
+                "(NETSKOPE_SEGMENT_*)."
+            )
+        self.index = kwargs.get("index")
+        if self.index is not None and self.segments and self.segments.compression:
+            raise ValueError(
+                "NETSKOPE_INDEX can't index compressed segments "
+                "(NETSKOPE_SEGMENT_COMPRESSION)."
+            )
+        self.sinks = kwargs.get("sinks")
+        self.local_files = kwargs.get("local_files")
+        if self.local_files is None:
+            self.local_files = env_bool("NETSKOPE_LOCAL_FILES", True)
+        if not self.local_files and self.sinks is None:
+            raise ValueError("NETSKOPE_LOCAL_FILES can only be off with sinks.")
+        if not self.local_files and (self.segments or self.partitions or self.index):
+            raise ValueError(
+                "Segments, partitions and the index need NETSKOPE_LOCAL_FILES."
+            )
+        # Compressing closed segments has its own thread so it never
+        # holds up writing.
+        self._compressor = ThreadPoolExecutor(max_workers=1)
+        self._active = {}
+        # Manifests of the partitions written to during the run, keyed
+        # by partition path, and the partitions each type has open.
+        self._manifests = {}
+        self._open_partitions = {}
+        self._queues = {}
+        self._workers = {}
+        # Stages opened and not yet handed over to be committed or
+        # discarded.
+        self._open_stages = set()
+        self._error = None
+        # Checkpoints or not, compressed copies cut short by a crash are
+        # never finished, so they can go before anything is written.
+        if self.segments is not None:
+            for endpoint_dir in _subdirectories(os.path.join(self.base_dir, "logs")):
+                for type_dir in _subdirectories(endpoint_dir):
+                    remove_partial_segments(type_dir)
+
+    async def write_page(self, endpoint_type, type_, log_list):
+        """ Queue a page of logs for the type-specific log file. Waits
+            while the type's queue is full.
+
+        Parameters
+        ----------
+        endpoint_type: str
+            'event' or 'alert'
+        type_: str
+            The log 'type'. For example: 'application' or 'page'
+        log_list: list
+            The 'data' list from a Netskope API response.
+        """
+
+        if not log_list:
+            return
+
+        # The file is picked by the worker so segments can rotate.
+        await self._submit((endpoint_type, type_), (_WRITE, None, log_list))
+
+    def log_file_path(self, endpoint_type, type_):
+        """ Build the log file path for the endpoint and type.
+
+            Ex: base/file/path/logs/alert/Compromised_Credential.log
+        """
+
+        return os.path.join(
+            self.base_dir,
+            "logs",
+            endpoint_type,
+            "{}.log".format(replace_spaces(type_)),
+        )
+
+    def open_stage(self, endpoint_type, type_, start, end):
+        """ Return a WindowStage which holds the logs of one sub-window
+            until it is committed.
+        """
+
+        stage = WindowStage(self, endpoint_type, type_, start, end)
+        self._open_stages.add(stage)
+        return stage
+
+    def segment_directory(self, endpoint_type, type_):
+        """ Directory which holds the segments (or partitions) of the
+            endpoint and type.
+
+            Ex: base/file/path/logs/alert/Compromised_Credential/
+        """
+
+        return os.path.join(
+            self.base_dir, "logs", endpoint_type, replace_spaces(type_)
+        )
+
+    async def commit_stage(self, stage, checkpoints=None):
+        """ Append the staged logs to the type-specific log file and,
+            if a CheckpointStore is given, record the window and the
+            new size of the log file alongside it.
+
+            Returns once the pages queued before the commit have been
+            written and the checkpoints saved. Should we die part way
+            through, recover() will truncate the log file back to the
+            last size recorded in the checkpoints.
+        """
+
+        self._open_stages.discard(stage)
+        await self._submit_and_wait(stage.key, _COMMIT, stage, checkpoints)
+
+    async def discard_stage(self, stage):
+        """ Throw away the logs of a window that wasn't fully pulled
+            down. It will be pulled down again on the next run.
+        """
+
+        self._open_stages.discard(stage)
+        await self._submit_and_wait(stage.key, _DISCARD, stage)
+
+    async def abort(self, timeout=0):
+        """ Stop writing after the windows in flight were cancelled.
+
+            What's queued gets up to 'timeout' seconds to be written and
+            committed. Then the workers still running are cancelled,
+            whatever is still queued is dropped, and the staging files
+            of windows that were never committed are removed (they're
+            pulled down again on the next run). Call close() afterwards.
+        """
+
+        workers = [task for task in self._workers.values() if not task.done()]
+        if workers and timeout > 0:
+            await asyncio.wait(workers, timeout=timeout)
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._workers = {}
+        for queue in self._queues.values():
+            while not queue.empty():
+                _cancel_waiters([queue.get_nowait()])
+
+        loop = asyncio.get_event_loop()
+        stages, self._open_stages = self._open_stages, set()
+        for stage in stages:
+            await loop.run_in_executor(self._executor, self._remove_stage, stage)
+
+    async def drain(self):
+        """ Wait until every queued page has been written (and sent by
+            the sinks). Raises the first error a worker ran into, or
+            SinkError if a sink couldn't send everything in time.
+        """
+
+        while True:
+            workers = [task for task in self._workers.values() if not task.done()]
+            if not workers:
+                break
+            await asyncio.wait(workers)
+        self._raise_if_failed()
+        if self.sinks is not None:
+            await self.sinks.drain()
+
+    def recover(self, checkpoints):
+        """ Undo anything that was written after the last commit:
+            truncate log files back to their committed size and remove
+            leftover staging files. The manifests of truncated
+            partitions are rebuilt.
+        """
+
+        for relative_log_file, offset in checkpoints.log_offsets().items():
+            log_file = os.path.join(self.base_dir, relative_log_file)
+            if os.path.exists(log_file) and os.path.getsize(log_file) > offset:
+                logging.warning(
+                    "Truncating %s to its last committed size %s.", log_file, offset
+                )
+                with open(log_file, "rb+") as _f:
+                    _f.truncate(offset)
+                if self.index is not None:
+                    self.index.truncate(log_file, offset)
+                if log_file.endswith(PARTITION_SUFFIX) and self.partitions:
+                    rebuild_manifest(
+                        log_file, self.partitions.field, self.codec
+                    ).save(manifest_path(log_file), sync=True)
+
+        staging_dir = self.staging_directory()
+        if os.path.isdir(staging_dir):
+            for file_ in os.listdir(staging_dir):
+                os.remove(os.path.join(staging_dir, file_))
+
+    def staging_directory(self):
+        """ Directory which holds the WindowStage files """
+
+        return os.path.join(self.base_dir, "logs", "staging")
+
+    def close(self):
+        """ Flush and close every file that was opened during the run
+            and wait for segments to finish compressing and for the
+            index to catch up. Anything still queued is lost, so drain()
+            first.
+        """
+
+        self._executor.shutdown(wait=True)
+        for _f in self.handles.values():
+            _f.close()
+        self.handles = {}
+        self._compressor.shutdown(wait=True)
+        if self.index is not None:
+            self.index.close()
+
+    async def _submit(self, key, operation):
+        """ Queue an operation for the key's worker, starting the worker
+            if it isn't running.
+        """
+
+        self._raise_if_failed()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue(maxsize=self.queue_size)
+        await queue.put(operation)
+
+        worker = self._workers.get(key)
+        if worker is None or worker.done():
+            self._workers[key] = asyncio.ensure_future(self._work(key, queue))
+
+    async def _submit_and_wait(self, key, kind, stage, checkpoints=None):
+        """ Queue a commit or discard and wait for its result """
+
+        done = asyncio.get_event_loop().create_future()
+        await self._submit(key, (kind, stage, done, checkpoints))
+        return await done
+
+    async def _work(self, key, queue):
+        """ Drain a queue in batches. Consecutive pages for the same file
+            are written with one call on the thread pool. Returns once
+            the queue is empty; _submit starts a new worker as needed.
+        """
+
+        loop = asyncio.get_event_loop()
+        while not queue.empty():
+            batch = []
+            records = 0
+            while not queue.empty() and records < self.batch_records:
+                operation = queue.get_nowait()
+                batch.append(operation)
+                if operation[0] == _WRITE:
+                    records += len(operation[2])
+
+            try:
+                for operation in _group_writes(batch):
+                    started = time.perf_counter()
+                    if operation[0] == _WRITE and not self._local(operation[1]):
+                        data = await loop.run_in_executor(
+                            self._executor, self._encode, operation[2]
+                        )
+                    elif operation[0] == _WRITE and self._partitioned(operation[1]):
+                        data = await loop.run_in_executor(
+                            self._executor, self._write_partitions, key, operation[2]
+                        )
+                    elif operation[0] == _WRITE:
+                        # Staging files aren't indexed, their logs are
+                        # once they're committed.
+                        path = operation[1] or await self._log_target(key)
+                        size, data = await loop.run_in_executor(
+                            self._executor,
+                            self._write,
+                            path,
+                            operation[2],
+                            key if operation[1] is None else None,
+                        )
+                        self._grew(key, path, size)
+                    elif operation[0] == _COMMIT:
+                        result = await self._commit(key, operation[1], operation[3])
+                        operation[2].set_result(result)
+                    else:
+                        await loop.run_in_executor(
+                            self._executor, self._remove_stage, operation[1]
+                        )
+                        operation[2].set_result(None)
+                        continue
+                    elapsed = time.perf_counter() - started
+                    self.metrics.write_latency.observe(
+                        self.tenant or "", *key, value=elapsed
+                    )
+                    self.timers.add(*key, "write", elapsed)
+                    if (
+                        operation[0] == _WRITE
+                        and operation[1] is None
+                        and self.sinks is not None
+                    ):
+                        # Waits while a sink's queue and spool are full.
+                        await self.sinks.put(*key, data)
+            except asyncio.CancelledError:
+                _cancel_waiters(batch)
+                raise
+            except Exception as _e:  # pylint: disable=broad-except
+                logging.exception("Failed to write logs: %s", _e)
+                self._error = self._error or _e
+                _fail_waiters(batch, _e)
+                while not queue.empty():
+                    _fail_waiters([queue.get_nowait()], _e)
+                return
+
+    async def _commit(self, key, stage, checkpoints):
+        """ Append a stage (see _append_window) and record the window
+            and the new log file sizes in the checkpoints.
+
+            Runs in the type's worker, so the checkpoints are saved
+            before the type's next commit is appended, and the sizes of
+            a log file are recorded in the order it grew.
+
+        Returns
+        ----------
+        dict
+            Paths of the log files appended to, relative to base_dir,
+            and their new sizes.
+        """
+
+        offsets = await self._append_window(key, stage, checkpoints)
+        if checkpoints:
+            # Saving the checkpoints means an fsync, which mustn't hold
+            # up the requests in flight.
+            with self.timers.time(*key, "checkpoint"):
+                await asyncio.get_event_loop().run_in_executor(
+                    self._executor,
+                    checkpoints.commit_window,
+                    stage.endpoint_type,
+                    stage.type_,
+                    stage.start,
+                    stage.end,
+                    offsets,
+                )
+        return offsets
+
+    async def _append_window(self, key, stage, checkpoints):
+        """ Forward a stage to the sinks, then append it to the type's
+            log file, segment or partitions.
+
+        Returns
+        ----------
+        dict
+            Paths of the log files appended to, relative to base_dir,
+            and their new sizes.
+        """
+
+        loop = asyncio.get_event_loop()
+        if self.sinks is not None:
+            await self._forward_stage(stage)
+        if not self.local_files:
+            await loop.run_in_executor(self._executor, self._remove_stage, stage)
+            return {}
+
+        if self.partitions is not None:
+            return await self._commit_partitions(key, stage, checkpoints)
+
+        log_file = await self._log_target(key, checkpoints)
+        relative_log_file = os.path.relpath(log_file, self.base_dir)
+
+        # Record where the log file starts before the first append so
+        # a crash mid-append can always be rolled back.
+        if checkpoints and checkpoints.log_offset(relative_log_file) is None:
+            offset = await loop.run_in_executor(self._executor, _file_size, log_file)
+            with self.timers.time(*key, "checkpoint"):
+                await loop.run_in_executor(
+                    self._executor,
+                    checkpoints.set_log_offset,
+                    relative_log_file,
+                    offset,
+                )
+
+        size = await loop.run_in_executor(
+            self._executor, self._append_stage, stage, log_file
+        )
+        self._grew(key, log_file, size)
+        return {relative_log_file: size}
+
+    async def _commit_partitions(self, key, stage, checkpoints):
+        """ Split a stage between the type's partitions and append it.
+            See _append_window.
+        """
+
+        loop = asyncio.get_event_loop()
+        groups = await loop.run_in_executor(
+            self._executor, self._read_stage_partitions, stage
+        )
+        directory = self.segment_directory(*key)
+        paths = {name: partition_path(directory, name) for name in groups}
+
+        if checkpoints:
+            relative_paths = {
+                os.path.relpath(path, self.base_dir) for path in paths.values()
+            }
+            prefix = os.path.relpath(directory, self.base_dir) + os.sep
+            offsets = checkpoints.log_offsets()
+            # Partitions left out of this commit hold nothing
+            # uncommitted. They're tracked again if late logs come in
+            # for them.
+            forgotten = [
+                relative_path
+                for relative_path in offsets
+                if relative_path.startswith(prefix)
+                and relative_path not in relative_paths
+            ]
+            with self.timers.time(*key, "checkpoint"):
+                for relative_path in forgotten:
+                    await loop.run_in_executor(
+                        self._executor, checkpoints.forget_log_offset, relative_path
+                    )
+            for path in paths.values():
+                relative_path = os.path.relpath(path, self.base_dir)
+                if offsets.get(relative_path) is None:
+                    offset = await loop.run_in_executor(
+                        self._executor, _file_size, path
+                    )
+                    with self.timers.time(*key, "checkpoint"):
+                        await loop.run_in_executor(
+                            self._executor,
+                            checkpoints.set_log_offset,
+                            relative_path,
+                            offset,
+                        )
+
+        sizes = await loop.run_in_executor(
+            self._executor, self._append_partitions, key, groups, paths, True
+        )
+        await loop.run_in_executor(self._executor, self._remove_stage, stage)
+        return {
+            os.path.relpath(path, self.base_dir): size for path, size in sizes.items()
+        }
+
+    async def _forward_stage(self, stage):
+        """ Forward a staging file to the sinks and wait until they've
+            sent it, so the window is only checkpointed once it has
+            reached them.
+        """
+
+        loop = asyncio.get_event_loop()
+        offset = 0
+        while True:
+            data, offset = await loop.run_in_executor(
+                self._executor, self._read_stage, stage, offset
+            )
+            if not data:
+                break
+            await self.sinks.put(*stage.key, data)
+        await self.sinks.drain()
+
+    def _read_stage(self, stage, offset):
+        """ Read the whole lines of a staging file after offset, up to
+            about _FORWARD_CHUNK_BYTES. Runs on the thread pool.
+
+        Returns
+        ----------
+        tuple
+            (bytes, offset to read from next)
+        """
+
+        staged = self.handles.get(stage.path)
+        if staged is not None:
+            staged.flush()
+        if not os.path.exists(stage.path):
+            return b"", offset
+        with open(stage.path, "rb") as _f:
+            _f.seek(offset)
+            data = _f.read(_FORWARD_CHUNK_BYTES)
+            if len(data) == _FORWARD_CHUNK_BYTES:
+                data += _f.readline()
+        return data, offset + len(data)
+
+    def _local(self, path):
+        """ Is a write to path (None for the type's log file) written to
+            a local file? Staging files always are.
+        """
+
+        return self.local_files or path is not None
+
+    def _partitioned(self, path):
+        """ Is a write to path (None for the type's log file) split
+            between partitions? Staging files never are.
+        """
+
+        return self.partitions is not None and path is None
+
+    def _write_partitions(self, key, pages):
+        """ Encode pages of logs and append each log to its partition.
+            Returns what was written if there are sinks to forward it
+            to. Runs on the thread pool.
+        """
+
+        groups = group_by_partition(pages, self.partitions.field, self.codec)
+        directory = self.segment_directory(*key)
+        paths = {name: partition_path(directory, name) for name in groups}
+        self._append_partitions(key, groups, paths)
+        if self.sinks is None:
+            return None
+        return b"".join(chunk for group in groups.values() for chunk in group[0])
+
+    def _read_stage_partitions(self, stage):
+        """ Read a staging file back and sort its logs into partitions.
+            Runs on the thread pool.
+        """
+
+        staged = self.handles.pop(stage.path, None)
+        if staged is not None:
+            staged.close()
+        if not os.path.exists(stage.path):
+            return {}
+        with open(stage.path, "rb") as _f:
+            lines = RawRecords(line for line in _f.read().splitlines() if line)
+        return group_by_partition([lines], self.partitions.field, self.codec)
+
+    def _append_partitions(self, key, groups, paths, sync=False):
+        """ Append grouped logs to their partitions and update their
+            manifests. With sync (for commits), the partitions and
+            manifests are fsynced. Runs on the thread pool.
+
+        Returns
+        ----------
+        dict
+            Partition paths and their new sizes.
+        """
+
+        sizes = {}
+        for name, (chunks, count, lowest, highest) in groups.items():
+            path = paths[name]
+            manifest = self._manifests.get(path)
+            _f = self._get_handle(path)
+            start = _f.tell()
+            if manifest is None or manifest.bytes != start:
+                manifest = load_manifest(path, self.partitions.field, self.codec)
+                self._manifests[path] = manifest
+
+            data = b"".join(chunks)
+            _f.write(data)
+            if sync:
+                _f.flush()
+                os.fsync(_f.fileno())
+            manifest.add(data, count, lowest, highest)
+            manifest.save(manifest_path(path), sync=sync)
+            sizes[path] = _f.tell()
+            self._indexed(key, _f, path, start)
+
+        # Keep only the partitions that are still being written to
+        # open, or an all day run would hold a file per hour.
+        for path in self._open_partitions.get(key, set()) - set(sizes):
+            self._close_handle(path)
+            self._manifests.pop(path, None)
+        self._open_partitions[key] = set(sizes)
+        return sizes
+
+    async def _log_target(self, key, checkpoints=None):
+        """ Return the file logs for the key should be appended to. With
+            segments, that's the current segment, which is rotated here
+            (between writes) once it's full or too old.
+        """
+
+        if self.segments is None:
+            return self.log_file_path(*key)
+
+        loop = asyncio.get_event_loop()
+        now = time.time()
+        segment = self._active.get(key)
+        if segment is None:
+            segment, closed = await loop.run_in_executor(
+                self._executor,
+                find_segments,
+                self.segment_directory(*key),
+                self.segments,
+            )
+            for path in closed:
+                self._compress_later(path)
+            if segment is not None and not self.segments.should_rotate(segment, now):
+                self._active[key] = segment
+                return segment.path
+            if segment is not None:
+                # Left behind by an earlier run, and already due to be
+                # rotated.
+                await self._close_segment(segment, checkpoints)
+
+        elif self.segments.should_rotate(segment, now):
+            await self._close_segment(segment, checkpoints)
+
+        else:
+            return segment.path
+
+        segment = await loop.run_in_executor(
+            self._executor,
+            new_segment,
+            self.segment_directory(*key),
+            now,
+            self.segments,
+        )
+        self._active[key] = segment
+        return segment.path
+
+    async def _close_segment(self, segment, checkpoints=None):
+        """ Close a segment that won't be written to again: stop tracking
+            its size in the checkpoints and compress it in the background.
+        """
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._executor, self._close_handle, segment.path)
+        relative_path = os.path.relpath(segment.path, self.base_dir)
+        if checkpoints and checkpoints.log_offset(relative_path) is not None:
+            # Everything in it is committed, so there is nothing left to
+            # roll back.
+            await loop.run_in_executor(
+                self._executor, checkpoints.forget_log_offset, relative_path
+            )
+        if not self.segments.stream_compression:
+            self._compress_later(segment.path)
+        logging.info("Closed segment %s (%s bytes).", segment.path, segment.size)
+
+    def _grew(self, key, path, size):
+        """ Keep track of how big the current segment is """
+
+        segment = self._active.get(key)
+        if segment is not None and segment.path == path:
+            segment.size = size
+
+    def _compress_later(self, path):
+        """ Compress a closed segment on the compression thread """
+
+        if self.segments.compression is None:
+            return
+        future = self._compressor.submit(
+            compress_segment, path, self.segments.compression
+        )
+        future.add_done_callback(_log_compression_error)
+
+    def _encode(self, pages):
+        """ Newline delimited json for pages of logs. Runs on the thread
+            pool.
+        """
+
+        return b"".join([serialize_page(page, self.codec) for page in pages])
+
+    def _write(self, path, pages, key=None):
+        """ Encode pages of logs and append them to a file with a single
+            write. The append is indexed if the key of the type is
+            given. Runs on the thread pool.
+
+        Returns
+        ----------
+        tuple
+            (new size of the file, the encoded logs before compression)
+        """
+
+        data = written = self._encode(pages)
+        if self._compresses(path):
+            written = self.segments.compression.compress(data)
+        _f = self._get_handle(path)
+        start = _f.tell()
+        _f.write(written)
+        if key is not None:
+            self._indexed(key, _f, path, start)
+        return _f.tell(), data
+
+    def _indexed(self, key, _f, path, start):
+        """ Report what was appended to a file since 'start' to the
+            index. The file is flushed first so the index can read the
+            logs back. Runs on the thread pool.
+        """
+
+        if self.index is not None:
+            _f.flush()
+            self.index.appended(*key, path, start, _f.tell())
+
+    def _append_stage(self, stage, log_file):
+        """ Append a staging file to a log file, fsync it and return the
+            new size of the log file. Runs on the thread pool.
+        """
+
+        _f = self._get_handle(log_file)
+        start = _f.tell()
+        staged = self.handles.pop(stage.path, None)
+        if staged is not None:
+            staged.close()
+            with open(stage.path, "rb") as staged:
+                if self._compresses(log_file):
+                    _f.flush()
+                    self.segments.compression.copy(staged, _f)
+                else:
+                    shutil.copyfileobj(staged, _f)
+            _f.flush()
+            os.fsync(_f.fileno())
+            os.remove(stage.path)
+            self._indexed(stage.key, _f, log_file, start)
+        return _f.tell()
+
+    def _compresses(self, path):
+        """ Is path a segment that is written compressed? """
+
+        return (
+            self.segments is not None
+            and self.segments.stream_compression
+            and path.endswith(self.segments.active_suffix)
+        )
+
+    def _close_handle(self, path):
+        """ Flush and close the file for path if it's open """
+
+        _f = self.handles.pop(path, None)
+        if _f is not None:
+            _f.close()
+
+    def _remove_stage(self, stage):
+        """ Close and delete a staging file. Runs on the thread pool. """
+
+        staged = self.handles.pop(stage.path, None)
+        if staged is not None:
+            staged.close()
+        if os.path.exists(stage.path):
+            os.remove(stage.path)
+
+    def _get_handle(self, path):
+        """ Return the open file for path, opening it (and creating its
+            directory) if this is the first write to it.
+        """
+
+        if path not in self.handles:
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+            logging.debug("Opening %s log file for streaming.", path)
+            self.handles[path] = open(path, "ab")
+        return self.handles[path]
+
+    def _raise_if_failed(self):
+        """ Re-raise the first error a worker ran into """
+
+        if self._error is not None:
+            raise self._error
+
+
+class WindowStage:
+
+    """ Staging file for the logs of one sub-window of one type.
+
+    Attributes
+    ----------
+    endpoint_type: str
+        'event' or 'alert'
+    type_: str
+        The log 'type'
+    start: int
+        Epoch start of the window.
+    end: int
+        Epoch end of the window.
+    path: str
+        Path to the staging file.
+    key: tuple
+        (endpoint_type, type_). Pages, commits and discards for a type
+        go through the same queue so they happen in order.
+    """
+
+    def __init__(self, writer, endpoint_type, type_, start, end):
+        self.endpoint_type = endpoint_type
+        self.type_ = type_
+        self.start = start
+        self.end = end
+        self.key = (endpoint_type, type_)
+        self.path = os.path.join(
+            writer.staging_directory(),
+            "{}-{}-{}-{}.part".format(endpoint_type, replace_spaces(type_), start, end),
+        )
+        self._writer = writer
+
+    async def write_page(self, log_list):
+        """ Queue a page of logs for the staging file """
+
+        if not log_list:
+            return
+        await self._writer._submit(  # pylint: disable=protected-access
+            self.key, (_WRITE, self.path, log_list)
+        )
+
+
+def _group_writes(batch):
+    """ Merge consecutive writes to the same file into one write of
+        several pages. Commits and discards keep their place.
+    """
+
+    grouped = []
+    for operation in batch:
+        if operation[0] != _WRITE:
+            grouped.append(operation)
+        elif grouped and grouped[-1][0] == _WRITE and grouped[-1][1] == operation[1]:
+            grouped[-1][2].append(operation[2])
+        else:
+            grouped.append((_WRITE, operation[1], [operation[2]]))
+    return grouped
+
+
+def _fail_waiters(batch, error):
+    """ Hand a worker's error to anyone waiting on a commit or discard """
+
+    for operation in batch:
+        if operation[0] != _WRITE and not operation[2].done():
+            operation[2].set_exception(error)
+
+
+def _cancel_waiters(batch):
+    """ Cancel the commits and discards a stopped worker never ran """
+
+    for operation in batch:
+        if operation[0] != _WRITE:
+            operation[2].cancel()
+
+
+def _subdirectories(directory):
+    """ Paths of the directories inside directory """
+
+    if not os.path.isdir(directory):
+        return []
+    return [
+        entry.path for entry in os.scandir(directory) if entry.is_dir()
+    ]
+
+
+def _log_compression_error(future):
+    """ Compression runs in the background, so log its failures """
+
+    if future.exception() is not None:
+        logging.error("Failed to compress segment: %s", future.exception())
+
+
+def _file_size(path):
+    """ Size of a file, or 0 if it doesn't exist yet """
+
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def serialize_page(log_list, codec):
+    """ Newline delimited json bytes for a page of logs. Raw logs from
+        passthrough mode are written as they are.
+    """
+
+    if isinstance(log_list, RawRecords):
+        return log_list.to_lines()
+    return codec.dumps_lines(log_list)
+
+
+def replace_spaces(some_string):
+    """ Substitute spaces with underscores"""
+
+    return re.sub(" ", "_", some_string)
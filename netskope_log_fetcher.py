@@ -2,18 +2,39 @@
 
 
 from datetime import datetime
+import argparse
+import asyncio
+import functools
 import logging
-import json
 import os
 import re
 
 from dotenv import load_dotenv
 
+from netskope_fetcher.backfill import Backfill, parse_time, run_backfills
 from netskope_fetcher.bootstrap import NetskopeAsyncBootstrap
+from netskope_fetcher.checkpoint import CheckpointStore
+from netskope_fetcher.codec import get_codec
+from netskope_fetcher.config import env_bool, env_float, env_int, env_str
+from netskope_fetcher.connection import create_session
+from netskope_fetcher.daemon import NetskopeDaemon, run_daemons
+from netskope_fetcher.dedup import Deduplicator
+from netskope_fetcher.filters import load_filters
+from netskope_fetcher.index import LogIndex
+from netskope_fetcher.scheduler import RequestScheduler
+from netskope_fetcher.segments import SegmentSettings
+from netskope_fetcher.sinks import load_sinks
+from netskope_fetcher.tenants import load_tenants
 from netskope_fetcher.token import Token
 from netskope_fetcher.events import EventClient
 from netskope_fetcher.alerts import AlertClient
-from netskope_fetcher.logger import setup_logger
+from netskope_fetcher.logger import setup_logger, setup_runtime_log_directory
+from netskope_fetcher.metrics import METRICS
+from netskope_fetcher.offload import PageOffloader
+from netskope_fetcher.paging import PageTuner
+from netskope_fetcher.partitions import PartitionSettings
+from netskope_fetcher.profiling import TIMERS, Profiler, parse_profile_options
+from netskope_fetcher.writer import LogWriter
 
 
 class TinyTimeWriter:
@@ -61,7 +82,7 @@ class TinyTimeWriter:
             return time_stamp
 
 
-def write_logs(netskope_object):
+def write_logs(netskope_object, codec=None, base_dir=None):
     """ Writes logs to the type-specific log file.
 
         Pull the log files from netskope_object.log_dictionary, and
@@ -82,9 +103,15 @@ def write_logs(netskope_object):
     netskope_object: netskope_fetcher.events.EventClient
                      OR netskope_fetcher.alerts.AlertClient
         Object contains the log files in log_dictionary.
+    codec: netskope_fetcher.codec.JsonCodec
+        Used to serialize the logs. Defaults to NETSKOPE_JSON_CODEC.
+    base_dir: str
+        Directory the logs folder is in. Defaults to the directory of
+        this file.
     """
 
-    _current_directory = os.path.dirname(__file__)
+    codec = codec or get_codec()
+    _current_directory = base_dir or os.path.dirname(__file__)
     for type_, log_list in netskope_object.log_dictionary.items():
         # Some types have spaces, replace them with underscores
         file_ = replace_spaces(type_)
@@ -94,11 +121,12 @@ def write_logs(netskope_object):
         # Ex: base/file/path/logs/alert/type.log
         log_file = os.path.join(_current_directory, log_path, "{}.log".format(file_))
 
-        with open(log_file, "a+") as _f:
+        with open(log_file, "ab") as _f, TIMERS.time(
+            netskope_object.endpoint_type, type_, "write"
+        ):
             logging.debug("Writing to %s log file.", log_file)
             try:
-                for log in log_list:
-                    _f.write("{}\n".format(json.dumps(log)))
+                _f.write(codec.dumps_lines(log_list))
             except TypeError as _t:
                 # Most likely that log_list is not an iterable
                 logging.warning("Couldn't write logs for %s: %s", type_, {_t})
@@ -118,7 +146,7 @@ def make_dir_if_needed(current_dir, log_dir):
 
     required_dir = os.path.join(current_dir, log_dir)
     if not os.path.isdir(required_dir):
-        os.mkdir(required_dir)
+        os.makedirs(required_dir)
 
 
 def replace_spaces(some_string):
@@ -127,48 +155,553 @@ def replace_spaces(some_string):
     return re.sub(" ", "_", some_string)
 
 
-if __name__ == "__main__":
-    try:
-        setup_logger()
+def parse_args(argv=None):
+    """ Parse the command line arguments """
+
+    parser = argparse.ArgumentParser(description="Pull down Netskope logs.")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and pull down new logs every "
+        "NETSKOPE_DAEMON_INTERVAL seconds instead of exiting after one run.",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="all",
+        type=parse_profile_options,
+        metavar="cpu,memory,loop",
+        help="Profile the run and write cProfile stats (cpu), the top "
+        "allocators (memory), slow asyncio callbacks (loop) and time spent "
+        "per phase to logs/system/. Captures everything if no list is given.",
+    )
+    parser.add_argument(
+        "--tenants",
+        metavar="FILE",
+        help="Pull down the logs of every tenant listed in this json file "
+        "(see netskope_fetcher/tenants.py) instead of NETSKOPE_TENANT_NAME. "
+        "Defaults to NETSKOPE_TENANTS_FILE.",
+    )
+    commands = parser.add_subparsers(dest="command")
+    backfill = commands.add_parser(
+        "backfill",
+        help="Pull down a past range of logs in parallel chunks, into "
+        "backfill/ next to the incremental runs. Run it again to resume.",
+    )
+    backfill.add_argument(
+        "--from",
+        dest="start",
+        required=True,
+        type=parse_time,
+        help="Start of the range: epoch time or ISO 8601 (UTC), ex: 2026-09-01.",
+    )
+    backfill.add_argument(
+        "--to",
+        dest="end",
+        required=True,
+        type=parse_time,
+        help="End of the range: epoch time or ISO 8601 (UTC).",
+    )
+    return parser.parse_args(argv)
+
+
+def setup_output(current_directory, sinks=None, tenant=None):
+    """ Create the streaming LogWriter and the CheckpointStore if they
+        are enabled in the config. The writer forwards logs to the
+        sinks, if any, and labels its metrics with the tenant.
+
+    Returns
+    ----------
+    tuple
+        (LogWriter or None, CheckpointStore or None)
+    """
 
-        CURRENT_DIRECTORY = os.path.dirname(__file__)
-        load_dotenv(dotenv_path=os.path.join(CURRENT_DIRECTORY, ".env"))
+    # In streaming mode each page is written as soon as it arrives
+    # instead of being held in memory until every client is done.
+    # Rotating segments and partitions are written by the streaming
+    # writer too, and only the streaming writer keeps an index or
+    # feeds sinks.
+    writer = None
+    if (
+        env_bool("NETSKOPE_STREAM_LOGS")
+        or SegmentSettings().enabled
+        or PartitionSettings().enabled
+        or env_bool("NETSKOPE_INDEX")
+        or sinks is not None
+    ):
+        writer = setup_writer(current_directory, sinks, tenant)
+
+    # Checkpoints record each committed sub-window per type so a
+    # failed run only pulls down what is missing the next time.
+    checkpoints = None
+    if writer is not None and env_bool("NETSKOPE_CHECKPOINTS"):
+        checkpoints = CheckpointStore(
+            os.path.join(current_directory, "checkpoints.json")
+        )
+        writer.recover(checkpoints)
+
+    return writer, checkpoints
+
+
+def setup_writer(current_directory, sinks=None, tenant=None):
+    """ Create the streaming LogWriter for current_directory, with its
+        index if NETSKOPE_INDEX is enabled.
+    """
+
+    index = None
+    if env_bool("NETSKOPE_INDEX"):
+        index = LogIndex(
+            os.path.join(current_directory, "index.sqlite"), current_directory
+        )
+    return LogWriter(current_directory, index=index, sinks=sinks, tenant=tenant)
+
+
+def setup_backfill(output_dir, sinks=None, **kwargs):
+    """ Create the writer and progress store of a backfill. Both live in
+        output_dir/backfill, so a backfill never touches the log files,
+        checkpoints or time.log of the incremental runs. Backfills
+        always stream and checkpoint, and don't share the dedup filter.
+
+    Returns
+    ----------
+    tuple
+        (None, keyword arguments for fetch_window), like setup_tenant
+        but without a time.log.
+    """
+
+    directory = os.path.join(output_dir, "backfill")
+    os.makedirs(directory, exist_ok=True)
+    writer = setup_writer(directory, sinks, kwargs.get("tenant"))
+    progress = CheckpointStore(os.path.join(directory, "progress.json"))
+    writer.recover(progress)
+    return None, dict(kwargs, writer=writer, checkpoints=progress, output_dir=directory)
+
+
+def setup_dedup(current_directory):
+    """ Create the Deduplicator if NETSKOPE_DEDUP is enabled. Its filter
+        is kept in dedup.state between runs.
+    """
+
+    if not env_bool("NETSKOPE_DEDUP"):
+        return None
+    return Deduplicator(os.path.join(current_directory, "dedup.state"))
+
+
+def setup_filters():
+    """ Read and compile the per-type field filters from
+        NETSKOPE_FILTERS_FILE, if it is set. They apply to every tenant.
+    """
+
+    file_path = env_str("NETSKOPE_FILTERS_FILE")
+    if file_path is None:
+        return None
+    return load_filters(file_path)
+
+
+def setup_sinks(backfill=False):
+    """ Create the sinks set in NETSKOPE_SINKS_FILE, if it is set. They
+        are shared by every tenant. A backfill spools to its own
+        directory so it can run next to the incremental runs.
+    """
+
+    file_path = env_str("NETSKOPE_SINKS_FILE")
+    if file_path is None:
+        return None
+    spool_dir = env_str("NETSKOPE_SINK_SPOOL_DIR")
+    if backfill and spool_dir:
+        return load_sinks(file_path, os.path.join(spool_dir, "backfill"))
+    return load_sinks(file_path)
+
+
+def setup_offload():
+    """ Create the PageOffloader if NETSKOPE_OFFLOAD_WORKERS is set. It
+        is shared by every client (and tenant).
+    """
+
+    offloader = PageOffloader()
+    return offloader if offloader.enabled else None
+
+
+def setup_page_tuner():
+    """ Create a PageTuner if NETSKOPE_PAGE_AUTO_TUNE is enabled. Each
+        tenant gets its own, kept for as long as the process runs.
+    """
+
+    return PageTuner() if env_bool("NETSKOPE_PAGE_AUTO_TUNE") else None
+
+
+def setup_tenant(tenant, sinks=None):
+    """ Create a tenant's output directory, writer, checkpoints and
+        dedup filter. Everything is kept in tenant.output_dir. The
+        writer forwards logs to the sinks, if any.
+
+    Returns
+    ----------
+    tuple
+        (TinyTimeWriter for the tenant's time.log, keyword arguments for
+        fetch_window)
+    """
+
+    os.makedirs(tenant.output_dir, exist_ok=True)
+    writer, checkpoints = setup_output(tenant.output_dir, sinks, tenant.name)
+    kwargs = dict(
+        tenant.client_kwargs(),
+        writer=writer,
+        checkpoints=checkpoints,
+        dedup=setup_dedup(tenant.output_dir),
+        output_dir=tenant.output_dir,
+    )
+    return TinyTimeWriter(os.path.join(tenant.output_dir, "time.log")), kwargs
 
-        TINY_TIME = TinyTimeWriter()
-        TOKEN = Token()
 
-        # End time will always be 'right now'
-        # start_time will be the end of the last successful run, or in the
-        #    case that the last timestamp isn't available, set the start
-        #    time to ten minutes ago.
-        END_TIME = int(datetime.now().timestamp())
-        START_TIME = TINY_TIME.get_last_log_time() or (END_TIME - 600)
+async def fetch_window(session, start, end, **kwargs):
+    """ Pull down and write every log of every type in (start, end].
 
+    Parameters
+    ----------
+    session: aiohttp.ClientSession
+        Session to reuse, or None to create one for this window.
+    start: int
+        Epoch start time.
+    end: int
+        Epoch end time.
+    kwargs:
+        token, writer, checkpoints, dedup, filters, offloader,
+        page_tuner and scheduler, and tenant, base_url, types and
+        output_dir for a tenant from the tenants file. Passed on to the
+        clients.
+
+    Returns
+    ----------
+    bool
+        False if a checkpointed window failed without raising and is
+        still pending.
+    """
+
+    clients = [EventClient(start=start, end=end, **kwargs)]
+    clients.append(AlertClient(start=start, end=end, **kwargs))
+
+    bootstrap = NetskopeAsyncBootstrap(
+        client_list=clients, scheduler=kwargs.get("scheduler"), session=session
+    )
+    await bootstrap.run_async_clients(asyncio.get_event_loop())
+
+    # Write to the log files
+    if kwargs.get("writer") is None:
+        for client in clients:
+            write_logs(client, base_dir=kwargs.get("output_dir"))
+    else:
+        # Wait for the writer to catch up with the fetchers.
+        await kwargs["writer"].drain()
+
+    # Only remember what was written once the writer has caught up.
+    if kwargs.get("dedup") is not None:
+        await kwargs["dedup"].save_async()
+
+    # Publish the metrics for the node_exporter textfile collector.
+    textfile = env_str("NETSKOPE_METRICS_TEXTFILE")
+    if textfile:
+        METRICS.write_textfile(textfile)
+
+    # With checkpoints, a window that failed without raising is
+    # still pending.
+    if kwargs.get("checkpoints") is None:
+        return True
+    return not any(
+        client.pending_windows(type_)
+        for client in clients
+        for type_ in client.type_list
+    )
+
+
+def run_once(time_writer, **kwargs):
+    """ Pull down everything since the last run and save the end time.
+
+    Returns
+    ----------
+    bool
+        True if time.log was moved forward.
+    """
+
+    # End time will always be 'right now'
+    # start_time will be the end of the last successful run, or in the
+    #    case that the last timestamp isn't available, set the start
+    #    time to ten minutes ago.
+    end_time = int(datetime.now().timestamp())
+    start_time = time_writer.get_last_log_time() or (end_time - 600)
+
+    logging.info(
+        "Running from %s to %s",
+        datetime.strftime(datetime.fromtimestamp(start_time), "%c"),
+        datetime.strftime(datetime.fromtimestamp(end_time), "%c"),
+    )
+
+    loop = asyncio.get_event_loop()
+    if not loop.run_until_complete(fetch_window(None, start_time, end_time, **kwargs)):
+        # Leave time.log alone so the next run picks the window up;
+        # the committed windows won't be pulled down again.
+        logging.error("Some windows were not committed. Keeping time.log.")
+        return False
+
+    # Save the end time so that it can be used in the next run.
+    # This is purposely left at the end of the program so that the
+    # subsequent run of the program will gather logs that may have been
+    # missed if the script were to fail mid-stream.
+    time_writer.save_last_log_time(end_time)
+    if kwargs.get("checkpoints") is not None:
+        kwargs["checkpoints"].prune(end_time)
+    return True
+
+
+def run_tenants_once(tenant_runs):
+    """ Pull down everything since each tenant's last run and save the
+        end times. The tenants share one event loop, session and
+        scheduler, which takes requests from each tenant in turn.
+
+    Parameters
+    ----------
+    tenant_runs: list
+        (TinyTimeWriter, fetch_window keyword arguments) per tenant,
+        from setup_tenant.
+
+    Returns
+    ----------
+    bool
+        True if every tenant's time.log was moved forward.
+    """
+
+    end_time = int(datetime.now().timestamp())
+    scheduler = RequestScheduler()
+    windows = []
+    for time_writer, kwargs in tenant_runs:
+        start_time = time_writer.get_last_log_time() or (end_time - 600)
         logging.info(
-            "Running from %s to %s",
-            datetime.strftime(datetime.fromtimestamp(START_TIME), "%c"),
-            datetime.strftime(datetime.fromtimestamp(END_TIME), "%c"),
+            "Running tenant %s from %s to %s",
+            kwargs["tenant"],
+            datetime.strftime(datetime.fromtimestamp(start_time), "%c"),
+            datetime.strftime(datetime.fromtimestamp(end_time), "%c"),
         )
+        windows.append((start_time, kwargs))
+
+    async def fetch_all():
+        async with create_session() as session:
+            return await asyncio.gather(
+                *[
+                    fetch_window(
+                        session, start, end_time, scheduler=scheduler, **kwargs
+                    )
+                    for start, kwargs in windows
+                ],
+                return_exceptions=True
+            )
+
+    results = asyncio.get_event_loop().run_until_complete(fetch_all())
+
+    committed = True
+    for (time_writer, kwargs), result in zip(tenant_runs, results):
+        # One tenant failing doesn't stop the others from moving on.
+        if isinstance(result, Exception):
+            logging.error(
+                "Exception Occurred for tenant %s: %s.",
+                kwargs["tenant"],
+                result,
+                exc_info=result,
+            )
+            committed = False
+        elif not result:
+            logging.error(
+                "Some windows of tenant %s were not committed. Keeping its "
+                "time.log.",
+                kwargs["tenant"],
+            )
+            committed = False
+        else:
+            time_writer.save_last_log_time(end_time)
+            if kwargs.get("checkpoints") is not None:
+                kwargs["checkpoints"].prune(end_time)
+    return committed
+
+
+def make_daemon(time_writer, serve_metrics=True, **kwargs):
+    """ Create a NetskopeDaemon that pulls down new logs every
+        NETSKOPE_DAEMON_INTERVAL seconds with fetch_window(**kwargs).
 
-        CLIENTS = [
-            EventClient(token=TOKEN, start=START_TIME, end=END_TIME),
-            AlertClient(token=TOKEN, start=START_TIME, end=END_TIME),
+    Parameters
+    ----------
+    time_writer: TinyTimeWriter
+        Where the end of the last committed window is kept.
+    serve_metrics: bool
+        Serve the metrics on NETSKOPE_METRICS_PORT from this daemon.
+        Only one daemon per process can.
+    """
+
+    checkpoints = kwargs.get("checkpoints")
+    kwargs["scheduler"] = kwargs.get("scheduler") or RequestScheduler()
+    return NetskopeDaemon(
+        functools.partial(fetch_window, **kwargs),
+        time_writer,
+        interval=env_int("NETSKOPE_DAEMON_INTERVAL", 60),
+        max_window=env_int("NETSKOPE_DAEMON_MAX_WINDOW", 3600),
+        max_cycles=env_int("NETSKOPE_DAEMON_MAX_CYCLES", 2),
+        shutdown_timeout=env_float("NETSKOPE_DAEMON_SHUTDOWN_TIMEOUT", 30.0),
+        default_interval=env_int("NETSKOPE_DEFAULT_INTERVAL", 600),
+        on_commit=checkpoints.prune if checkpoints is not None else None,
+        writer=kwargs.get("writer"),
+        metrics_port=env_int("NETSKOPE_METRICS_PORT", 0) if serve_metrics else 0,
+        metrics_host=env_str("NETSKOPE_METRICS_HOST", "0.0.0.0"),
+    )
+
+
+def run_daemon(time_writer, **kwargs):
+    """ Keep one event loop, session and scheduler alive and pull down
+        new logs every NETSKOPE_DAEMON_INTERVAL seconds until SIGTERM.
+    """
+
+    make_daemon(time_writer, **kwargs).run()
+
+
+def make_backfill(start, end, **kwargs):
+    """ Create a Backfill of (start, end] that pulls each chunk down
+        with fetch_window(**kwargs). kwargs come from setup_backfill.
+    """
+
+    clients = [
+        EventClient(start=start, end=end, **kwargs),
+        AlertClient(start=start, end=end, **kwargs),
+    ]
+    types = [
+        (client.endpoint_type, type_)
+        for client in clients
+        for type_ in client.type_list
+    ]
+    name = "Backfill"
+    if kwargs.get("tenant"):
+        name = "Backfill of {}".format(kwargs["tenant"])
+    return Backfill(
+        functools.partial(fetch_window, **kwargs),
+        start,
+        end,
+        kwargs["checkpoints"],
+        types,
+        name=name,
+    )
+
+
+def run_tenant_backfills(tenant_runs, start, end):
+    """ Backfill (start, end] for every tenant on one event loop and
+        session. The backfills share one scheduler, which takes
+        requests from each tenant in turn.
+
+    Returns
+    ----------
+    bool
+        True if every tenant's range is committed.
+    """
+
+    scheduler = RequestScheduler()
+    return run_backfills(
+        [
+            make_backfill(start, end, scheduler=scheduler, **kwargs)
+            for _, kwargs in tenant_runs
+        ]
+    )
+
+
+def run_tenant_daemons(tenant_runs):
+    """ Run a daemon per tenant on one event loop and session until
+        SIGTERM. The daemons share one scheduler, which takes requests
+        from each tenant in turn.
+    """
+
+    scheduler = RequestScheduler()
+    run_daemons(
+        [
+            make_daemon(
+                time_writer, serve_metrics=index == 0, scheduler=scheduler, **kwargs
+            )
+            for index, (time_writer, kwargs) in enumerate(tenant_runs)
         ]
+    )
 
-        BOOTSTRAP = NetskopeAsyncBootstrap(client_list=CLIENTS)
-        BOOTSTRAP.run()
 
-        # Write to the log files
-        for client in CLIENTS:
-            write_logs(client)
+if __name__ == "__main__":
+    ARGS = parse_args()
+    try:
+        setup_logger()
 
-        # Save the end time so that it can be used in the next run.
-        # This is purposely left at the end of the program so that the
-        # subsequent run of the program will gather logs that may have been
-        # missed if the script were to fail mid-stream.
-        TINY_TIME.save_last_log_time(END_TIME)
+        CURRENT_DIRECTORY = os.path.dirname(__file__)
+        load_dotenv(dotenv_path=os.path.join(CURRENT_DIRECTORY, ".env"))
+
+        BACKFILL = ARGS.command == "backfill"
+        SINKS = setup_sinks(BACKFILL)
+
+        # One (TinyTimeWriter, fetch_window keyword arguments) per
+        # tenant. A backfill has no TinyTimeWriter.
+        TENANTS_FILE = ARGS.tenants or env_str("NETSKOPE_TENANTS_FILE")
+        if BACKFILL and TENANTS_FILE:
+            TENANT_RUNS = [
+                setup_backfill(tenant.output_dir, SINKS, **tenant.client_kwargs())
+                for tenant in load_tenants(TENANTS_FILE)
+            ]
+        elif BACKFILL:
+            TENANT_RUNS = [setup_backfill(CURRENT_DIRECTORY, SINKS, token=Token())]
+        elif TENANTS_FILE:
+            TENANT_RUNS = [
+                setup_tenant(tenant, SINKS) for tenant in load_tenants(TENANTS_FILE)
+            ]
+        else:
+            WRITER, CHECKPOINTS = setup_output(CURRENT_DIRECTORY, SINKS)
+            TENANT_RUNS = [
+                (
+                    TinyTimeWriter(),
+                    {
+                        "token": Token(),
+                        "writer": WRITER,
+                        "checkpoints": CHECKPOINTS,
+                        "dedup": setup_dedup(CURRENT_DIRECTORY),
+                    },
+                )
+            ]
+
+        OFFLOADER = setup_offload()
+        FILTERS = setup_filters()
+        for _, RUN_KWARGS in TENANT_RUNS:
+            RUN_KWARGS["offloader"] = OFFLOADER
+            RUN_KWARGS["filters"] = FILTERS
+            RUN_KWARGS["page_tuner"] = setup_page_tuner()
+
+        PROFILER = None
+        if ARGS.profile:
+            PROFILER = Profiler(setup_runtime_log_directory(), ARGS.profile)
+            PROFILER.start(asyncio.get_event_loop())
+
+        try:
+            if BACKFILL:
+                COMMITTED = run_tenant_backfills(TENANT_RUNS, ARGS.start, ARGS.end)
+            elif TENANTS_FILE and ARGS.daemon:
+                run_tenant_daemons(TENANT_RUNS)
+                COMMITTED = True
+            elif TENANTS_FILE:
+                COMMITTED = run_tenants_once(TENANT_RUNS)
+            elif ARGS.daemon:
+                run_daemon(TENANT_RUNS[0][0], **TENANT_RUNS[0][1])
+                COMMITTED = True
+            else:
+                COMMITTED = run_once(TENANT_RUNS[0][0], **TENANT_RUNS[0][1])
+        finally:
+            # Flush whatever is still buffered for the log files.
+            for _, RUN_KWARGS in TENANT_RUNS:
+                if RUN_KWARGS["writer"] is not None:
+                    RUN_KWARGS["writer"].close()
+            if OFFLOADER is not None:
+                OFFLOADER.close()
+            if SINKS is not None:
+                # Whatever the sinks haven't sent yet is spooled.
+                asyncio.get_event_loop().run_until_complete(SINKS.close())
+            if PROFILER is not None:
+                PROFILER.stop()
     except Exception as _e:
         logging.exception("Exception Occurred: %s.", _e)
         raise
 
-    exit()
+    exit(0 if COMMITTED else 1)
@@ -0,0 +1,93 @@
+"""Tests the classes/functions in netskope_fetcher.backfill"""
+
+import asyncio
+
+import pytest
+
+from netskope_fetcher.backfill import Backfill, parse_time
+from netskope_fetcher.checkpoint import CheckpointStore
+
+TYPES = [("event", "page"), ("alert", "DLP")]
+
+
+def make_backfill(tmpdir, run_window, **kwargs):
+    """ Backfill of (0, 1000] in chunks of 300 seconds """
+
+    progress = CheckpointStore(str(tmpdir.join("progress.json")))
+    options = dict(chunk_seconds=300, parallel=2, progress_interval=60)
+    options.update(kwargs)
+    return Backfill(run_window, 0, 1000, progress, TYPES, **options), progress
+
+
+@pytest.mark.asyncio
+async def test_chunks_run_in_parallel_and_resume(tmpdir):
+    """Tests to see if the range is cut into chunks, no more than
+    'parallel' of them run at once, and a second run only pulls down
+    the chunks that weren't committed.
+    """
+
+    calls = []
+    running = [0, 0]
+
+    async def run_window(session, start, end):  # pylint: disable=unused-argument
+        calls.append((start, end))
+        running[0] += 1
+        running[1] = max(running)
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        if start == 600:
+            return False
+        for endpoint_type, type_ in TYPES:
+            progress.commit_window(endpoint_type, type_, start, end)
+        return True
+
+    backfill, progress = make_backfill(tmpdir, run_window, retries=1)
+    assert backfill.chunks() == [(0, 300), (300, 600), (600, 900), (900, 1000)]
+    assert not await backfill.run_async(session=object())
+    assert running[1] == 2
+    # The failed chunk was retried once.
+    assert sorted(calls) == [(0, 300), (300, 600), (600, 900), (600, 900), (900, 1000)]
+    assert backfill.pending_chunks() == [(600, 900)]
+    assert backfill.done_seconds() == 700 * len(TYPES)
+
+    # The progress store is reloaded, and a type left half done makes
+    # its chunk pending again.
+    calls.clear()
+    backfill, progress = make_backfill(tmpdir, run_window)
+    assert backfill.pending_chunks() == [(600, 900)]
+    progress.state["windows"]["alert/DLP"] = [[0, 150], [300, 600], [900, 1000]]
+    assert backfill.pending_chunks() == [(0, 300), (600, 900)]
+
+
+@pytest.mark.asyncio
+async def test_report_has_progress_and_eta(tmpdir):
+    """Tests to see if the progress report gives the share committed
+    and an ETA from how fast the run has gone.
+    """
+
+    async def run_window(session, start, end):  # pylint: disable=unused-argument
+        for endpoint_type, type_ in TYPES:
+            progress.commit_window(endpoint_type, type_, start, end)
+        return True
+
+    backfill, progress = make_backfill(tmpdir, run_window)
+    progress.commit_window("event", "page", 0, 500)
+    backfill._started = 1  # pylint: disable=protected-access
+    backfill._done_at_start = 0  # pylint: disable=protected-access
+    report = backfill.report()
+    assert "Backfill: 25.0% done, 4 of 4 chunks left, ETA " in report
+
+    assert await backfill.run_async(session=object())
+    assert backfill.report() == "Backfill: 100.0% done, 0 of 4 chunks left"
+    with pytest.raises(ValueError):
+        Backfill(run_window, 10, 10, progress, TYPES)
+
+
+def test_parse_time():
+    """Tests to see if epoch times and ISO 8601 dates are accepted."""
+
+    assert parse_time("1790812800") == 1790812800
+    assert parse_time("2026-10-01") == 1790812800
+    assert parse_time("2026-10-01T02:00+02:00") == 1790812800
+    with pytest.raises(ValueError):
+        parse_time("last tuesday")
@@ -1,12 +1,16 @@
 """Tests the classes/functions in netskope_fetcher.base"""
 
+import asyncio
+import json
 import os
 
 from aiohttp.client_exceptions import ContentTypeError
 import pytest
 
-from netskope_fetcher.base import BaseNetskopeClient
-from tests.helpers import AsyncHelper
+from netskope_fetcher.base import BaseNetskopeClient, split_window
+from netskope_fetcher.token import Token
+from netskope_fetcher.writer import LogWriter
+from tests.helpers import AsyncHelper, FakeSession
 
 
 @pytest.fixture(scope="module")
@@ -108,3 +112,216 @@ async def test_handle_response_returns_expected_error(mocker, async_helper, req)
 
     assert expected_error_dict == error_dict
     assert error_dict.get("token") is None
+
+
+@pytest.mark.asyncio
+async def test_deliver_page_streams_to_writer(mocker, async_helper, req):
+    """Tests to see if pages are handed to the writer (and not kept in
+    log_dictionary) when the client is in streaming mode.
+    """
+
+    writer = mocker.MagicMock()
+    writer.write_page.return_value = async_helper.value(None)
+    client = BaseNetskopeClient(url=req.url, writer=writer)
+    client.endpoint_type = "event"
+
+    await client._deliver_page(  # pylint: disable=protected-access
+        req.type_, [req.expected_dict]
+    )
+
+    writer.write_page.assert_called_once_with("event", req.type_, [req.expected_dict])
+    assert client.log_dictionary == {}
+    assert client.log_counts == {req.type_: 1}
+
+
+@pytest.mark.asyncio
+async def test_api_call_paginates_until_short_page(req):
+    """Tests to see if every record is pulled down exactly once and
+    pagination stops after the first short page.
+    """
+
+    records = [{"n": n, "timestamp": 1} for n in range(23)]
+    session = FakeSession(records, page_size=5)
+    client = BaseNetskopeClient(url=req.url, page_concurrency=2)
+    client.max_logs = 5
+
+    await client._api_call_2(  # pylint: disable=protected-access
+        session,
+        {"token": "fake-token", "type": req.type_, "starttime": 0, "endtime": 1},
+    )
+
+    assert sorted(log["n"] for log in client.log_dictionary[req.type_]) == list(
+        range(23)
+    )
+    assert client.log_counts[req.type_] == 23
+    # One request for the first page, then batches of two: 5/10, 15/20.
+    assert [call.get("skip", 0) for call in session.calls] == [0, 5, 10, 15, 20]
+
+
+@pytest.mark.asyncio
+async def test_async_worker_splits_busy_windows(req):
+    """Tests to see if a window whose first page shows it holds more
+    than split_depth pages is split straight into enough sub-windows,
+    while quiet sub-windows cost a single request.
+    """
+
+    # 12 logs in the first second, 2 more spread out afterwards. The
+    # first page reaches 1 second into the window, so it looks like 100
+    # pages: 13 sub-windows of about 8 pages each.
+    records = [{"n": n, "timestamp": 1001} for n in range(12)]
+    records += [{"n": 12, "timestamp": 1050}, {"n": 13, "timestamp": 1090}]
+    session = FakeSession(records, page_size=5)
+    client = BaseNetskopeClient(
+        url=req.url, token=fake_token(), start=1000, end=1100, min_window=1
+    )
+    client.max_logs = 5
+
+    await client._async_worker(session, req.type_)  # pylint: disable=protected-access
+
+    assert sorted(log["n"] for log in client.log_dictionary[req.type_]) == list(
+        range(14)
+    )
+    windows = {(call["starttime"], call["endtime"]) for call in session.calls}
+    assert windows == {(1000, 1100)} | set(split_window(1000, 1100, 13))
+
+
+@pytest.mark.asyncio
+async def test_async_worker_keeps_the_first_page_of_shallow_windows(req):
+    """Tests to see if a window whose first page is full but shows it
+    holds no more than split_depth pages is paginated with 'skip',
+    keeping the first page rather than splitting the window.
+    """
+
+    records = [{"n": n, "timestamp": 1001 + n * 8} for n in range(12)]
+    session = FakeSession(records, page_size=5)
+    client = BaseNetskopeClient(
+        url=req.url, token=fake_token(), start=1000, end=1100, min_window=1
+    )
+    client.max_logs = 5
+
+    await client._async_worker(session, req.type_)  # pylint: disable=protected-access
+
+    assert sorted(log["n"] for log in client.log_dictionary[req.type_]) == list(
+        range(12)
+    )
+    assert {(call["starttime"], call["endtime"]) for call in session.calls} == {
+        (1000, 1100)
+    }
+    assert [call.get("skip", 0) for call in session.calls] == [0, 5, 10, 15, 20]
+
+
+@pytest.mark.asyncio
+async def test_async_worker_paginates_one_second_windows(req, monkeypatch):
+    """Tests to see if a full one second window is paginated rather than
+    split over and over, even with NETSKOPE_MIN_WINDOW=0.
+    """
+
+    monkeypatch.setenv("NETSKOPE_MIN_WINDOW", "0")
+    records = [{"n": n, "timestamp": 1001} for n in range(12)]
+    session = FakeSession(records, page_size=5)
+    client = BaseNetskopeClient(url=req.url, token=fake_token(), start=1000, end=1001)
+    client.max_logs = 5
+    assert client.min_window == 1
+
+    await client._async_worker(session, req.type_)  # pylint: disable=protected-access
+
+    assert sorted(log["n"] for log in client.log_dictionary[req.type_]) == list(
+        range(12)
+    )
+
+
+class StalledWriter:  # pylint: disable=too-few-public-methods
+    """ Stand-in for LogWriter that holds every page until 'released'
+    is set.
+    """
+
+    def __init__(self):
+        self.released = asyncio.Event()
+        self.logs = []
+
+    # pylint: disable=unused-argument
+    async def write_page(self, endpoint_type, type_, log_list):
+        """ Wait for 'released', then keep the logs."""
+
+        await self.released.wait()
+        self.logs.extend(log_list)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("count", [400, 4000])
+async def test_pages_waiting_on_the_writer_are_bounded(req, count):
+    """Tests to see if no more than page_concurrency pages are pulled
+    down while the writer is stalled, however many logs (and so
+    sub-windows) there are.
+    """
+
+    records = [{"n": n, "timestamp": 1001 + n} for n in range(count)]
+    session = FakeSession(records, page_size=5)
+    writer = StalledWriter()
+    client = BaseNetskopeClient(
+        url=req.url,
+        token=fake_token(),
+        start=1000,
+        end=1000 + count,
+        min_window=1,
+        page_concurrency=2,
+        writer=writer,
+    )
+    client.endpoint_type = "event"
+    client.max_logs = 5
+
+    task = asyncio.ensure_future(
+        client._async_worker(session, req.type_)  # pylint: disable=protected-access
+    )
+    await asyncio.sleep(0.1)
+
+    # The first page of the whole range, which is split, then the first
+    # page of as many sub-windows as page_concurrency.
+    assert len(session.calls) == 1 + client.page_concurrency
+    writer.released.set()
+    await task
+    assert sorted(log["n"] for log in writer.logs) == list(range(count))
+
+
+def test_split_window_covers_range_without_overlap():
+    """Tests to see if split_window returns contiguous windows."""
+
+    assert split_window(0, 10, 3) == [(0, 3), (3, 6), (6, 10)]
+    assert split_window(5, 6, 4) == [(5, 6)]
+
+
+def fake_token():
+    """Returns a stand-in for netskope_fetcher.token.Token"""
+
+    return Token(auth_token="fake-token")
+
+
+@pytest.mark.asyncio
+async def test_passthrough_writes_raw_logs(tmpdir, req):
+    """Tests to see if passthrough mode writes the logs to file as the
+    API sent them.
+    """
+
+    records = [{"n": n, "timestamp": 1001} for n in range(7)]
+    writer = LogWriter(str(tmpdir))
+    client = BaseNetskopeClient(
+        url=req.url,
+        token=fake_token(),
+        start=1000,
+        end=1100,
+        writer=writer,
+        passthrough=True,
+    )
+    client.endpoint_type = "event"
+    client.max_logs = 5
+
+    await client._async_worker(  # pylint: disable=protected-access
+        FakeSession(records, page_size=5), req.type_
+    )
+    await writer.drain()
+    writer.close()
+
+    with open(writer.log_file_path("event", req.type_), "rb") as _f:
+        lines = _f.read().splitlines()
+    assert sorted(json.loads(line)["n"] for line in lines) == list(range(7))
+    assert client.log_counts[req.type_] == 7
@@ -0,0 +1,105 @@
+"""Tests the classes/functions in netskope_fetcher.checkpoint"""
+
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from netskope_fetcher.checkpoint import CheckpointStore
+from netskope_fetcher.writer import LogWriter
+
+
+def test_pending_windows_skips_committed_windows(tmpdir):
+    """Tests to see if committed windows are left out of the pending
+    windows, and if adjacent windows are merged.
+    """
+
+    store = CheckpointStore(os.path.join(str(tmpdir), "checkpoints.json"))
+    store.commit_window("event", "page", 100, 200)
+    store.commit_window("event", "page", 200, 300)
+    store.commit_window("event", "page", 500, 600)
+
+    assert store.state["windows"]["event/page"] == [[100, 300], [500, 600]]
+    assert store.pending_windows("event", "page", 0, 1000) == [
+        (0, 100),
+        (300, 500),
+        (600, 1000),
+    ]
+    assert store.pending_windows("event", "audit", 0, 1000) == [(0, 1000)]
+
+
+def test_checkpoints_survive_a_restart(tmpdir):
+    """Tests to see if a new CheckpointStore picks up where the last
+    one left off, and if prune forgets old windows.
+    """
+
+    path = os.path.join(str(tmpdir), "checkpoints.json")
+    store = CheckpointStore(path)
+    store.commit_window("alert", "DLP", 0, 50, {"logs/alert/DLP.log": 10})
+
+    restarted = CheckpointStore(path)
+    assert restarted.pending_windows("alert", "DLP", 0, 100) == [(50, 100)]
+    assert restarted.log_offset("logs/alert/DLP.log") == 10
+
+    restarted.prune(50)
+    assert restarted.pending_windows("alert", "DLP", 0, 100) == [(0, 100)]
+
+
+@pytest.mark.asyncio
+async def test_commits_are_saved_off_the_event_loop(tmpdir, monkeypatch):
+    """Tests to see if committing a window saves the checkpoints in the
+    writer's threads rather than on the event loop.
+    """
+
+    store = CheckpointStore(os.path.join(str(tmpdir), "checkpoints.json"))
+    threads = []
+    save = store.save
+
+    def recording_save():
+        threads.append(threading.current_thread())
+        save()
+
+    monkeypatch.setattr(store, "save", recording_save)
+    writer = LogWriter(str(tmpdir))
+    stage = writer.open_stage("event", "page", 0, 10)
+    await stage.write_page([{"n": 1}])
+    await writer.commit_stage(stage, store)
+    writer.close()
+
+    assert threads and threading.main_thread() not in threads
+    restarted = CheckpointStore(store.file_path)
+    assert restarted.pending_windows("event", "page", 0, 10) == []
+
+
+@pytest.mark.asyncio
+async def test_commits_of_a_type_are_checkpointed_in_order(tmpdir, monkeypatch):
+    """Tests to see if a log file's recorded size never goes back to that
+    of an earlier commit, even when saving the earlier commit's
+    checkpoint is slow.
+    """
+
+    store = CheckpointStore(os.path.join(str(tmpdir), "checkpoints.json"))
+    commit_window = store.commit_window
+
+    def slow_first_commit(endpoint_type, type_, start, end, offsets=None):
+        if start == 0:
+            time.sleep(0.2)
+        commit_window(endpoint_type, type_, start, end, offsets)
+
+    monkeypatch.setattr(store, "commit_window", slow_first_commit)
+    writer = LogWriter(str(tmpdir))
+    stages = [
+        writer.open_stage("event", "page", 0, 10),
+        writer.open_stage("event", "page", 10, 20),
+    ]
+    for stage in stages:
+        await stage.write_page([{"n": stage.start}])
+    await asyncio.gather(*[writer.commit_stage(stage, store) for stage in stages])
+    writer.close()
+
+    log_file = writer.log_file_path("event", "page")
+    relative_log_file = os.path.relpath(log_file, str(tmpdir))
+    assert store.log_offset(relative_log_file) == os.path.getsize(log_file)
+    assert store.pending_windows("event", "page", 0, 20) == []
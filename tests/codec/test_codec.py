@@ -0,0 +1,54 @@
+"""Tests the classes/functions in netskope_fetcher.codec"""
+
+import json
+
+import pytest
+
+from netskope_fetcher.codec import available_codecs, get_codec
+
+
+LOGS = [{"_id": "a1", "user": "Zoë", "count": 1}, {"_id": "b2", "nested": [1, 2]}]
+
+
+@pytest.mark.parametrize("codec", available_codecs(), ids=lambda codec: codec.name)
+def test_codecs_round_trip_ndjson(codec):
+    """Tests to see if every installed codec writes one json document
+    per line that decodes back to the original logs.
+    """
+
+    lines = codec.dumps_lines(LOGS).splitlines()
+
+    assert [codec.loads(line) for line in lines] == LOGS
+    assert [json.loads(line) for line in lines] == LOGS
+
+
+def test_stdlib_codec_matches_json_dumps():
+    """Tests to see if the stdlib backend writes exactly what
+    json.dumps did before codecs existed.
+    """
+
+    assert get_codec("stdlib").dumps_lines(LOGS) == "".join(
+        "{}\n".format(json.dumps(log)) for log in LOGS
+    ).encode()
+
+
+def test_unknown_codec_raises_value_error():
+    """Tests to see if a typo in NETSKOPE_JSON_CODEC is reported."""
+
+    with pytest.raises(ValueError):
+        get_codec("simdjsn")
+
+
+def test_auto_codec_writes_like_json_dumps(monkeypatch):
+    """Tests to see if the default codec writes logs in the format of
+    json.dumps even when a faster backend is installed.
+    """
+
+    monkeypatch.setenv("NETSKOPE_JSON_CODEC", "auto")
+    codec = get_codec()
+
+    assert codec.name == "auto"
+    assert codec.dumps_lines(LOGS) == "".join(
+        "{}\n".format(json.dumps(log)) for log in LOGS
+    ).encode()
+    assert codec.loads(codec.dumps(LOGS[0])) == LOGS[0]
@@ -0,0 +1,21 @@
+"""Tests the classes/functions in netskope_fetcher.connection"""
+
+from netskope_fetcher.connection import HttpSettings
+
+
+def test_endpoint_timeouts_override_global_timeouts(monkeypatch):
+    """Tests to see if NETSKOPE_<ENDPOINT>_HTTP_* settings take
+    precedence over the NETSKOPE_HTTP_* settings for that endpoint only.
+    """
+
+    monkeypatch.setenv("NETSKOPE_HTTP_READ_TIMEOUT", "30")
+    monkeypatch.setenv("NETSKOPE_EVENT_HTTP_READ_TIMEOUT", "300")
+    monkeypatch.setenv("NETSKOPE_HTTP_CONNECT_TIMEOUT", "5")
+
+    event_timeout = HttpSettings("event").timeout()
+    alert_timeout = HttpSettings("alert").timeout()
+
+    assert event_timeout.sock_read == 300
+    assert alert_timeout.sock_read == 30
+    assert event_timeout.sock_connect == alert_timeout.sock_connect == 5
+    assert event_timeout.total is None
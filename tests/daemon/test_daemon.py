@@ -0,0 +1,127 @@
+"""Tests the classes/functions in netskope_fetcher.daemon"""
+
+import asyncio
+import os
+import time
+
+import pytest
+
+from netskope_fetcher.daemon import NetskopeDaemon
+from netskope_fetcher.writer import LogWriter
+
+
+class MemoryTimeWriter:
+    """ Stand-in for TinyTimeWriter that keeps the time in memory."""
+
+    def __init__(self, last_time=None):
+        self.last_time = last_time
+
+    def save_last_log_time(self, _time):
+        """ Remember the time."""
+
+        self.last_time = _time
+
+    def get_last_log_time(self):
+        """ Return the remembered time."""
+
+        return self.last_time
+
+
+def test_next_windows_catches_up_in_overlapping_cycles():
+    """Tests to see if a backlog is cut into max_window sized windows,
+    no more than max_cycles at a time, and nothing is returned before
+    the interval has passed.
+    """
+
+    daemon = NetskopeDaemon(
+        None, MemoryTimeWriter(), interval=60, max_window=100, max_cycles=2
+    )
+
+    assert daemon.next_windows(1000, 1030) == []
+    assert daemon.next_windows(1000, 1090) == [(1000, 1090)]
+    assert daemon.next_windows(1000, 1400) == [(1000, 1100), (1100, 1200)]
+
+
+@pytest.mark.asyncio
+async def test_time_only_moves_over_contiguous_committed_windows(monkeypatch):
+    """Tests to see if time.log stops at the first window that failed
+    even when a later window committed.
+    """
+
+    async def run_window(session, start, end):  # pylint: disable=unused-argument
+        return start != 1100
+
+    monkeypatch.setattr(time, "time", lambda: 1300)
+    time_writer = MemoryTimeWriter(1000)
+    daemon = NetskopeDaemon(run_window, time_writer, max_window=100, max_cycles=3)
+    await daemon._run_cycles(None, 1000)  # pylint: disable=protected-access
+
+    assert time_writer.last_time == 1100
+
+
+@pytest.mark.asyncio
+async def test_next_window_starts_as_soon_as_one_finishes(monkeypatch):
+    """Tests to see if catching up keeps max_cycles windows in flight
+    instead of waiting for a whole batch, and time.log follows the
+    windows as they commit.
+    """
+
+    release = asyncio.Event()
+    started = []
+
+    async def run_window(session, start, end):  # pylint: disable=unused-argument
+        started.append(start)
+        if start == 1000:
+            await release.wait()
+        return True
+
+    monkeypatch.setattr(time, "time", lambda: 1400)
+    time_writer = MemoryTimeWriter(1000)
+    daemon = NetskopeDaemon(run_window, time_writer, max_window=100, max_cycles=2)
+    task = asyncio.ensure_future(
+        daemon._run_cycles(None, 1000)  # pylint: disable=protected-access
+    )
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    assert started == [1000, 1100, 1200, 1300]
+    assert time_writer.last_time == 1000
+
+    release.set()
+    assert await task
+    assert time_writer.last_time == 1400
+
+
+@pytest.mark.asyncio
+async def test_shutdown_discards_what_cancelled_windows_staged(tmpdir):
+    """Tests to see if the daemon stops the writer's workers and removes
+    the staging files of windows it cancelled on shutdown.
+    """
+
+    writer = LogWriter(str(tmpdir))
+
+    async def run_window(session, start, end):  # pylint: disable=unused-argument
+        stage = writer.open_stage("event", "page", start, end)
+        await stage.write_page([{"start": start}])
+        await asyncio.Event().wait()
+
+    last_time = int(time.time()) - 200
+    time_writer = MemoryTimeWriter(last_time)
+    daemon = NetskopeDaemon(
+        run_window,
+        time_writer,
+        writer=writer,
+        max_window=100,
+        max_cycles=2,
+        shutdown_timeout=0.1,
+    )
+    task = asyncio.ensure_future(daemon.run_async(session=object()))
+    await asyncio.sleep(0.1)
+    assert len(os.listdir(writer.staging_directory())) == 2
+
+    daemon.stop()
+    await asyncio.wait_for(task, 5)
+    writer.close()
+
+    assert os.listdir(writer.staging_directory()) == []
+    assert time_writer.last_time == last_time
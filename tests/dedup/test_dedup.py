@@ -0,0 +1,85 @@
+"""Tests the classes/functions in netskope_fetcher.dedup"""
+
+import os
+import threading
+
+import pytest
+
+from netskope_fetcher.dedup import Deduplicator
+from netskope_fetcher.passthrough import RawRecords
+
+
+def test_duplicates_are_suppressed_across_runs(tmpdir):
+    """Tests to see if a log written by an earlier run is dropped and
+    counted, but the same _id under another type is not.
+    """
+
+    file_path = os.path.join(str(tmpdir), "dedup.state")
+    dedup = Deduplicator(file_path, capacity=100)
+    assert dedup.filter_page("event", "page", [{"_id": "a"}, {"_id": "b"}]) == [
+        {"_id": "a"},
+        {"_id": "b"},
+    ]
+    dedup.save()
+
+    dedup = Deduplicator(file_path, capacity=100)
+    page = [{"_id": "b"}, {"_id": "c"}, {"_id": "c"}, {"no_id": 1}]
+    assert dedup.filter_page("event", "page", page) == [{"_id": "c"}, {"no_id": 1}]
+    assert dedup.filter_page("alert", "page", [{"_id": "b"}]) == [{"_id": "b"}]
+    assert dedup.suppressed == {"event/page": 2}
+
+
+@pytest.mark.asyncio
+async def test_save_async_writes_the_filter_off_the_event_loop(tmpdir, monkeypatch):
+    """Tests to see if save_async writes the filter in another thread
+    and a restart picks it up.
+    """
+
+    file_path = os.path.join(str(tmpdir), "dedup.state")
+    dedup = Deduplicator(file_path, capacity=100)
+    dedup.filter_page("event", "page", [{"_id": "a"}])
+    threads = []
+    write = dedup._write  # pylint: disable=protected-access
+
+    def recording_write(data):
+        threads.append(threading.current_thread())
+        write(data)
+
+    monkeypatch.setattr(dedup, "_write", recording_write)
+    await dedup.save_async()
+
+    assert threads and threading.main_thread() not in threads
+    restarted = Deduplicator(file_path, capacity=100)
+    assert restarted.filter_page("event", "page", [{"_id": "a"}]) == []
+
+
+def test_window_keys_are_only_remembered_on_commit():
+    """Tests to see if a discarded window can be pulled down again while
+    duplicates within a window are still dropped.
+    """
+
+    dedup = Deduplicator(capacity=100)
+    window = object()
+    page = RawRecords([b'{"_id": "a", "n": 1}', b'{"_id": "a", "n": 2}'])
+
+    kept = dedup.filter_page("event", "page", page, window)
+    assert kept == [b'{"_id": "a", "n": 1}'] and isinstance(kept, RawRecords)
+
+    dedup.discard(window)
+    assert len(dedup.filter_page("event", "page", RawRecords(page[:1]), window)) == 1
+    dedup.commit(window)
+    assert dedup.filter_page("event", "page", RawRecords(page[:1])) == []
+
+
+def test_memory_stays_bounded():
+    """Tests to see if old generations are dropped once the newest one
+    fills up, and that keys can be built from other fields.
+    """
+
+    dedup = Deduplicator(capacity=10, generations=2, fields=["user", "timestamp"])
+    for n in range(25):
+        dedup.filter_page("event", "page", [{"user": "u", "timestamp": n}])
+
+    assert len(dedup._filters) == 2  # pylint: disable=protected-access
+    assert dedup.filter_page("event", "page", [{"user": "u", "timestamp": 0}])
+    assert not dedup.filter_page("event", "page", [{"user": "u", "timestamp": 24}])
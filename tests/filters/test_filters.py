@@ -0,0 +1,152 @@
+"""Tests the classes/functions in netskope_fetcher.filters"""
+
+import json
+import os
+
+import pytest
+
+from netskope_fetcher.base import BaseNetskopeClient
+from netskope_fetcher.filters import (
+    FieldFilters,
+    compile_filter,
+    compile_predicate,
+    load_filters,
+)
+from netskope_fetcher.token import Token
+from netskope_fetcher.writer import LogWriter
+from tests.helpers import FakeSession
+
+
+LOGS = [
+    {"_id": "a", "user": "ann", "app": "Slack", "severity": 1, "extra": "x"},
+    {"_id": "b", "user": "bob", "app": "Box", "severity": 5, "extra": "y"},
+    {"_id": "c", "user": "cy", "app": "Slack Enterprise", "severity": "high"},
+    {"_id": "d", "app": ["Slack"], "severity": 3.5},
+]
+
+
+@pytest.mark.parametrize(
+    "predicate, expected",
+    [
+        ({"field": "user", "equals": "bob"}, ["b"]),
+        ({"field": "user", "in": ["ann", "cy", "zed"]}, ["a", "c"]),
+        ({"field": "app", "in": [["Slack"]]}, ["d"]),
+        ({"field": "app", "regex": "^Slack"}, ["a", "c"]),
+        ({"field": "severity", "min": 3}, ["b", "d"]),
+        ({"field": "severity", "min": 2, "max": 4}, ["d"]),
+        ({"field": "user", "equals": "bob", "not": True}, ["a", "c", "d"]),
+    ],
+)
+def test_compile_predicate(predicate, expected):
+    """Tests to see if equals, in-set, regex and numeric range
+    predicates match the right logs, a missing or mistyped field never
+    matches and 'not' negates.
+    """
+
+    matches = compile_predicate(predicate)
+
+    assert [log["_id"] for log in LOGS if matches(log)] == expected
+
+
+@pytest.mark.parametrize(
+    "predicate",
+    [
+        {"equals": 1},
+        {"field": "user"},
+        {"field": "user", "equals": "a", "in": ["a"]},
+        {"field": "user", "like": "a"},
+        {"field": "user", "regex": "("},
+        {"field": "severity", "min": "3"},
+        {"field": "user", "in": "ann"},
+    ],
+)
+def test_compile_predicate_rejects_bad_predicates(predicate):
+    """Tests to see if a predicate without a field or with an unknown,
+    extra or badly typed operator is refused.
+    """
+
+    with pytest.raises(ValueError):
+        compile_predicate(predicate)
+
+
+def test_compile_filter_projects_and_filters():
+    """Tests to see if keep, drop, include and exclude combine."""
+
+    filter_ = compile_filter(
+        {
+            "keep": ["_id", "app", "extra"],
+            "drop": ["extra"],
+            "include": [{"field": "app", "regex": "Slack|Box"}],
+            "exclude": [{"field": "severity", "equals": "high"}],
+        }
+    )
+
+    assert filter_(LOGS) == [{"_id": "a", "app": "Slack"}, {"_id": "b", "app": "Box"}]
+    assert compile_filter({"drop": ["extra", "severity", "app", "user"]})(LOGS) == [
+        {"_id": log["_id"]} for log in LOGS
+    ]
+    assert compile_filter({}) is None
+
+
+def test_load_filters(tmpdir):
+    """Tests to see if filters are looked up by endpoint and type, and a
+    file that isn't keyed by 'endpoint/type' is refused.
+    """
+
+    path = os.path.join(str(tmpdir), "filters.json")
+    with open(path, "w") as _f:
+        json.dump({"event/page": {"keep": ["_id"]}, "event/audit": {}}, _f)
+
+    filters = load_filters(path)
+
+    assert filters.get("event", "page")(LOGS[:1]) == [{"_id": "a"}]
+    assert filters.spec("event", "page") == {"keep": ["_id"]}
+    assert filters.get("event", "audit") is None
+    assert filters.get("alert", "page") is None
+    with pytest.raises(ValueError):
+        FieldFilters({"page": {"keep": ["_id"]}})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("passthrough", [False, True])
+async def test_filtered_pages_still_paginate(tmpdir, passthrough):
+    """Tests to see if a page that the filter empties out still counts
+    as full, so the following pages are pulled down, and passthrough
+    mode is skipped for filtered types.
+    """
+
+    records = [
+        {"_id": str(n), "n": n, "timestamp": 1001, "noise": n % 3 == 0}
+        for n in range(12)
+    ]
+    writer = LogWriter(str(tmpdir))
+    client = BaseNetskopeClient(
+        url="https://some.goofy.fake/url/for/tests",
+        token=Token(auth_token="fake-token"),
+        start=1000,
+        end=1100,
+        writer=writer,
+        passthrough=passthrough,
+        filters=FieldFilters(
+            {
+                "event/page": {
+                    "keep": ["n"],
+                    "exclude": [{"field": "noise", "equals": True}],
+                }
+            }
+        ),
+    )
+    client.endpoint_type = "event"
+    client.max_logs = 3
+
+    await client._async_worker(  # pylint: disable=protected-access
+        FakeSession(records, page_size=3), "page"
+    )
+    await writer.drain()
+    writer.close()
+
+    with open(writer.log_file_path("event", "page"), "rb") as _f:
+        written = [json.loads(line) for line in _f.read().splitlines()]
+    assert sorted(log["n"] for log in written) == [1, 2, 4, 5, 7, 8, 10, 11]
+    assert all(list(log) == ["n"] for log in written)
+    assert client.log_counts["page"] == 12
@@ -1,5 +1,7 @@
 """Module to hold helper classes shared across tests."""
 
+import json
+
 
 class AsyncHelper:
     """ Class wrapper for helper functions. When unit testing async
@@ -19,3 +21,52 @@ class AsyncHelper:
         """ Coroutine wrapper for mocking forced exceptions/errors."""
 
         raise error(*args, **kwargs)
+
+
+class FakeResponse:
+    """ Stand-in for aiohttp.ClientResponse that returns a prepared
+    json body.
+    """
+
+    def __init__(self, json_, status=200, headers=None):
+        self.status = status
+        self.headers = headers or {"Content-Type": "application/json"}
+        self._json = json_
+
+    async def read(self):
+        """ Return the prepared json body as bytes."""
+
+        return json.dumps(self._json).encode()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeSession:
+    """ Stand-in for aiohttp.ClientSession that serves 'records' a page
+    at a time, honoring the 'starttime', 'endtime' and 'skip' query
+    parameters the same way the Netskope API does, and 'limit' up to
+    page_size. Every set of query parameters is recorded in 'calls'.
+    """
+
+    def __init__(self, records, page_size):
+        self.records = records
+        self.page_size = page_size
+        self.calls = []
+
+    def get(self, url, params=None, **kwargs):  # pylint: disable=unused-argument
+        """ Return a FakeResponse holding the requested page."""
+
+        self.calls.append(dict(params))
+        skip = params.get("skip", 0)
+        in_window = [
+            record
+            for record in self.records
+            if params["starttime"] < record["timestamp"] <= params["endtime"]
+        ]
+        limit = min(params.get("limit", self.page_size), self.page_size)
+        data = in_window[skip : skip + limit]
+        return FakeResponse({"status": "success", "data": data})
@@ -0,0 +1,155 @@
+"""Tests the classes/functions in netskope_fetcher.index and
+netskope_fetcher.query"""
+
+import io
+import json
+import os
+
+import pytest
+
+from netskope_fetcher.checkpoint import CheckpointStore
+from netskope_fetcher.index import LogIndex, read_records
+from netskope_fetcher.partitions import PartitionSettings
+from netskope_fetcher.passthrough import RawRecords
+from netskope_fetcher.query import main as query_main
+from netskope_fetcher.writer import LogWriter
+
+
+def make_writer(tmpdir, **kwargs):
+    """ LogWriter indexing to tmpdir/index.sqlite """
+
+    index = LogIndex(os.path.join(str(tmpdir), "index.sqlite"), str(tmpdir))
+    return LogWriter(str(tmpdir), index=index, **kwargs), index
+
+
+def log(n, user="alice", app="Box"):
+    """ A log with the indexed fields """
+
+    return {"_id": "id{}".format(n), "timestamp": 1000 + n, "user": user, "app": app}
+
+
+@pytest.mark.asyncio
+async def test_written_logs_are_found_by_their_fields(tmpdir):
+    """Tests to see if logs written straight to the log file, raw or
+    not, can be looked up by any indexed field and read back from their
+    offsets.
+    """
+
+    writer, index = make_writer(tmpdir)
+    await writer.write_page("event", "page", [log(1), log(2, user="bob")])
+    await writer.write_page(
+        "alert", "DLP", RawRecords([json.dumps(log(3, app="Slack")).encode()])
+    )
+    await writer.drain()
+    writer.close()
+
+    found = read_records(str(tmpdir), index.lookup({"user": "alice"}))
+    assert found == [
+        (os.path.join("logs", "event", "page.log"), log(1)),
+        (os.path.join("logs", "alert", "DLP.log"), log(3, app="Slack")),
+    ]
+    assert read_records(str(tmpdir), index.lookup({"_id": "id2"}))[0][1] == log(
+        2, user="bob"
+    )
+    assert index.lookup({"user": "alice"}, types=["alert/DLP"], start=1002)
+    assert not index.lookup({"user": "alice", "app": "Slack"}, end=1002)
+    with pytest.raises(ValueError):
+        index.lookup({"url": "x"})
+
+
+def test_appends_past_a_full_queue_are_indexed_later(tmpdir):
+    """Tests to see if appends that don't fit in the queue are still
+    indexed once the indexing thread catches up.
+    """
+
+    path = os.path.join(str(tmpdir), "page.log")
+    lines = [json.dumps(log(n)).encode() + b"\n" for n in range(200)]
+    with open(path, "wb") as _f:
+        _f.write(b"".join(lines))
+    index = LogIndex(
+        os.path.join(str(tmpdir), "index.sqlite"), str(tmpdir), queue_size=1
+    )
+    offset = 0
+    for line in lines:
+        index.appended("event", "page", path, offset, offset + len(line))
+        offset += len(line)
+    index.close()
+
+    found = read_records(str(tmpdir), index.lookup({"user": "alice"}))
+    assert [record for _, record in found] == [log(n) for n in range(200)]
+
+
+def test_appends_are_dropped_once_indexing_fails(tmpdir, monkeypatch, caplog):
+    """Tests to see if appends stop piling up once the indexing thread
+    has died, and if the failure is logged once.
+    """
+
+    index = LogIndex(
+        os.path.join(str(tmpdir), "index.sqlite"), str(tmpdir), queue_size=1
+    )
+
+    def broken_index(*args):  # pylint: disable=unused-argument
+        raise OSError("disk full")
+
+    monkeypatch.setattr(index, "_index", broken_index)
+    path = os.path.join(str(tmpdir), "page.log")
+    index.appended("event", "page", path, 0, 10)
+    index._thread.join(5)  # pylint: disable=protected-access
+    for offset in range(10, 2000, 10):
+        index.appended("event", "page", path, offset, offset + 10)
+    index.close()
+
+    assert index._queue.empty()  # pylint: disable=protected-access
+    assert not index._missed  # pylint: disable=protected-access
+    assert caplog.text.count("Indexing failed") == 1
+
+
+@pytest.mark.asyncio
+async def test_committed_stages_are_indexed_and_rollbacks_forgotten(tmpdir):
+    """Tests to see if logs are indexed once their window is committed
+    (not while staged), and if recover forgets the rolled back ones.
+    """
+
+    checkpoints = CheckpointStore(os.path.join(str(tmpdir), "checkpoints.json"))
+    writer, index = make_writer(tmpdir, partitions=PartitionSettings(enabled=True))
+
+    stage = writer.open_stage("event", "page", 1000, 1010)
+    await stage.write_page([log(1), log(2)])
+    await writer.commit_stage(stage, checkpoints)
+    # Simulate a crash after an append but before its commit.
+    await writer.write_page("event", "page", [log(3)])
+    await writer.drain()
+    writer.close()
+    assert len(index.lookup({"user": "alice"})) == 3
+
+    writer, index = make_writer(tmpdir, partitions=PartitionSettings(enabled=True))
+    writer.recover(checkpoints)
+    writer.close()
+
+    matches = index.lookup({"user": "alice"})
+    assert [record for _, record in read_records(str(tmpdir), matches)] == [
+        log(1),
+        log(2),
+    ]
+    assert matches[0][0] == os.path.join(
+        "logs", "event", "page", "1970", "01", "01", "00.ndjson"
+    )
+
+
+@pytest.mark.asyncio
+async def test_query_prints_matching_logs(tmpdir):
+    """Tests to see if the query command prints the matching logs as
+    json lines and exits 1 when nothing matches.
+    """
+
+    writer, _ = make_writer(tmpdir)
+    await writer.write_page("event", "page", [log(1), log(2, user="bob")])
+    await writer.drain()
+    writer.close()
+
+    out = io.BytesIO()
+    assert query_main(["user=bob", "--dir", str(tmpdir)], out=out) == 0
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == [
+        log(2, user="bob")
+    ]
+    assert query_main(["user=carol", "--dir", str(tmpdir)], out=io.BytesIO()) == 1
@@ -0,0 +1,116 @@
+"""Tests the classes/functions in netskope_fetcher.metrics"""
+
+import os
+import time
+
+import aiohttp
+import pytest
+
+from netskope_fetcher.base import BaseNetskopeClient
+from netskope_fetcher.metrics import (
+    Counter,
+    Histogram,
+    NetskopeMetrics,
+    start_http_server,
+)
+from netskope_fetcher.token import Token
+from tests.helpers import FakeSession
+
+
+def test_render_prometheus_text_format():
+    """Tests to see if counters and histograms are rendered in the
+    Prometheus text format, with label values escaped and empty labels
+    left out.
+    """
+
+    counter = Counter("requests_total", "Requests.")
+    counter.inc("acme", "event", 'a "b"', amount=2)
+    histogram = Histogram("latency_seconds", "Latency.", (0.1, 1))
+    histogram.observe("", "alert", "DLP", value=0.5)
+
+    assert counter.render() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{tenant="acme",endpoint="event",type="a \\"b\\""} 2',
+    ]
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{endpoint="alert",type="DLP",le="0.1"} 0',
+        'latency_seconds_bucket{endpoint="alert",type="DLP",le="1"} 1',
+        'latency_seconds_bucket{endpoint="alert",type="DLP",le="+Inf"} 1',
+        'latency_seconds_sum{endpoint="alert",type="DLP"} 0.5',
+        'latency_seconds_count{endpoint="alert",type="DLP"} 1',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_client_records_requests_pages_and_lag(tmpdir):
+    """Tests to see if a client counts its requests, pages and logs per
+    tenant, endpoint and type, and works out the ingestion lag.
+    """
+
+    now = int(time.time())
+    records = [{"n": n, "timestamp": now - 100 + n} for n in range(12)]
+    metrics = NetskopeMetrics()
+    client = BaseNetskopeClient(
+        url="https://fake",
+        token=Token(auth_token="fake-token"),
+        start=now - 200,
+        end=now,
+        min_window=1000,
+        metrics=metrics,
+        tenant="acme",
+    )
+    client.endpoint_type = "event"
+    client.max_logs = 5
+
+    await client._async_worker(  # pylint: disable=protected-access
+        FakeSession(records, page_size=5), "page"
+    )
+
+    labels = ("acme", "event", "page")
+    assert metrics.records.value(*labels) == 12
+    assert metrics.pages.value(*labels) == metrics.requests.value(*labels, "200")
+    assert metrics.pagination_depth.count(*labels) == 1
+    assert metrics.pagination_depth.value(*labels) == 5
+    assert metrics.response_bytes.value(*labels) > 0
+    assert 85 <= metrics.ingestion_lag.value(*labels) <= 95
+
+    path = os.path.join(str(tmpdir), "netskope.prom")
+    metrics.write_textfile(path)
+    with open(path) as _f:
+        assert (
+            'netskope_records_total{tenant="acme",endpoint="event",type="page"} 12'
+            in _f.read()
+        )
+
+
+def test_ingestion_lag_only_moves_on_newer_logs():
+    """Tests to see if a late page of an older window leaves the
+    ingestion lag alone.
+    """
+
+    now = time.time()
+    metrics = NetskopeMetrics()
+    metrics.observe_newest("", "event", "page", timestamp=now - 60)
+    metrics.observe_newest("", "event", "page", timestamp=now - 3600)
+    assert metrics.ingestion_lag.value("", "event", "page") < 120
+    metrics.observe_newest("", "event", "page", timestamp=now - 10)
+    assert metrics.ingestion_lag.value("", "event", "page") < 60
+
+
+@pytest.mark.asyncio
+async def test_http_server_serves_metrics():
+    """Tests to see if the metrics are served at /metrics."""
+
+    metrics = NetskopeMetrics()
+    metrics.pages.inc("", "alert", "DLP")
+    runner = await start_http_server(0, "127.0.0.1", metrics)
+    try:
+        port = runner.addresses[0][1]
+        async with aiohttp.ClientSession() as session:
+            async with session.get("http://127.0.0.1:{}/metrics".format(port)) as resp:
+                body = await resp.text()
+    finally:
+        await runner.cleanup()
+
+    assert 'netskope_pages_total{endpoint="alert",type="DLP"} 1' in body
@@ -0,0 +1,73 @@
+"""Tests the classes/functions in netskope_fetcher.offload"""
+
+import json
+
+import pytest
+
+from netskope_fetcher.base import BaseNetskopeClient
+from netskope_fetcher.offload import PageOffloader, encode_page
+from netskope_fetcher.token import Token
+from netskope_fetcher.writer import LogWriter
+from tests.helpers import FakeSession
+
+
+def test_encode_page_returns_each_log_encoded():
+    """Tests to see if every log of a page comes back filtered and as
+    its own json bytes, and a body that can't be decoded comes back as
+    (None, None, None).
+    """
+
+    logs = [{"_id": "a", "timestamp": 1, "nested": {"x": [1, 2]}}, {"_id": "b"}]
+    body = json.dumps({"status": "success", "msg": "", "data": logs}).encode()
+
+    status, records, received = encode_page(body, "stdlib")
+
+    assert status == "success"
+    assert records == [json.dumps(log).encode() for log in logs]
+    assert received == 2
+    assert encode_page(b"<html>Bad Gateway</html>", "stdlib") == (None, None, None)
+    assert encode_page(b'{"status": "error"}', "stdlib") == ("error", None, None)
+
+    status, records, received = encode_page(
+        body, "stdlib", {"keep": ["_id"], "exclude": [{"field": "_id", "equals": "b"}]}
+    )
+    assert records == [b'{"_id": "a"}']
+    assert received == 2
+
+
+@pytest.mark.asyncio
+async def test_offloaded_pages_are_written(tmpdir):
+    """Tests to see if pages decoded in a worker process are paginated
+    and written like any other page.
+    """
+
+    records = [{"n": n, "timestamp": 1001} for n in range(12)]
+    writer = LogWriter(str(tmpdir))
+    offloader = PageOffloader(workers=1, min_bytes=0)
+    client = BaseNetskopeClient(
+        url="https://some.goofy.fake/url/for/tests",
+        token=Token(auth_token="fake-token"),
+        start=1000,
+        end=1100,
+        writer=writer,
+        offloader=offloader,
+        passthrough=False,
+    )
+    client.endpoint_type = "event"
+    client.max_logs = 5
+
+    try:
+        await client._async_worker(  # pylint: disable=protected-access
+            FakeSession(records, page_size=5), "page"
+        )
+        await writer.drain()
+        # The pages went through the worker process.
+        assert offloader._executor is not None  # pylint: disable=protected-access
+    finally:
+        writer.close()
+        offloader.close()
+
+    with open(writer.log_file_path("event", "page"), "rb") as _f:
+        lines = _f.read().splitlines()
+    assert sorted(json.loads(line)["n"] for line in lines) == list(range(12))
+    assert client.log_counts["page"] == 12
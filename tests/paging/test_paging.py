@@ -0,0 +1,105 @@
+"""Tests the classes/functions in netskope_fetcher.paging"""
+
+import pytest
+
+from netskope_fetcher.events import EventClient
+from netskope_fetcher.paging import PageTuner, configured_page_size
+from netskope_fetcher.token import Token
+from tests.helpers import FakeSession
+
+
+def test_configured_page_size(monkeypatch):
+    """Tests to see if the most specific page size set wins and sizes
+    are capped at what the API returns.
+    """
+
+    monkeypatch.setenv("NETSKOPE_EVENT_PAGE_SIZE", "3000")
+    monkeypatch.setenv("NETSKOPE_PAGE_SIZES", "event/page=2000, alert/DLP=100")
+    monkeypatch.setenv("NETSKOPE_PAGE_SIZE_MAX", "4000")
+
+    assert configured_page_size("event", "page", 5000) == 2000
+    assert configured_page_size("event", "audit", 5000) == 3000
+    assert configured_page_size("alert", "DLP", 5000) == 100
+    assert configured_page_size("alert", "malware", 5000) == 4000
+    assert configured_page_size(None, "page", 50) == 50
+
+
+def test_tuner_grows_and_shrinks():
+    """Tests to see if fast full pages grow the size, slow, big or
+    failed ones shrink it, and responses to requests made before a
+    change are ignored.
+    """
+
+    tuner = PageTuner(min_size=100, max_size=1000, target_latency=10, max_bytes=1000)
+    assert tuner.size("event", "page", 400) == 400
+    tuner.observe("event", "page", 400, 400, latency=1, size=100)
+    assert tuner.size("event", "page", 400) == 500
+    # A short page says nothing about bigger ones.
+    tuner.observe("event", "page", 500, 20, latency=1, size=100)
+    assert tuner.size("event", "page", 400) == 500
+    tuner.observe("event", "page", 500, 500, latency=20, size=100)
+    assert tuner.size("event", "page", 400) == 250
+    # Sent at 500, before the size came down.
+    tuner.observe("event", "page", 500, 500, latency=20, size=100)
+    assert tuner.size("event", "page", 400) == 250
+    tuner.observe("event", "page", 250, 250, latency=1, size=1250)
+    assert tuner.size("event", "page", 400) == 200
+    tuner.failed("event", "page", 200)
+    tuner.failed("event", "page", 100)
+    assert tuner.size("event", "page", 400) == 100
+
+    # Never above the max, nor below a configured size under min_size.
+    assert tuner.size("alert", "DLP", 5000) == 1000
+    tuner.failed("alert", "malware", tuner.size("alert", "malware", 20))
+    assert tuner.size("alert", "malware", 20) == 20
+
+
+def test_tuner_backs_off_a_capped_page_size():
+    """Tests to see if a short page at a size the API hasn't served in
+    full isn't taken as the last one, and the size goes back under it.
+    """
+
+    tuner = PageTuner(min_size=10, max_size=1000)
+    assert tuner.size("event", "page", 100) == 100
+    assert tuner.served("event", "page", 100)
+    # A short page at the configured size is the last one.
+    assert tuner.last_page("event", "page", 100, 40)
+
+    tuner.observe("event", "page", 100, 100, latency=1)
+    assert tuner.size("event", "page", 100) == 125
+    assert not tuner.served("event", "page", 125)
+    # The API sent 100 of 125: it may have more.
+    assert not tuner.last_page("event", "page", 125, 100)
+    assert tuner.size("event", "page", 100) == 100
+    # And the size doesn't grow past what it sent again.
+    tuner.observe("event", "page", 100, 100, latency=1)
+    assert tuner.size("event", "page", 100) == 100
+
+
+@pytest.mark.asyncio
+async def test_skip_follows_a_changing_page_size():
+    """Tests to see if the page size is sent as 'limit' and every log is
+    pulled down exactly once while the tuner grows it between batches.
+    """
+
+    records = [{"n": n, "timestamp": 1} for n in range(60)]
+    session = FakeSession(records, page_size=10)
+    client = EventClient(
+        url="https://fake/events",
+        token=Token(auth_token="fake-token"),
+        start=1,
+        end=2,
+        page_concurrency=2,
+        page_tuner=PageTuner(min_size=1, max_size=10),
+    )
+    client.max_logs = 4
+
+    await client._api_call_2(  # pylint: disable=protected-access
+        session, {"token": "fake-token", "type": "page", "starttime": 0, "endtime": 1}
+    )
+
+    assert sorted(log["n"] for log in client.log_dictionary["page"]) == list(range(60))
+    limits = [call["limit"] for call in session.calls]
+    assert limits[0] == 4 and max(limits) == 10
+    for previous, call in zip(session.calls, session.calls[1:]):
+        assert call.get("skip", 0) <= previous.get("skip", 0) + previous["limit"]
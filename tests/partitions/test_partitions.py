@@ -0,0 +1,199 @@
+"""Tests the classes/functions in netskope_fetcher.partitions"""
+
+import json
+import os
+import zlib
+
+import pytest
+
+from netskope_fetcher.checkpoint import CheckpointStore
+from netskope_fetcher.codec import get_codec
+from netskope_fetcher.partitions import (
+    PartitionSettings,
+    find_partitions,
+    load_manifest,
+    manifest_path,
+    partition_name,
+)
+from netskope_fetcher.passthrough import RawRecords
+from netskope_fetcher.writer import LogWriter
+
+# 2026-10-17 14:00:00 UTC
+HOUR = 1792245600
+
+
+def read_partition(directory, name):
+    """ Logs and manifest of one partition """
+
+    path = os.path.join(directory, *name.split("/")) + ".ndjson"
+    with open(path, "rb") as _f:
+        data = _f.read()
+    with open(manifest_path(path)) as _f:
+        manifest = json.load(_f)
+    return [json.loads(line) for line in data.splitlines()], manifest, data
+
+
+def make_writer(tmpdir, **kwargs):
+    """ LogWriter writing partitions to tmpdir """
+
+    return LogWriter(
+        str(tmpdir), partitions=PartitionSettings(enabled=True), **kwargs
+    )
+
+
+def test_partition_names_are_utc_hours():
+    """Tests to see if timestamps map to the UTC hour they're in."""
+
+    assert partition_name(HOUR) == "2026/10/17/14"
+    assert partition_name(HOUR + 3599.5) == "2026/10/17/14"
+    assert partition_name(HOUR - 1) == "2026/10/17/13"
+    assert partition_name("yesterday") == "undated"
+    assert partition_name(None) == "undated"
+    assert partition_name(True) == "undated"
+
+
+@pytest.mark.asyncio
+async def test_logs_are_split_into_hourly_partitions_with_manifests(tmpdir):
+    """Tests to see if each log lands in the partition of its hour and
+    if every partition's manifest describes its file.
+    """
+
+    writer = make_writer(tmpdir)
+    await writer.write_page(
+        "event", "page", [{"timestamp": HOUR + 10}, {"timestamp": HOUR + 3600}]
+    )
+    await writer.write_page(
+        "event", "page", RawRecords([b'{"timestamp":%d}' % (HOUR + 5), b'{"x":1}'])
+    )
+    await writer.drain()
+    writer.close()
+
+    directory = writer.segment_directory("event", "page")
+    logs, manifest, data = read_partition(directory, "2026/10/17/14")
+    assert logs == [{"timestamp": HOUR + 10}, {"timestamp": HOUR + 5}]
+    assert manifest == {
+        "file": "14.ndjson",
+        "start": HOUR,
+        "end": HOUR + 3600,
+        "min_timestamp": HOUR + 5,
+        "max_timestamp": HOUR + 10,
+        "count": 2,
+        "bytes": len(data),
+        "checksum": "crc32:{:08x}".format(zlib.crc32(data)),
+    }
+
+    logs, manifest, _ = read_partition(directory, "2026/10/17/15")
+    assert logs == [{"timestamp": HOUR + 3600}]
+    logs, manifest, _ = read_partition(directory, "undated")
+    assert logs == [{"x": 1}]
+    assert manifest["start"] is None and manifest["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_raw_logs_are_partitioned_without_decoding_them(tmpdir, monkeypatch):
+    """Tests to see if the timestamp of a raw log is picked out of it
+    without decoding the whole log.
+    """
+
+    writer = make_writer(tmpdir)
+
+    def loads(data):
+        raise AssertionError("Decoded {!r}".format(data))
+
+    monkeypatch.setattr(writer.codec, "loads", loads)
+    await writer.write_page(
+        "event",
+        "page",
+        RawRecords([b'{"a":{"timestamp":1},"timestamp":%d}' % (HOUR + 5)]),
+    )
+    await writer.drain()
+    writer.close()
+
+    directory = writer.segment_directory("event", "page")
+    logs, _, _ = read_partition(directory, "2026/10/17/14")
+    assert logs == [{"a": {"timestamp": 1}, "timestamp": HOUR + 5}]
+
+
+@pytest.mark.asyncio
+async def test_find_partitions_only_returns_the_hours_in_range(tmpdir):
+    """Tests to see if find_partitions picks the partitions that may
+    hold logs in (start, end].
+    """
+
+    writer = make_writer(tmpdir)
+    await writer.write_page(
+        "event", "page", [{"timestamp": HOUR + n * 3600 + 60} for n in range(4)]
+    )
+    await writer.drain()
+    writer.close()
+
+    directory = writer.segment_directory("event", "page")
+    found = find_partitions(directory, HOUR + 3600, HOUR + 3 * 3600)
+    assert [manifest["start"] for manifest in found] == [HOUR + 3600, HOUR + 7200]
+    assert os.path.exists(found[0]["path"])
+    assert find_partitions(directory, HOUR + 60, HOUR + 3600) == []
+
+
+@pytest.mark.asyncio
+async def test_stale_manifest_is_rebuilt_before_appending(tmpdir):
+    """Tests to see if a manifest that fell behind its partition (a
+    crash between the two writes) is rebuilt from the partition.
+    """
+
+    writer = make_writer(tmpdir)
+    await writer.write_page("event", "page", [{"timestamp": HOUR + 1}])
+    await writer.drain()
+    writer.close()
+
+    directory = writer.segment_directory("event", "page")
+    path = os.path.join(directory, "2026", "10", "17", "14.ndjson")
+    with open(path, "ab") as _f:
+        _f.write(b'{"timestamp":%d}\n' % (HOUR + 2))
+
+    writer = make_writer(tmpdir)
+    await writer.write_page("event", "page", [{"timestamp": HOUR + 3}])
+    await writer.drain()
+    writer.close()
+
+    _, manifest, data = read_partition(directory, "2026/10/17/14")
+    assert manifest["count"] == 3
+    assert manifest["max_timestamp"] == HOUR + 3
+    assert manifest["checksum"] == "crc32:{:08x}".format(zlib.crc32(data))
+    assert load_manifest(path, "timestamp", get_codec()).to_dict() == manifest
+
+
+@pytest.mark.asyncio
+async def test_recover_rolls_partitions_and_manifests_back(tmpdir):
+    """Tests to see if a committed window is split between partitions,
+    and if recover truncates uncommitted logs and rebuilds the
+    manifests to match.
+    """
+
+    checkpoints = CheckpointStore(os.path.join(str(tmpdir), "checkpoints.json"))
+    writer = make_writer(tmpdir)
+
+    stage = writer.open_stage("event", "page", HOUR, HOUR + 7200)
+    await stage.write_page([{"timestamp": HOUR + 1}, {"timestamp": HOUR + 3601}])
+    await writer.commit_stage(stage, checkpoints)
+    assert not os.path.exists(stage.path)
+    assert len(checkpoints.state["offsets"]) == 2
+
+    # Simulate a crash after an append but before its commit.
+    await writer.write_page("event", "page", [{"timestamp": HOUR + 2}])
+    await writer.drain()
+    writer.close()
+
+    make_writer(tmpdir).recover(checkpoints)
+
+    directory = writer.segment_directory("event", "page")
+    logs, manifest, _ = read_partition(directory, "2026/10/17/14")
+    assert logs == [{"timestamp": HOUR + 1}]
+    assert manifest["count"] == 1 and manifest["max_timestamp"] == HOUR + 1
+
+
+def test_partitions_and_segments_are_exclusive(tmpdir, monkeypatch):
+    """Tests to see if asking for both partitions and segments fails."""
+
+    monkeypatch.setenv("NETSKOPE_SEGMENT_MAX_BYTES", "1000")
+    with pytest.raises(ValueError):
+        make_writer(tmpdir)
@@ -0,0 +1,62 @@
+"""Tests the classes/functions in netskope_fetcher.passthrough"""
+
+import json
+
+import pytest
+
+from netskope_fetcher.passthrough import extract_field, split_response
+
+
+LOGS = [
+    {"_id": "a1", "timestamp": 1, "msg": 'has "quotes", {braces} and [brackets]'},
+    {"_id": "b2", "timestamp": 2, "deep": {"a": [1, {"b": {"c": [[{"_id": "x"}]]}}]}},
+    {"_id": "c3", "timestamp": 3, "unicode": "Zoë ☃", "escaped": "back\\slash\\"},
+]
+
+
+def test_split_response_returns_raw_logs():
+    """Tests to see if every log comes back as its own raw json bytes,
+    including logs nested deeper than the fast path handles.
+    """
+
+    body = json.dumps({"status": "success", "msg": "", "data": LOGS}).encode()
+
+    status, records = split_response(body)
+
+    assert status == "success"
+    assert [json.loads(record) for record in records] == LOGS
+    assert records.to_lines().count(b"\n") == len(LOGS)
+
+
+def test_split_response_handles_pretty_printed_bodies():
+    """Tests to see if whitespace (including newlines) in the body
+    doesn't end up splitting a log across lines.
+    """
+
+    body = json.dumps({"data": LOGS, "status": "success"}, indent=4).encode()
+
+    status, records = split_response(body)
+
+    assert status == "success"
+    assert all(b"\n" not in record for record in records)
+    assert [json.loads(record) for record in records] == LOGS
+
+
+def test_split_response_rejects_non_json():
+    """Tests to see if an HTML error page raises ValueError."""
+
+    with pytest.raises(ValueError):
+        split_response(b"<html><body>Bad Gateway</body></html>")
+
+
+def test_extract_field_only_reads_top_level_keys():
+    """Tests to see if extract_field ignores matching keys inside
+    strings and nested objects.
+    """
+
+    record = json.dumps(
+        {"note": '"_id": "fake"', "deep": {"_id": "nested"}, "_id": "real"}
+    ).encode()
+
+    assert extract_field(record, "_id") == "real"
+    assert extract_field(record, "timestamp") is None
@@ -0,0 +1,72 @@
+"""Tests the classes/functions in netskope_fetcher.profiling"""
+
+import asyncio
+import json
+
+import pytest
+
+from netskope_fetcher.base import BaseNetskopeClient
+from netskope_fetcher.profiling import PhaseTimers, Profiler, parse_profile_options
+from netskope_fetcher.token import Token
+from tests.helpers import FakeSession
+
+
+@pytest.mark.asyncio
+async def test_client_times_fetch_and_decode():
+    """Tests to see if a client adds up the time spent fetching and
+    decoding per endpoint and type.
+    """
+
+    timers = PhaseTimers()
+    client = BaseNetskopeClient(
+        url="https://fake",
+        token=Token(auth_token="fake-token"),
+        start=1000,
+        end=1100,
+        timers=timers,
+    )
+    client.endpoint_type = "alert"
+
+    await client._async_worker(  # pylint: disable=protected-access
+        FakeSession([{"timestamp": 1001}], page_size=5), "DLP"
+    )
+
+    phases = timers.as_dict()["alert/DLP"]
+    assert phases["fetch"]["calls"] == phases["decode"]["calls"] == 1
+    assert "alert/DLP" in timers.render()
+
+
+def test_profiler_writes_every_capture(tmpdir):
+    """Tests to see if the profiler writes cProfile stats, the top
+    allocators, the asyncio debug log and the phase timers.
+    """
+
+    timers = PhaseTimers()
+    profiler = Profiler(str(tmpdir), parse_profile_options("all"), timers)
+    loop = asyncio.new_event_loop()
+    try:
+        profiler.start(loop)
+        timers.add("event", "page", "write", 0.5)
+        loop.run_until_complete(asyncio.sleep(0))
+        written = profiler.stop()
+    finally:
+        loop.close()
+
+    assert sorted(path[len(profiler.prefix) :] for path in written) == [
+        "-asyncio.log",
+        "-cpu.txt",
+        "-memory.txt",
+        "-phases.json",
+        "-phases.txt",
+        ".pstats",
+    ]
+    with open(profiler.prefix + "-phases.json") as _f:
+        assert json.load(_f)["phases"]["event/page"]["write"]["seconds"] == 0.5
+
+
+def test_unknown_profile_options_are_rejected(tmpdir):
+    """Tests to see if a typo in --profile is reported."""
+
+    assert parse_profile_options("cpu, loop") == {"cpu", "loop"}
+    with pytest.raises(ValueError):
+        Profiler(str(tmpdir), {"cpu", "disk"})
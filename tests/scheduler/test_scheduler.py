@@ -0,0 +1,295 @@
+"""Tests the classes/functions in netskope_fetcher.scheduler"""
+
+import asyncio
+
+from aiohttp.client_exceptions import ClientError, ContentTypeError
+import pytest
+
+from netskope_fetcher import scheduler as scheduler_module
+from netskope_fetcher.scheduler import RequestScheduler
+from tests.helpers import FakeResponse
+
+
+class SequenceSession:  # pylint: disable=too-few-public-methods
+    """ Stand-in for aiohttp.ClientSession which returns the prepared
+    responses in order and keeps track of how many requests were in
+    flight at once.
+    """
+
+    def __init__(self, responses, delay=0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get(self, url, params=None, **kwargs):  # pylint: disable=unused-argument
+        """ Return the next response once 'delay' has passed."""
+
+        return _DelayedResponse(self, self.responses.pop(0))
+
+
+class _DelayedResponse:  # pylint: disable=too-few-public-methods
+    def __init__(self, session, response):
+        self.session = session
+        self.response = response
+
+    async def __aenter__(self):
+        self.session.in_flight += 1
+        self.session.max_in_flight = max(
+            self.session.max_in_flight, self.session.in_flight
+        )
+        await asyncio.sleep(self.session.delay)
+        return self.response
+
+    async def __aexit__(self, *args):
+        self.session.in_flight -= 1
+        return False
+
+
+@pytest.mark.asyncio
+async def test_fetch_retries_throttled_requests():
+    """Tests to see if a 429 is retried (honoring Retry-After) and the
+    in-flight budget is lowered.
+    """
+
+    session = SequenceSession(
+        [
+            FakeResponse({}, status=429, headers={"Retry-After": "0"}),
+            FakeResponse({"status": "success"}, status=200),
+        ]
+    )
+    scheduler = RequestScheduler(initial_limit=8, backoff_base=0.01)
+
+    resp = await scheduler.fetch(session, "https://fake/url")
+
+    assert resp.status == 200
+    assert await resp.json() == {"status": "success"}
+    assert scheduler.stats["retries"] == 1
+    assert scheduler.stats["throttled"] == 1
+    assert scheduler.limit < 8
+
+
+@pytest.mark.asyncio
+async def test_fetch_gives_up_after_max_retries():
+    """Tests to see if the last throttled response is returned once the
+    retries have run out.
+    """
+
+    session = SequenceSession([FakeResponse({}, status=503) for _ in range(3)])
+    scheduler = RequestScheduler(max_retries=2, backoff_base=0.001)
+
+    resp = await scheduler.fetch(session, "https://fake/url")
+
+    assert resp.status == 503
+    assert scheduler.stats["requests"] == 3
+
+
+@pytest.mark.asyncio
+async def test_fetch_caps_requests_in_flight():
+    """Tests to see if no more than 'limit' requests are in flight."""
+
+    session = SequenceSession(
+        [FakeResponse({"status": "success"}) for _ in range(10)], delay=0.01
+    )
+    scheduler = RequestScheduler(initial_limit=3, max_limit=3)
+
+    await asyncio.gather(
+        *[scheduler.fetch(session, "https://fake/url") for _ in range(10)]
+    )
+
+    assert session.max_in_flight == 3
+    assert scheduler.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_fetched_response_raises_content_type_error_for_html():
+    """Tests to see if an HTML error page raises ContentTypeError the
+    same way aiohttp.ClientResponse.json does.
+    """
+
+    session = SequenceSession(
+        [FakeResponse({}, status=200, headers={"Content-Type": "text/html"})]
+    )
+    resp = await RequestScheduler().fetch(session, "https://fake/url")
+
+    with pytest.raises(ContentTypeError):
+        await resp.json()
+
+
+@pytest.mark.asyncio
+async def test_fetch_takes_turns_between_shares():
+    """Tests to see if waiting requests are served round-robin between
+    shares (tenants) rather than first come, first served.
+    """
+
+    order = []
+
+    class RecordingSession(SequenceSession):  # pylint: disable=too-few-public-methods
+        """ Records the share of every request made."""
+
+        def get(self, url, params=None, **kwargs):
+            order.append(params["share"])
+            return super().get(url, params=params, **kwargs)
+
+    session = RecordingSession(
+        [FakeResponse({"status": "success"}) for _ in range(12)], delay=0.01
+    )
+    scheduler = RequestScheduler(initial_limit=1, max_limit=1)
+
+    busy = [
+        scheduler.fetch(session, "https://fake/url", {"share": "busy"}, share="busy")
+        for _ in range(9)
+    ]
+    quiet = [
+        scheduler.fetch(session, "https://fake/url", {"share": "quiet"}, share="quiet")
+        for _ in range(3)
+    ]
+    await asyncio.gather(*busy, *quiet)
+
+    # The quiet tenant doesn't wait behind the busy tenant's backlog.
+    assert order[:7] == ["busy", "busy", "quiet", "busy", "quiet", "busy", "quiet"]
+
+
+@pytest.mark.asyncio
+async def test_fetch_serves_flows_by_priority_and_weight():
+    """Tests to see if waiting requests of a higher priority flow go
+    first and flows of the same priority share slots by weight.
+    """
+
+    order = []
+
+    class RecordingSession(SequenceSession):  # pylint: disable=too-few-public-methods
+        """ Records the flow of every request made."""
+
+        def get(self, url, params=None, **kwargs):
+            order.append(params["flow"])
+            return super().get(url, params=params, **kwargs)
+
+    session = RecordingSession(
+        [FakeResponse({"status": "success"}) for _ in range(16)], delay=0.01
+    )
+    scheduler = RequestScheduler(
+        initial_limit=1,
+        max_limit=1,
+        priorities={"alert/malware": 10},
+        weights={"event/page": 3},
+    )
+
+    def fetch(flow):
+        return scheduler.fetch(
+            session, "https://fake/url", {"flow": flow}, share="tenant", flow=flow
+        )
+
+    # The first request takes the free slot, the rest wait.
+    requests = [fetch("event/page") for _ in range(9)]
+    requests += [fetch("event/application") for _ in range(4)]
+    requests += [fetch("alert/malware") for _ in range(3)]
+    await asyncio.gather(*requests)
+
+    # The small high priority type goes ahead of everything waiting...
+    assert order[:4] == ["event/page"] + ["alert/malware"] * 3
+    # ...and the busy type gets three slots for each of the other's one.
+    assert order[4:12] == (["event/page"] * 3 + ["event/application"]) * 2
+    assert len(order) == 16
+
+
+class _StalledResponse(_DelayedResponse):  # pylint: disable=too-few-public-methods
+    def __init__(self, session, response, delay):
+        super().__init__(session, response)
+        self.delay = delay
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.delay)
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+@pytest.mark.asyncio
+async def test_fetch_hedges_slow_requests():
+    """Tests to see if a request slower than the flow's latency
+    percentile is duplicated, the first response wins and hedges stay
+    within the budget.
+    """
+
+    delays = [0.01] * 4 + [5, 0.01] + [5]
+
+    class Session(SequenceSession):  # pylint: disable=too-few-public-methods
+        """ Requests take the delays above, in order."""
+
+        def get(self, url, params=None, **kwargs):
+            return _StalledResponse(self, self.responses.pop(0), delays.pop(0))
+
+    session = Session([FakeResponse({"status": "success"}) for _ in range(7)])
+    scheduler = RequestScheduler(
+        hedge_percentile=50,
+        hedge_budget=0.15,
+        hedge_min_samples=4,
+        hedge_min_delay=0.05,
+        deadline=1,
+        max_retries=0,
+    )
+
+    for _ in range(4):
+        response = await scheduler.fetch(session, "https://fake/url", flow="a/b")
+        assert not response.hedged
+
+    # The first request stalls. Its hedge responds first.
+    response = await scheduler.fetch(session, "https://fake/url", flow="a/b")
+    assert response.hedged and response.hedge_won
+    assert response.latency < 1
+    assert scheduler.stats["hedges"] == 1
+    assert scheduler.stats["hedges_won"] == 1
+    assert scheduler.in_flight == 0
+
+    # One hedge is over the budget for six requests: the next stalled
+    # request isn't hedged and runs into the deadline.
+    with pytest.raises(asyncio.TimeoutError):
+        await scheduler.fetch(session, "https://fake/url", flow="a/b")
+    assert scheduler.stats["hedges"] == 1
+    assert scheduler.stats["deadlines"] == 1
+    assert scheduler.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_fetch_waits_on_hedge_after_primary_fails(monkeypatch):
+    """Tests to see if a primary request that fails while its hedge is
+    still in flight is dropped from the race, rather than waking the
+    wait loop over and over until the hedge is done.
+    """
+
+    delays = [0.01] * 4 + [0.1, 0.3]
+    responses = [FakeResponse({"status": "success"}) for _ in range(4)]
+    responses += [ClientError("reset"), FakeResponse({"status": "success"})]
+
+    class Session(SequenceSession):  # pylint: disable=too-few-public-methods
+        """ Requests take the delays above, in order."""
+
+        def get(self, url, params=None, **kwargs):
+            return _StalledResponse(self, self.responses.pop(0), delays.pop(0))
+
+    waits = []
+    wait = asyncio.wait
+
+    async def counting_wait(*args, **kwargs):
+        waits.append(args)
+        return await wait(*args, **kwargs)
+
+    session = Session(responses)
+    scheduler = RequestScheduler(
+        hedge_percentile=50,
+        hedge_min_samples=4,
+        hedge_min_delay=0.05,
+        hedge_budget=1,
+        max_retries=0,
+    )
+    for _ in range(4):
+        await scheduler.fetch(session, "https://fake/url", flow="a/b")
+
+    monkeypatch.setattr(scheduler_module.asyncio, "wait", counting_wait)
+    response = await scheduler.fetch(session, "https://fake/url", flow="a/b")
+
+    assert response.hedge_won
+    # The hedge delay, the primary failing and the hedge responding.
+    assert len(waits) == 3
+    assert scheduler.in_flight == 0
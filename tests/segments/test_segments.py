@@ -0,0 +1,148 @@
+"""Tests the classes/functions in netskope_fetcher.segments"""
+
+import gzip
+import json
+import os
+
+import pytest
+
+from netskope_fetcher.checkpoint import CheckpointStore
+from netskope_fetcher.segments import (
+    GzipCompression,
+    SegmentSettings,
+    parse_segment_name,
+    segment_name,
+)
+from netskope_fetcher.writer import LogWriter
+
+
+def read_segments(directory):
+    """ Every log in a segment directory, oldest segment first """
+
+    logs = []
+    for name in sorted(os.listdir(directory)):
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(os.path.join(directory, name), "rb") as _f:
+            logs.extend(json.loads(line) for line in _f.read().splitlines())
+    return logs
+
+
+def test_segment_names_sort_by_time():
+    """Tests to see if segment names round trip and sort in the order
+    the segments were opened.
+    """
+
+    names = [segment_name(opened, 0) for opened in (999999999, 1500000000, 1500000001)]
+
+    assert sorted(names) == names
+    assert parse_segment_name(names[1] + ".gz") == (1500000000, 0, ".gz")
+    assert parse_segment_name("page.log") is None
+
+
+@pytest.mark.asyncio
+async def test_full_segments_are_rotated_and_compressed(tmpdir):
+    """Tests to see if a segment is closed and gzipped in the background
+    once it's full, and that every log survives in order.
+    """
+
+    settings = SegmentSettings(
+        max_bytes=1, max_age=0, compression=GzipCompression(), stream_compression=False
+    )
+    writer = LogWriter(str(tmpdir), segments=settings, batch_records=1)
+    for n in range(4):
+        await writer.write_page("event", "page", [{"n": n}])
+        await writer.drain()
+    writer.close()
+
+    directory = writer.segment_directory("event", "page")
+    names = sorted(os.listdir(directory))
+    assert [name.endswith(".log.gz") for name in names] == [True, True, True, False]
+    assert read_segments(directory) == [{"n": n} for n in range(4)]
+
+
+@pytest.mark.asyncio
+async def test_stream_compressed_segments_roll_back_to_a_commit(tmpdir):
+    """Tests to see if a stream compressed segment is still readable
+    after recover truncates it back to the last commit.
+    """
+
+    checkpoints = CheckpointStore(os.path.join(str(tmpdir), "checkpoints.json"))
+    settings = SegmentSettings(
+        max_bytes=0, max_age=0, compression=GzipCompression(), stream_compression=True
+    )
+    writer = LogWriter(str(tmpdir), segments=settings)
+
+    stage = writer.open_stage("event", "page", 0, 10)
+    await stage.write_page([{"a": 1}])
+    await writer.commit_stage(stage, checkpoints)
+
+    # Simulate a crash after an append but before its commit.
+    await writer.write_page("event", "page", [{"b": 2}])
+    await writer.drain()
+    writer.close()
+
+    LogWriter(str(tmpdir), segments=settings).recover(checkpoints)
+
+    assert read_segments(writer.segment_directory("event", "page")) == [{"a": 1}]
+
+
+@pytest.mark.asyncio
+async def test_segments_due_for_rotation_at_startup_are_closed(tmpdir):
+    """Tests to see if a segment left behind by an earlier run that is
+    already full is compressed and forgotten by the checkpoints, like
+    one that fills up during a run.
+    """
+
+    checkpoints = CheckpointStore(os.path.join(str(tmpdir), "checkpoints.json"))
+    writer = LogWriter(
+        str(tmpdir),
+        segments=SegmentSettings(
+            max_bytes=0, compression=GzipCompression(), stream_compression=False
+        ),
+    )
+    stage = writer.open_stage("event", "page", 0, 10)
+    await stage.write_page([{"n": 0}])
+    await writer.commit_stage(stage, checkpoints)
+    writer.close()
+    directory = writer.segment_directory("event", "page")
+    (old,) = os.listdir(directory)
+
+    writer = LogWriter(
+        str(tmpdir),
+        segments=SegmentSettings(
+            max_bytes=1, compression=GzipCompression(), stream_compression=False
+        ),
+    )
+    writer.recover(checkpoints)
+    stage = writer.open_stage("event", "page", 10, 20)
+    await stage.write_page([{"n": 1}])
+    await writer.commit_stage(stage, checkpoints)
+    writer.close()
+
+    names = sorted(os.listdir(directory))
+    assert names[0] == old + ".gz"
+    assert len(names) == 2 and not names[1].endswith(".gz")
+    assert os.path.relpath(os.path.join(directory, old), str(tmpdir)) not in (
+        checkpoints.log_offsets()
+    )
+    assert read_segments(directory) == [{"n": 0}, {"n": 1}]
+
+
+def test_partial_segments_are_removed_without_checkpoints(tmpdir):
+    """Tests to see if compressed copies cut short by a crash are
+    removed when the writer starts, even without checkpoints.
+    """
+
+    directory = os.path.join(str(tmpdir), "logs", "event", "page")
+    os.makedirs(directory)
+    partial = os.path.join(directory, segment_name(1500000000, 0) + ".gz.tmp")
+    with open(partial, "wb") as _f:
+        _f.write(b"cut short")
+
+    writer = LogWriter(
+        str(tmpdir),
+        segments=SegmentSettings(max_bytes=1, compression=GzipCompression()),
+    )
+    writer.close()
+
+    assert not os.path.exists(partial)
@@ -0,0 +1,97 @@
+"""Tests the classes/functions in benchmarks.simulator"""
+
+import json
+
+import pytest
+
+from benchmarks.simulator import NetskopeSimulator
+from netskope_fetcher.bootstrap import NetskopeAsyncBootstrap
+from netskope_fetcher.events import EventClient
+from netskope_fetcher.paging import PageTuner
+from netskope_fetcher.scheduler import RequestScheduler
+from netskope_fetcher.token import Token
+from netskope_fetcher.writer import LogWriter
+
+
+@pytest.mark.asyncio
+async def test_clients_pull_every_log_through_injected_errors(tmpdir):
+    """Tests to see if EventClient pulls down every log from the
+    simulator, across pages and throttled/failed requests, exactly once.
+    """
+
+    simulator = NetskopeSimulator(
+        records=230, page_limit=50, start_time=1000, span=100, rate_429=0.1, rate_5xx=0.1
+    )
+    base_url = await simulator.start()
+    writer = LogWriter(str(tmpdir))
+    client = EventClient(
+        url=base_url + "/events",
+        token=Token(auth_token="fake-token"),
+        start=1000,
+        end=1100,
+        writer=writer,
+    )
+    client.max_logs = 50
+    scheduler = RequestScheduler(backoff_base=0.001, max_retries=20)
+    try:
+        await NetskopeAsyncBootstrap(
+            client_list=[client], scheduler=scheduler
+        ).run_async_clients(None)
+        await writer.drain()
+    finally:
+        writer.close()
+        await simulator.stop()
+
+    assert scheduler.stats["throttled"] > 0
+    for type_ in client.type_list:
+        with open(writer.log_file_path("event", type_)) as _f:
+            ids = [json.loads(line)["_id"] for line in _f]
+        assert sorted(ids) == sorted("event/{}-{}".format(type_, n) for n in range(230))
+
+
+def test_windows_follow_starttime_endtime_semantics():
+    """Tests to see if logs are served for (starttime, endtime]."""
+
+    simulator = NetskopeSimulator(records=10, start_time=1000, span=10)
+
+    assert [simulator.timestamp("event", "page", n) for n in range(10)] == list(
+        range(1001, 1011)
+    )
+    assert simulator._first_after("event", "page", 1003) == 3  # pylint: disable=W0212
+
+
+@pytest.mark.asyncio
+async def test_tuned_page_size_above_the_api_cap_loses_nothing(tmpdir):
+    """Tests to see if every log is pulled down when the PageTuner grows
+    the page size past the most the API sends per page, which makes
+    capped pages look short.
+    """
+
+    simulator = NetskopeSimulator(records=2400, page_limit=100, start_time=1000, span=10)
+    base_url = await simulator.start()
+    writer = LogWriter(str(tmpdir))
+    tuner = PageTuner()
+    client = EventClient(
+        url=base_url + "/events",
+        token=Token(auth_token="fake-token"),
+        start=1000,
+        end=1010,
+        writer=writer,
+        page_tuner=tuner,
+    )
+    client.max_logs = 100
+    try:
+        await NetskopeAsyncBootstrap(
+            client_list=[client], scheduler=RequestScheduler()
+        ).run_async_clients(None)
+        await writer.drain()
+    finally:
+        writer.close()
+        await simulator.stop()
+
+    for type_ in client.type_list:
+        with open(writer.log_file_path("event", type_)) as _f:
+            ids = [json.loads(line)["_id"] for line in _f]
+        assert sorted(ids) == sorted("event/{}-{}".format(type_, n) for n in range(2400))
+        # The tuner found the cap and stays under it.
+        assert tuner.size("event", type_, 100) == 100
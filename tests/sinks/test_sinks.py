@@ -0,0 +1,274 @@
+"""Tests the classes/functions in netskope_fetcher.sinks against local
+stand-ins for the receiving ends"""
+
+import asyncio
+import json
+import os
+import re
+
+from aiohttp import web
+import pytest
+
+from netskope_fetcher.checkpoint import CheckpointStore
+from netskope_fetcher.sinks import (
+    HttpSink,
+    SinkError,
+    SinkSet,
+    SyslogSink,
+    TcpSink,
+    load_sinks,
+)
+from netskope_fetcher.writer import LogWriter
+
+
+class TcpListener:
+
+    """ Collects everything sent to it over TCP """
+
+    def __init__(self):
+        self.data = b""
+        self.connections = 0
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            self.data += chunk
+        writer.close()
+
+    def close(self):
+        self.server.close()
+
+
+class UdpListener(asyncio.DatagramProtocol):
+
+    """ Collects the datagrams sent to it """
+
+    def __init__(self):
+        self.datagrams = []
+
+    def datagram_received(self, data, addr):
+        self.datagrams.append(data)
+
+
+async def http_listener(statuses):
+    """ Web server answering POSTs with the given statuses in turn (then
+        200s). Returns (runner, url, list of received bodies).
+    """
+
+    bodies = []
+    statuses = list(statuses)
+
+    async def handle(request):
+        bodies.append(await request.read())
+        return web.Response(status=statuses.pop(0) if statuses else 200)
+
+    app = web.Application()
+    app.router.add_post("/bulk", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # pylint: disable=protected-access
+    return runner, "http://127.0.0.1:{}/bulk".format(port), bodies
+
+
+def lines(first, count):
+    """ Newline delimited json logs """
+
+    return b"".join(
+        json.dumps({"_id": n, "timestamp": n}).encode() + b"\n"
+        for n in range(first, first + count)
+    )
+
+
+@pytest.mark.asyncio
+async def test_tcp_sink_batches_over_one_connection():
+    """Tests to see if a TCP sink sends batches by size and by time, in
+    order, over a single kept-alive connection.
+    """
+
+    listener = await TcpListener().start()
+    sink = TcpSink("127.0.0.1", listener.port, batch_records=10, flush_interval=0.05)
+    await sink.put("event", "page", lines(0, 25))
+    await asyncio.sleep(0.1)
+    # The last 5 logs went out once they had waited flush_interval.
+    assert sink.stats["records"] == 25
+    assert sink.stats["batches"] == 3
+    await sink.put("alert", "DLP", lines(25, 5))
+    await sink.drain()
+    await sink.close()
+    await asyncio.sleep(0.05)
+    listener.close()
+
+    assert listener.data == lines(0, 30)
+    assert listener.connections == 1
+
+
+@pytest.mark.asyncio
+async def test_syslog_sink_frames_rfc5424_messages():
+    """Tests to see if the syslog sink sends octet-counted RFC5424
+    messages over TCP and one datagram per message over UDP.
+    """
+
+    listener = await TcpListener().start()
+    sink = SyslogSink("127.0.0.1", listener.port, hostname="fetcher", facility=1)
+    await sink.put("event", "page", lines(0, 2))
+    await sink.drain()
+    await sink.close()
+    await asyncio.sleep(0.05)
+    listener.close()
+
+    pattern = re.compile(
+        rb"(\d+) (<14>1 \S+ fetcher netskope - event/page - (\{[^\n]*?\}))"
+    )
+    messages = pattern.findall(listener.data)
+    assert [json.loads(message[2])["_id"] for message in messages] == [0, 1]
+    assert all(int(length) == len(message) for length, message, _ in messages)
+
+    loop = asyncio.get_event_loop()
+    receiver = UdpListener()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: receiver, local_addr=("127.0.0.1", 0)
+    )
+    port = transport.get_extra_info("sockname")[1]
+    sink = SyslogSink("127.0.0.1", port, protocol="udp")
+    await sink.put("alert", "DLP", lines(0, 3))
+    await sink.drain()
+    await asyncio.sleep(0.05)
+    await sink.close()
+    transport.close()
+
+    assert len(receiver.datagrams) == 3
+    assert receiver.datagrams[0].startswith(b"<134>1 ")
+    assert b" alert/DLP - {" in receiver.datagrams[2]
+
+
+@pytest.mark.asyncio
+async def test_http_sink_retries_and_drops():
+    """Tests to see if the HTTP sink retries a batch after a 503 and
+    drops one refused with a 400.
+    """
+
+    runner, url, bodies = await http_listener([503, 200, 400])
+    sink = HttpSink(url, batch_records=2, backoff_base=0.01)
+    await sink.put("event", "page", lines(0, 4))
+    await sink.drain()
+    await sink.close()
+    await runner.cleanup()
+
+    assert bodies == [lines(0, 2), lines(0, 2), lines(2, 2)]
+    assert sink.stats["retries"] == 1
+    assert sink.stats["dropped"] == 2
+
+
+@pytest.mark.asyncio
+async def test_full_queue_spills_to_disk_and_recovers(tmpdir):
+    """Tests to see if batches spill over to the spool while the
+    receiving end is down, survive a restart and are sent in order
+    once it's back.
+    """
+
+    spool_dir = str(tmpdir.join("spool"))
+    listener = await TcpListener().start()
+    port = listener.port
+    listener.close()
+    await asyncio.sleep(0.05)
+
+    options = dict(batch_records=5, queue_size=1, spool_dir=spool_dir)
+    sink = TcpSink("127.0.0.1", port, backoff_base=0.01, **options)
+    await sink.put("event", "page", lines(0, 20))
+    assert sink.stats["spilled"] >= 2
+    with pytest.raises(SinkError):
+        await sink.drain(timeout=0.1)
+    await sink.close()
+    assert len(os.listdir(spool_dir)) == 4
+
+    listener.server = await asyncio.start_server(
+        listener._handle, "127.0.0.1", port  # pylint: disable=protected-access
+    )
+    sink = TcpSink("127.0.0.1", port, **options)
+    await sink.put("event", "page", lines(20, 5))
+    await sink.drain()
+    await sink.close()
+    await asyncio.sleep(0.05)
+    listener.close()
+
+    assert sorted(listener.data.splitlines()) == sorted(lines(0, 25).splitlines())
+    assert listener.data.endswith(lines(20, 5))
+    assert os.listdir(spool_dir) == []
+
+
+@pytest.mark.asyncio
+async def test_writer_fans_out_to_every_sink(tmpdir):
+    """Tests to see if the writer forwards direct writes and committed
+    windows to every sink, and can write to sinks only.
+    """
+
+    first = await TcpListener().start()
+    second = await TcpListener().start()
+    sinks = SinkSet(
+        [
+            TcpSink("127.0.0.1", first.port, name="first"),
+            TcpSink("127.0.0.1", second.port, name="second"),
+        ]
+    )
+    writer = LogWriter(str(tmpdir), sinks=sinks, local_files=False)
+    checkpoints = CheckpointStore(str(tmpdir.join("checkpoints.json")))
+    await writer.write_page("event", "page", [{"_id": 0, "timestamp": 0}])
+    stage = writer.open_stage("alert", "DLP", 0, 10)
+    await stage.write_page([{"_id": n, "timestamp": n} for n in range(1, 4)])
+    await writer.commit_stage(stage, checkpoints)
+    await writer.drain()
+    writer.close()
+    await sinks.close()
+    await asyncio.sleep(0.05)
+    first.close()
+    second.close()
+
+    assert first.data == second.data == lines(0, 4)
+    assert checkpoints.state["windows"]
+    assert not os.path.exists(tmpdir.join("logs", "event", "page.log"))
+    with pytest.raises(ValueError):
+        LogWriter(str(tmpdir), local_files=False)
+
+
+def test_load_sinks(tmpdir):
+    """Tests to see if the sinks file is read, plugins are loaded by
+    module:Class and mistakes are reported.
+    """
+
+    path = tmpdir.join("sinks.json")
+    path.write(
+        json.dumps(
+            {
+                "sinks": [
+                    {"type": "syslog", "host": "localhost", "protocol": "udp"},
+                    {"type": "netskope_fetcher.sinks:TcpSink", "host": "h", "port": 1},
+                    {"type": "http", "url": "http://h/bulk", "gzip": True},
+                ]
+            }
+        )
+    )
+    sinks = load_sinks(str(path))
+    assert [sink.name for sink in sinks.sinks] == ["syslog", "tcp", "http"]
+    assert sinks.sinks[0].port == 514
+
+    for entry in (
+        {"type": "kafka"},
+        {"type": "tcp", "host": "h", "port": 1, "colour": "red"},
+        {"type": "netskope_fetcher.writer:LogWriter"},
+        {"type": "syslog", "host": "h", "protocol": "sctp"},
+    ):
+        path.write(json.dumps({"sinks": [entry]}))
+        with pytest.raises(ValueError):
+            load_sinks(str(path))
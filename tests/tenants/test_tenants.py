@@ -0,0 +1,86 @@
+"""Tests the classes/functions in netskope_fetcher.tenants"""
+
+import json
+import os
+
+import pytest
+
+from netskope_fetcher.alerts import AlertClient
+from netskope_fetcher.events import EventClient
+from netskope_fetcher.tenants import load_tenants
+
+
+def _write_config(tmpdir, config):
+    path = os.path.join(str(tmpdir), "tenants.json")
+    with open(path, "w") as _f:
+        json.dump(config, _f)
+    return path
+
+
+def test_load_tenants(tmpdir, monkeypatch):
+    """Tests to see if the region, base URL, token, types and output
+    directory of each tenant are read, with relative paths resolved
+    against the config file.
+    """
+
+    monkeypatch.setenv("ACME_TOKEN", "acme-token")
+    path = _write_config(
+        tmpdir,
+        {
+            "tenants": [
+                {
+                    "name": "acme",
+                    "region": "us",
+                    "token_env": "ACME_TOKEN",
+                    "types": {"event": ["page"]},
+                },
+                {
+                    "name": "globex",
+                    "base_url": "http://127.0.0.1:8080/api/v1/",
+                    "token": "globex-token",
+                    "output_dir": "/var/log/globex",
+                },
+            ]
+        },
+    )
+
+    acme, globex = load_tenants(path)
+
+    assert acme.base_url == "https://acme.us.goskope.com/api/v1"
+    assert acme.token.auth_token == "acme-token"
+    assert acme.output_dir == os.path.join(str(tmpdir), "tenants", "acme")
+    assert globex.base_url == "http://127.0.0.1:8080/api/v1"
+    assert globex.token.auth_token == "globex-token"
+    assert globex.types is None
+    assert globex.output_dir == "/var/log/globex"
+
+    events = EventClient(start=1, end=2, **acme.client_kwargs())
+    alerts = AlertClient(start=1, end=2, **acme.client_kwargs())
+    assert events.url == "https://acme.us.goskope.com/api/v1/events"
+    assert events.type_list == ["page"]
+    assert events.tenant == "acme"
+    assert alerts.type_list == []
+
+
+@pytest.mark.parametrize(
+    "tenants",
+    [
+        [{"token": "x"}],
+        [{"name": "acme", "token": "x", "tokne_env": "ACME_TOKEN"}],
+        [{"name": "acme", "token": "x", "types": {"events": ["page"]}}],
+        [{"name": "acme", "token": "x"}, {"name": "acme", "token": "y"}],
+        [
+            {"name": "acme", "token": "x", "output_dir": "shared"},
+            {"name": "globex", "token": "y", "output_dir": "shared"},
+        ],
+        [{"name": "acme", "token_env": "NETSKOPE_TEST_UNSET_TOKEN"}],
+    ],
+)
+def test_load_tenants_rejects_bad_config(tmpdir, tenants):
+    """Tests to see if a tenant without a name or token, an unknown
+    setting or endpoint, a repeated name and a shared output directory
+    are refused.
+    """
+
+    with pytest.raises(ValueError):
+        load_tenants(_write_config(tmpdir, {"tenants": tenants}))
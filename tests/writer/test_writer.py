@@ -0,0 +1,117 @@
+"""Tests the classes/functions in netskope_fetcher.writer"""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+from netskope_fetcher.checkpoint import CheckpointStore
+from netskope_fetcher.writer import LogWriter
+
+
+@pytest.mark.asyncio
+async def test_write_page_appends_ndjson_to_type_file(tmpdir):
+    """Tests to see if LogWriter.write_page writes one json line per log
+    to logs/<endpoint>/<type>.log (spaces replaced with underscores).
+    """
+
+    writer = LogWriter(str(tmpdir))
+    await writer.write_page("alert", "Compromised Credential", [{"a": 1}])
+    await writer.write_page("alert", "Compromised Credential", [{"b": 2}, {"c": 3}])
+    await writer.drain()
+    writer.close()
+
+    log_file = os.path.join(str(tmpdir), "logs", "alert", "Compromised_Credential.log")
+    with open(log_file) as _f:
+        lines = [json.loads(line) for line in _f]
+
+    assert lines == [{"a": 1}, {"b": 2}, {"c": 3}]
+
+
+@pytest.mark.asyncio
+async def test_write_page_skips_empty_pages(tmpdir):
+    """Tests to see if an empty page doesn't create a log file."""
+
+    writer = LogWriter(str(tmpdir))
+    await writer.write_page("event", "page", [])
+    await writer.drain()
+    writer.close()
+
+    assert not os.path.exists(writer.log_file_path("event", "page"))
+
+
+@pytest.mark.asyncio
+async def test_recover_rolls_back_uncommitted_writes(tmpdir):
+    """Tests to see if a committed window survives LogWriter.recover
+    while logs appended after the last commit are truncated away.
+    """
+
+    checkpoints = CheckpointStore(os.path.join(str(tmpdir), "checkpoints.json"))
+    writer = LogWriter(str(tmpdir))
+
+    stage = writer.open_stage("event", "page", 0, 10)
+    await stage.write_page([{"a": 1}])
+    await writer.commit_stage(stage, checkpoints)
+
+    # Simulate a crash after an append but before its commit.
+    await writer.write_page("event", "page", [{"b": 2}])
+    leftover = writer.open_stage("event", "page", 10, 20)
+    await leftover.write_page([{"c": 3}])
+    await writer.drain()
+    writer.close()
+
+    writer.recover(checkpoints)
+
+    with open(writer.log_file_path("event", "page")) as _f:
+        assert [json.loads(line) for line in _f] == [{"a": 1}]
+    assert os.listdir(writer.staging_directory()) == []
+    assert checkpoints.pending_windows("event", "page", 0, 20) == [(10, 20)]
+
+
+@pytest.mark.asyncio
+async def test_full_queue_applies_backpressure(tmpdir):
+    """Tests to see if write_page waits once a type's queue is full and
+    that the queued pages are written in order.
+    """
+
+    writer = LogWriter(str(tmpdir), queue_size=2, batch_records=1)
+    pages = [[{"n": n}] for n in range(6)]
+
+    # Nothing is written until the loop lets the worker run, so the
+    # third page can't be queued.
+    await writer.write_page("event", "page", pages[0])
+    await writer.write_page("event", "page", pages[1])
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(
+            asyncio.shield(writer.write_page("event", "page", pages[2])), 0
+        )
+
+    for page in pages[3:]:
+        await writer.write_page("event", "page", page)
+    await writer.drain()
+    writer.close()
+
+    with open(writer.log_file_path("event", "page")) as _f:
+        assert [json.loads(line)["n"] for line in _f] == list(range(6))
+
+
+@pytest.mark.asyncio
+async def test_commit_waits_for_queued_pages(tmpdir):
+    """Tests to see if commit_stage only records the window once every
+    page queued for it is in the log file.
+    """
+
+    checkpoints = CheckpointStore(os.path.join(str(tmpdir), "checkpoints.json"))
+    writer = LogWriter(str(tmpdir), batch_records=1)
+
+    stage = writer.open_stage("event", "page", 0, 10)
+    for n in range(5):
+        await stage.write_page([{"n": n}])
+    await writer.commit_stage(stage, checkpoints)
+
+    log_file = writer.log_file_path("event", "page")
+    relative_log_file = os.path.relpath(log_file, str(tmpdir))
+    assert checkpoints.log_offset(relative_log_file) == os.path.getsize(log_file)
+    assert not os.path.exists(stage.path)
+    writer.close()